@@ -9,6 +9,7 @@ from six.moves import UserDict
 
 from .lexer import AssemblyLexer
 from .parser import AssemblyParser
+from .preprocessor import Preprocessor
 from .ast import FileNode, LabelNode, GlobalDirectiveNode, FileDirectiveNode, SectionDirectiveNode, DataSectionDirectiveNode, TextSectionDirectiveNode, SetDirectiveNode
 from .ast import StringNode, AsciiNode, SpaceNode, AlignNode, ByteNode, ShortNode, WordNode, InstructionNode, SourceLocation, ExpressionNode
 
@@ -361,11 +362,14 @@ def sizeof(o):
   return ctypes.sizeof(o)
 
 class AssemblerProcess(LoggingCapable, object):
-  def __init__(self, filepath, base_address = None, writable_sections = False, defines = None, includes = None, logger = None):
+  def __init__(self, filepath, base_address = None, writable_sections = False, defines = None, includes = None, cpp = False, preprocessor_cache = None, logger = None):
     super(AssemblerProcess, self).__init__(logger)
 
     self._filepath = filepath
 
+    self.cpp = cpp
+    self.preprocessor_cache = preprocessor_cache
+
     self.base_address = base_address or 0x00000000
     self.defines = defines or {}
     self.includes = includes or []
@@ -388,6 +392,12 @@ class AssemblerProcess(LoggingCapable, object):
     return cls(**kwargs)
 
   def preprocess(self):
+    if not self.cpp:
+      preprocessor = Preprocessor(includes = self.includes, defines = self.defines, cache = self.preprocessor_cache, logger = self._logger)
+
+      self.preprocessed = preprocessor.preprocess(self._filepath)
+      return
+
     includes = ['-I %s' % i for i in self.includes]
     defines = ['-D%s' % i for i in self.defines]
 
@@ -712,7 +722,9 @@ class AssemblerProcess(LoggingCapable, object):
     self.sections_pass3 = sections
 
   def translate(self):
-    self.preprocess()
+    if self.preprocessed is None:
+      self.preprocess()
+
     self.parse()
     self.pass1()
     self.pass2()
@@ -0,0 +1,223 @@
+"""
+Streaming disassembler of binary sections.
+
+Section payload is decoded in chunks of instructions, and each chunk is
+annotated with symbols and relocations before it is passed to the caller, so
+even large sections can be printed without building their complete listing
+in memory. Chunks can be decoded by a pool of worker processes, their order
+is preserved.
+"""
+
+import collections
+import struct
+
+from ..cpu.instructions import DuckyInstructionSet, INSTRUCTION_SETS, get_instruction_set
+from ..log import get_logger
+from ..mm import WORD_SIZE
+from ..mm.binary import SectionTypes
+from ..util import LoggingCapable, SymbolTable
+
+from ..cpu.coprocessor.math_copro import MathCoprocessorInstructionSet  # noqa - registers its instruction set
+
+#: Default number of instructions in one chunk.
+DEFAULT_CHUNK_SIZE = 4096
+
+#: Disassembled instruction.
+DisassembledInstruction = collections.namedtuple('DisassembledInstruction', ['address', 'raw', 'disassembly', 'symbol', 'relocations'])
+
+U32 = struct.Struct('<I')
+
+def unpack_words(payload, offset = 0, count = None):
+  if count is None:
+    count = (len(payload) - offset) // WORD_SIZE
+
+  return struct.unpack_from('<%iI' % count, payload, offset)
+
+def switch_instruction_set(instruction_set, word):
+  """
+  Find instruction set used after an instruction.
+
+  :param ducky.cpu.instructions.InstructionSet instruction_set: instruction
+    set the instruction belongs to.
+  :param u32_t word: encoded instruction.
+  :returns: instruction set of the next instruction.
+  """
+
+  opcode = word & 0x3F
+
+  if opcode != instruction_set.opcodes.SIS:
+    return instruction_set
+
+  inst = instruction_set.opcode_encoding_map[opcode].from_buffer_copy(U32.pack(word))
+
+  return INSTRUCTION_SETS.get(inst.immediate, instruction_set)
+
+class Disassembler(LoggingCapable, object):
+  """
+  Decoder of instructions. Text of each decoded instruction is remembered,
+  and when the same instruction is found again, it is not decoded anymore.
+  """
+
+  def __init__(self, logger):
+    super(Disassembler, self).__init__(logger)
+
+    self._cache = {}
+
+  def disassemble(self, instruction_set, word):
+    """
+    Disassemble one instruction.
+
+    :param ducky.cpu.instructions.InstructionSet instruction_set: instruction
+      set the instruction belongs to.
+    :param u32_t word: encoded instruction.
+    :returns: text of the instruction, or ``<unknown>`` when ``word`` is not
+      a valid instruction.
+    :rtype: str
+    """
+
+    key = (instruction_set.instruction_set_id, word)
+
+    text = self._cache.get(key)
+    if text is not None:
+      return text
+
+    opcode = word & 0x3F
+    desc = instruction_set.opcode_desc_map.get(opcode)
+
+    if desc is None:
+      text = '<unknown>'
+
+    else:
+      inst = instruction_set.opcode_encoding_map[opcode].from_buffer_copy(U32.pack(word))
+
+      mnemonic = desc.disassemble_mnemonic(inst)
+      operands = desc.disassemble_operands(self._logger, inst)
+
+      text = (mnemonic + ' ' + ', '.join(operands)) if operands else mnemonic
+
+    self._cache[key] = text
+    return text
+
+  def disassemble_chunk(self, payload, instruction_set_id):
+    """
+    Disassemble chunk of instructions.
+
+    :param bytearray payload: encoded instructions.
+    :param int instruction_set_id: instruction set of the first instruction.
+    :rtype: list of ``str``
+    """
+
+    instruction_set = get_instruction_set(instruction_set_id)
+    disassemble = self.disassemble
+
+    texts = []
+
+    for word in unpack_words(payload):
+      texts.append(disassemble(instruction_set, word))
+      instruction_set = switch_instruction_set(instruction_set, word)
+
+    return texts
+
+def split_chunks(payload, chunk_size, instruction_set_id = DuckyInstructionSet.instruction_set_id):
+  """
+  Split payload into chunks. Instruction set of each chunk is found by
+  following ``sis`` instructions, so chunks can be decoded independently.
+
+  :returns: list of ``(offset, count, instruction set id)`` tuples.
+  """
+
+  words = unpack_words(payload)
+  instruction_set = get_instruction_set(instruction_set_id)
+  chunks = []
+
+  for start in range(0, len(words), chunk_size):
+    chunk = words[start:start + chunk_size]
+    chunks.append((start * WORD_SIZE, len(chunk), instruction_set.instruction_set_id))
+
+    for word in chunk:
+      instruction_set = switch_instruction_set(instruction_set, word)
+
+  return chunks
+
+def get_relocations(binary, section):
+  """
+  Create index of relocations patching a section.
+
+  :returns: mapping between patched addresses and lists of symbol names.
+  :rtype: dict
+  """
+
+  relocations = collections.defaultdict(list)
+
+  for reloc_section in binary.sections:
+    if reloc_section.header.type != SectionTypes.RELOC:
+      continue
+
+    for entry in reloc_section.payload:
+      if entry.patch_section != section.index:
+        continue
+
+      relocations[entry.patch_address].append(binary.string_table.get_string(entry.name))
+
+  return relocations
+
+_WORKER_DISASSEMBLER = None
+
+def _disassemble_chunk_worker(chunk):
+  global _WORKER_DISASSEMBLER
+
+  if _WORKER_DISASSEMBLER is None:
+    _WORKER_DISASSEMBLER = Disassembler(get_logger())
+
+  return _WORKER_DISASSEMBLER.disassemble_chunk(*chunk)
+
+def disassemble_section(logger, binary, section, chunk_size = DEFAULT_CHUNK_SIZE, jobs = 1):
+  """
+  Disassemble executable section.
+
+  :param ducky.mm.binary.File binary: file the section belongs to.
+  :param ducky.mm.binary.Section section: section to disassemble.
+  :param int chunk_size: number of instructions in one chunk.
+  :param int jobs: if greater than one, chunks are decoded by a pool of
+    ``jobs`` worker processes.
+  :returns: iterator of chunks, lists of :py:class:`DisassembledInstruction`,
+    in the order of their addresses.
+  """
+
+  logger.debug('disassemble_section: section=%s, chunk_size=%s, jobs=%s', section.name, chunk_size, jobs)
+
+  payload = section.payload
+  base = section.header.base
+
+  symbol_table = SymbolTable(binary, section_filter = lambda symbol_section: symbol_section.index == section.index)
+  relocations = get_relocations(binary, section)
+
+  chunks = split_chunks(payload, chunk_size)
+  chunk_payloads = [(payload[offset:offset + count * WORD_SIZE], instruction_set_id) for offset, count, instruction_set_id in chunks]
+
+  pool = None
+
+  if jobs > 1 and len(chunks) > 1:
+    import multiprocessing
+
+    pool = multiprocessing.Pool(min(jobs, len(chunks)))
+    texts = pool.imap(_disassemble_chunk_worker, chunk_payloads)
+
+  else:
+    disassembler = Disassembler(logger)
+    texts = (disassembler.disassemble_chunk(*chunk) for chunk in chunk_payloads)
+
+  try:
+    for (offset, count, _), chunk_texts in zip(chunks, texts):
+      start = base + offset
+      end = start + count * WORD_SIZE
+
+      words = unpack_words(payload, offset, count)
+      symbols = symbol_table.walk(start, end, step = WORD_SIZE)
+
+      yield [DisassembledInstruction(address, word, text, symbol[0], relocations.get(address, [])) for address, word, text, symbol in zip(range(start, end, WORD_SIZE), words, chunk_texts, symbols)]
+
+  finally:
+    if pool is not None:
+      pool.terminate()
+      pool.join()
@@ -92,9 +92,24 @@ def t_error(t):
 
   raise AssemblyIllegalCharError(c = t.value[0], location = loc, line = t.lexer.parser.lineno_to_line(t.lineno))
 
+_LEXER = None
+
+def get_lexer():
+  """
+  Return new PLY lexer. Master lexer is built just once, and each caller gets
+  its clone, with its own input and position.
+  """
+
+  global _LEXER
+
+  if _LEXER is None:
+    _LEXER = ply.lex.lex()
+
+  return _LEXER.clone()
+
 class AssemblyLexer(object):
   def __init__(self):
-    self._lexer = ply.lex.lex()
+    self._lexer = get_lexer()
 
   def token(self, *args, **kwargs):
     return self._lexer.token(*args, **kwargs)
@@ -472,6 +472,22 @@ def p_error(t):
   from ..errors import AssemblyParseError
   raise AssemblyParseError(token = t, location = loc, line = t.lexer.parser.lineno_to_line(t.lineno))
 
+_PARSER = None
+
+def get_parser():
+  """
+  Return PLY parser. Parser tables are built just once, when the parser is
+  requested for the first time, and the parser is then shared by all
+  :py:class:`AssemblyParser` instances of the process.
+  """
+
+  global _PARSER
+
+  if _PARSER is None:
+    _PARSER = ply.yacc.yacc()
+
+  return _PARSER
+
 class AssemblyParser(object):
   def __init__(self, lexer, logger = None):
     self._lexer = lexer
@@ -479,7 +495,7 @@ class AssemblyParser(object):
 
     self.location = SourceLocation(filename = None, lineno = 0)
 
-    self._parser = ply.yacc.yacc()
+    self._parser = get_parser()
 
   def lexpos_to_lineno(self, lexpos):
     last_cr = self.input_text.rfind('\n', 0, lexpos)
@@ -0,0 +1,557 @@
+"""
+Built-in preprocessor of assembly sources.
+
+It implements the subset of C preprocessor used by assembly sources -
+``#include``, ``#define`` and ``#undef`` of object-like and function-like
+macros, including ``#`` and ``##`` operators, conditionals (``#if``,
+``#ifdef``, ``#ifndef``, ``#elif``, ``#else``, ``#endif``), and ``#error``.
+Output contains line markers, understood by assembler's parser, so locations
+of parsed nodes point to the original sources.
+"""
+
+import os
+import re
+
+from ..errors import PreprocessorError
+from ..util import LoggingCapable
+from .ast import SourceLocation
+
+#: Maximal depth of nested includes.
+MAX_INCLUDE_DEPTH = 200
+
+TOKEN_PATTERN = re.compile(r'''
+  \s+ |
+  [A-Za-z_]\w* |
+  \.?\d(?:[eEpP][+-]|[\w.])* |
+  "(?:\\.|[^"\\])*" |
+  '(?:\\.|[^'\\])*' |
+  \#\# |
+  .
+''', re.VERBOSE | re.DOTALL)
+
+COMMENT_PATTERN = re.compile(r'''"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|//[^\n]*|/\*.*?\*/''', re.DOTALL)
+DIRECTIVE_PATTERN = re.compile(r'^\s*#\s*([A-Za-z_]*)\s*(.*?)\s*$', re.DOTALL)
+DEFINE_PATTERN = re.compile(r'^([A-Za-z_]\w*)(?:\(([^)]*)\))?\s*(.*)$', re.DOTALL)
+INCLUDE_PATTERN = re.compile(r'^(?:"([^"]+)"|<([^>]+)>)$')
+IDENTIFIER_PATTERN = re.compile(r'^[A-Za-z_]\w*$')
+
+EXPRESSION_NUMBER_PATTERN = re.compile(r'\b(?:0[xX]([0-9a-fA-F]+)|(0[0-7]*)|([1-9]\d*))[uUlL]*\b')
+EXPRESSION_IDENTIFIER_PATTERN = re.compile(r'\b[A-Za-z_]\w*\b')
+EXPRESSION_OPERATORS = [
+  (re.compile(r'&&'), ' and '),
+  (re.compile(r'\|\|'), ' or '),
+  (re.compile(r'!(?!=)'), ' not '),
+  (re.compile(r'/'), '//')
+]
+
+def tokenize(text):
+  return TOKEN_PATTERN.findall(text)
+
+def strip_whitespace(tokens):
+  while tokens and tokens[0][0].isspace():
+    tokens = tokens[1:]
+
+  while tokens and tokens[-1][0].isspace():
+    tokens = tokens[:-1]
+
+  return tokens
+
+def parse_source(text):
+  """
+  Split source into logical lines: continued lines are joined, and comments
+  are removed.
+
+  :param str text: content of source file.
+  :returns: list of ``(lineno, count, directive, text)`` tuples, where
+    ``count`` is the number of physical lines of the logical line, and
+    ``directive`` is either ``None`` or ``(name, arguments)`` tuple.
+  """
+
+  physical_lines = text.split('\n')
+
+  if physical_lines and physical_lines[-1] == '':
+    physical_lines.pop()
+
+  linenos, counts, spliced = [], [], []
+
+  lineno = 0
+  while lineno < len(physical_lines):
+    start, parts = lineno, []
+
+    while True:
+      line = physical_lines[lineno].rstrip('\r')
+      lineno += 1
+
+      if not line.endswith('\\') or lineno >= len(physical_lines):
+        parts.append(line)
+        break
+
+      parts.append(line[:-1])
+
+    linenos.append(start + 1)
+    counts.append(lineno - start)
+    spliced.append(''.join(parts))
+
+  def __replace_comment(match):
+    comment = match.group(0)
+
+    if comment.startswith('//'):
+      return ''
+
+    if comment.startswith('/*'):
+      return ' ' + '\n' * comment.count('\n')
+
+    return comment
+
+  logical_lines = COMMENT_PATTERN.sub(__replace_comment, '\n'.join(spliced)).split('\n')
+
+  lines = []
+
+  for lineno, count, line in zip(linenos, counts, logical_lines):
+    match = DIRECTIVE_PATTERN.match(line)
+
+    lines.append((lineno, count, (match.group(1), match.group(2)) if match else None, line))
+
+  return lines
+
+class SourceCache(object):
+  """
+  Cache of parsed source files, shared by all sources preprocessed by one
+  assembler run, so often included files are read and parsed just once.
+  Cached file is parsed again when its mtime changes.
+  """
+
+  def __init__(self):
+    self._files = {}
+
+  def get_lines(self, path):
+    """
+    Return logical lines of a source file.
+
+    :param str path: path to the file.
+    :rtype: ``list``, see :py:func:`parse_source`.
+    """
+
+    mtime = os.path.getmtime(path)
+    entry = self._files.get(path)
+
+    if entry is None or entry[0] != mtime:
+      with open(path, 'r') as f:
+        entry = self._files[path] = (mtime, parse_source(f.read()))
+
+    return entry[1]
+
+class Macro(object):
+  """
+  Macro definition.
+
+  Body of function-like macro is split into a substitution plan just once,
+  when the macro is defined, so it is not necessary to search for parameters
+  and operators each time the macro is expanded. Each item of the plan is
+  a ``(kind, value)`` tuple, where kind is one of ``token`` (copy the token),
+  ``stringify`` (``#`` applied to an argument), ``raw`` (argument used as an
+  operand of ``##``) and ``expand`` (argument, expanded before substitution).
+  """
+
+  __slots__ = ('name', 'params', 'variadic', 'body', 'plan')
+
+  def __init__(self, name, params, body):
+    self.name = name
+    self.variadic = params is not None and len(params) > 0 and params[-1] == '...'
+
+    if self.variadic:
+      params = params[:-1] + ['__VA_ARGS__']
+
+    self.params = params
+    self.body = body
+    self.plan = self._create_plan() if params is not None else None
+
+  def _create_plan(self):
+    body = self.body
+    params = dict([(param, i) for i, param in enumerate(self.params)])
+
+    def __neighbour(i, step):
+      i += step
+
+      while 0 <= i < len(body) and body[i].isspace():
+        i += step
+
+      return i if 0 <= i < len(body) else None
+
+    plan = []
+
+    i = 0
+    while i < len(body):
+      token = body[i]
+
+      if token == '#':
+        j = __neighbour(i, 1)
+
+        if j is not None and body[j] in params:
+          plan.append(('stringify', params[body[j]]))
+          i = j + 1
+          continue
+
+      if token in params:
+        previous, following = __neighbour(i, -1), __neighbour(i, 1)
+
+        if (previous is not None and body[previous] == '##') or (following is not None and body[following] == '##'):
+          plan.append(('raw', params[token]))
+
+        else:
+          plan.append(('expand', params[token]))
+
+      else:
+        plan.append(('token', token))
+
+      i += 1
+
+    return plan
+
+  def __repr__(self):
+    return '<Macro: name=%s, params=%s, body=%s>' % (self.name, self.params, ''.join(self.body))
+
+class Preprocessor(LoggingCapable, object):
+  """
+  Preprocessor of one source file.
+
+  :param list includes: directories searched for included files.
+  :param list defines: predefined macros, either ``NAME`` or ``NAME=VALUE``.
+  :param SourceCache cache: cache of parsed files. If not set, private cache
+    is used.
+  """
+
+  def __init__(self, includes = None, defines = None, cache = None, logger = None):
+    super(Preprocessor, self).__init__(logger)
+
+    self.includes = includes or []
+    self.cache = cache or SourceCache()
+
+    self.macros = {}
+
+    for define in defines or []:
+      name, _, value = define.partition('=')
+      self.macros[name] = Macro(name, None, tokenize(value or '1'))
+
+  def preprocess(self, filepath):
+    """
+    Preprocess a source file.
+
+    :param str filepath: path to the source file.
+    :returns: preprocessed source.
+    :rtype: str
+    """
+
+    output = []
+
+    self._process_file(filepath, output, 0)
+
+    output.append('')
+    return '\n'.join(output)
+
+  def _error(self, path, lineno, line, info):
+    return PreprocessorError(location = SourceLocation(filename = path, lineno = lineno), line = line, info = info)
+
+  def _find_include(self, path, lineno, line, argument):
+    match = INCLUDE_PATTERN.match(argument)
+
+    if match is None:
+      match = INCLUDE_PATTERN.match(''.join(token for token, _ in self._expand([(token, frozenset()) for token in tokenize(argument)])).strip())
+
+    if match is None:
+      raise self._error(path, lineno, line, '#include expects "FILENAME" or <FILENAME>')
+
+    quoted, name = match.group(1) is not None, match.group(1) or match.group(2)
+
+    directories = ([os.path.dirname(path)] if quoted else []) + self.includes
+
+    for directory in directories:
+      candidate = os.path.join(directory, name)
+
+      if os.path.isfile(candidate):
+        return candidate
+
+    raise self._error(path, lineno, line, 'No such file: %s' % name)
+
+  def _process_file(self, path, output, depth):
+    if depth > MAX_INCLUDE_DEPTH:
+      raise PreprocessorError(location = SourceLocation(filename = path), info = 'Too many nested includes')
+
+    self.DEBUG('%s._process_file: path=%s', self.__class__.__name__, path)
+
+    output.append('# 1 "%s"' % path)
+
+    # Each entry: [parent is active, this branch is active, some branch was taken]
+    conditionals = []
+
+    for lineno, count, directive, line in self.cache.get_lines(path):
+      active = conditionals[-1][1] if conditionals else True
+
+      if directive is None:
+        if not active:
+          output += [''] * count
+          continue
+
+        tokens = tokenize(line)
+
+        # Most lines contain no macros at all
+        if any(token in self.macros for token in tokens):
+          line = ''.join(token for token, _ in self._expand([(token, frozenset()) for token in tokens], path = path, lineno = lineno, line = line))
+
+        output.append(line)
+        output += [''] * (count - 1)
+        continue
+
+      name, argument = directive
+
+      if name in ('if', 'ifdef', 'ifndef'):
+        if not active:
+          conditionals.append([False, False, True])
+
+        else:
+          if name == 'if':
+            value = self._evaluate(argument, path, lineno, line)
+
+          else:
+            value = (argument.split()[0] in self.macros) if argument else False
+
+            if name == 'ifndef':
+              value = not value
+
+          conditionals.append([True, value, value])
+
+      elif name in ('elif', 'else', 'endif'):
+        if not conditionals:
+          raise self._error(path, lineno, line, '#%s without #if' % name)
+
+        conditional = conditionals[-1]
+
+        if name == 'endif':
+          conditionals.pop()
+
+        elif name == 'else':
+          conditional[1] = conditional[0] and not conditional[2]
+          conditional[2] = True
+
+        elif not conditional[0] or conditional[2]:
+          conditional[1] = False
+
+        else:
+          conditional[1] = conditional[2] = self._evaluate(argument, path, lineno, line)
+
+      elif not active:
+        pass
+
+      elif name == 'define':
+        self._define(argument, path, lineno, line)
+
+      elif name == 'undef':
+        self.macros.pop(argument.strip(), None)
+
+      elif name == 'include':
+        self._process_file(self._find_include(path, lineno, line, argument), output, depth + 1)
+        output.append('# %i "%s"' % (lineno + count, path))
+        continue
+
+      elif name == 'error':
+        raise self._error(path, lineno, line, '#error %s' % argument)
+
+      elif name == 'warning':
+        self.WARN('%s:%s: #warning %s', path, lineno, argument)
+
+      elif name not in ('', 'pragma', 'line', 'ident'):
+        raise self._error(path, lineno, line, 'Invalid directive #%s' % name)
+
+      output += [''] * count
+
+    if conditionals:
+      raise PreprocessorError(location = SourceLocation(filename = path), info = 'Unterminated conditional directive')
+
+  def _define(self, argument, path, lineno, line):
+    match = DEFINE_PATTERN.match(argument)
+
+    if match is None:
+      raise self._error(path, lineno, line, 'Invalid macro definition')
+
+    name, params, body = match.groups()
+
+    if params is not None:
+      params = [param.strip() for param in params.split(',')] if params.strip() else []
+
+    self.macros[name] = Macro(name, params, [token for token, _ in strip_whitespace([(token, None) for token in tokenize(body)])])
+
+  def _evaluate(self, expression, path, lineno, line):
+    tokens = tokenize(expression)
+    resolved = []
+
+    # "defined" operator must be resolved before macro expansion
+    i = 0
+    while i < len(tokens):
+      if tokens[i] != 'defined':
+        resolved.append(tokens[i])
+        i += 1
+        continue
+
+      operands = [token for token in tokens[i + 1:i + 5] if not token.isspace()]
+
+      if operands and operands[0] == '(':
+        name, end = operands[1], tokens.index(')', i + 1)
+
+      else:
+        name, end = operands[0], tokens.index(operands[0], i + 1)
+
+      resolved.append('1' if name in self.macros else '0')
+      i = end + 1
+
+    expression = ''.join(token for token, _ in self._expand([(token, frozenset()) for token in resolved], path = path, lineno = lineno, line = line))
+
+    def __number(match):
+      hexadecimal, octal, decimal = match.groups()
+
+      if hexadecimal is not None:
+        return str(int(hexadecimal, 16))
+
+      if octal is not None:
+        return str(int(octal, 8))
+
+      return decimal
+
+    expression = EXPRESSION_NUMBER_PATTERN.sub(__number, expression)
+    expression = EXPRESSION_IDENTIFIER_PATTERN.sub('0', expression)
+
+    for pattern, replacement in EXPRESSION_OPERATORS:
+      expression = pattern.sub(replacement, expression)
+
+    try:
+      return bool(eval(expression, {'__builtins__': {}}))
+
+    except Exception as e:
+      raise self._error(path, lineno, line, 'Cannot evaluate expression: %s' % e)
+
+  def _expand(self, tokens, path = None, lineno = None, line = None):
+    """
+    Expand macros.
+
+    :param list tokens: list of ``(token, hide set)`` tuples. Hide set
+      contains names of macros that must not be expanded in the token,
+      because the token is a result of their expansion.
+    :rtype: list of ``(token, hide set)`` tuples.
+    """
+
+    macros = self.macros
+    expanded = []
+    pending = tokens[::-1]
+
+    while pending:
+      token, hide = pending.pop()
+
+      macro = macros.get(token)
+
+      if macro is None or token in hide:
+        expanded.append((token, hide))
+        continue
+
+      if macro.params is None:
+        body = self._paste(macro.body)
+
+      else:
+        i = len(pending) - 1
+        while i >= 0 and pending[i][0].isspace():
+          i -= 1
+
+        if i < 0 or pending[i][0] != '(':
+          expanded.append((token, hide))
+          continue
+
+        del pending[i:]
+
+        body = self._substitute(macro, self._collect_arguments(macro, pending, path, lineno, line), path, lineno, line)
+
+      hide = hide | frozenset([token])
+      pending += [(body_token, hide) for body_token in reversed(body)]
+
+    return expanded
+
+  def _collect_arguments(self, macro, pending, path, lineno, line):
+    arguments = [[]]
+    depth = 0
+
+    while pending:
+      token = pending.pop()
+
+      if token[0] == '(':
+        depth += 1
+
+      elif token[0] == ')':
+        if depth == 0:
+          break
+
+        depth -= 1
+
+      elif token[0] == ',' and depth == 0 and not (macro.variadic and len(arguments) == len(macro.params)):
+        arguments.append([])
+        continue
+
+      arguments[-1].append(token)
+
+    else:
+      raise self._error(path, lineno, line, 'Unterminated argument list invoking macro %s' % macro.name)
+
+    arguments = [strip_whitespace(argument) for argument in arguments]
+
+    if len(macro.params) == 0 and arguments == [[]]:
+      return []
+
+    if macro.variadic and len(arguments) == len(macro.params) - 1:
+      arguments.append([])
+
+    if len(arguments) != len(macro.params):
+      raise self._error(path, lineno, line, 'Macro %s requires %i arguments, but %i given' % (macro.name, len(macro.params), len(arguments)))
+
+    return arguments
+
+  def _substitute(self, macro, arguments, path, lineno, line):
+    substituted = []
+
+    for kind, value in macro.plan:
+      if kind == 'token':
+        substituted.append(value)
+
+      elif kind == 'expand':
+        substituted += [token for token, _ in self._expand(arguments[value], path = path, lineno = lineno, line = line)]
+
+      elif kind == 'raw':
+        substituted += [token for token, _ in arguments[value]] or ['']
+
+      else:
+        text = ' '.join(''.join(token for token, _ in arguments[value]).split())
+        substituted.append('"%s"' % text.replace('\\', '\\\\').replace('"', '\\"'))
+
+    return self._paste(substituted)
+
+  def _paste(self, tokens):
+    if '##' not in tokens:
+      return tokens
+
+    pasted = []
+
+    i = 0
+    while i < len(tokens):
+      token = tokens[i]
+
+      if token != '##':
+        pasted.append(token)
+        i += 1
+        continue
+
+      while pasted and pasted[-1].isspace():
+        pasted.pop()
+
+      i += 1
+      while i < len(tokens) and tokens[i].isspace():
+        i += 1
+
+      pasted.append((pasted.pop() if pasted else '') + (tokens[i] if i < len(tokens) else ''))
+      i += 1
+
+    return [token for token in pasted if token != '']
@@ -5,18 +5,21 @@ when compared to real hardware process, since e.g. external files can be mmap-ed
 into VM's memory for writing.
 """
 
+import hashlib
 import importlib
 import mmap
+import os
+import weakref
 
 from functools import partial
 from ctypes import sizeof
-from six import PY2
+from six import PY2, itervalues
 
 from .interfaces import IMachineWorker
 
 from .errors import InvalidResourceError
 from .util import align, BinaryFile
-from .mm import u8_t, u16_t, u32_t, UINT32_FMT, PAGE_SIZE, area_to_pages, PAGE_MASK, ExternalMemoryPage
+from .mm import u8_t, u16_t, u32_t, UINT32_FMT, PAGE_SIZE, area_to_pages, PAGE_MASK, MemoryPage, AnonymousMemoryPage, ExternalMemoryPage
 from .mm.binary import SectionFlags, File
 from .snapshot import SnapshotNode
 from .hdt import HDT, HDTEntry_Argument, HDTEntry_Device
@@ -117,6 +120,142 @@ class MMapMemoryPage(ExternalMemoryPage):
 
     self.data[self.offset + offset] = b
 
+class SharedMemoryPage(AnonymousMemoryPage):
+  """
+  Memory page with content shared by all machines that loaded the same
+  binary - see :py:class:`ducky.boot.ImageCache`. Shared content is never
+  modified, the first write gives the page its own private copy.
+
+  :param bytearray data: shared content of the page.
+  """
+
+  def __init__(self, controller, index, data):
+    # Skip AnonymousMemoryPage.__init__, there is no need for a private array
+    MemoryPage.__init__(self, controller, index)
+
+    self.data = data
+    self.shared = True
+
+  def __repr__(self):
+    return '<%s index=%i, base=%s, shared=%s>' % (self.__class__.__name__, self.index, UINT32_FMT(self.base_address), self.shared)
+
+  def unshare(self):
+    """
+    Replace shared content by a private copy.
+    """
+
+    self.DEBUG('%s.unshare: page=%s', self.__class__.__name__, self.index)
+
+    self.data = bytearray(self.data)
+    self.shared = False
+
+  def load_state(self, state):
+    if self.shared:
+      if state.content[0:PAGE_SIZE] == self.data:
+        return
+
+      self.unshare()
+
+    super(SharedMemoryPage, self).load_state(state)
+
+  def clear(self):
+    if self.shared:
+      self.unshare()
+
+    super(SharedMemoryPage, self).clear()
+
+  def write_u8(self, offset, value):
+    if self.shared:
+      self.unshare()
+
+    super(SharedMemoryPage, self).write_u8(offset, value)
+
+  def write_u16(self, offset, value):
+    if self.shared:
+      self.unshare()
+
+    super(SharedMemoryPage, self).write_u16(offset, value)
+
+  def write_u32(self, offset, value):
+    if self.shared:
+      self.unshare()
+
+    super(SharedMemoryPage, self).write_u32(offset, value)
+
+  def write_bytes(self, offset, data):
+    if self.shared:
+      self.unshare()
+
+    super(SharedMemoryPage, self).write_bytes(offset, data)
+
+class SharedImage(object):
+  """
+  Content of read-only sections of one binary, split into pages that are
+  shared by all machines loading this binary.
+
+  :param str file_path: real path of the binary.
+  :param str digest: hash of binary's content.
+  """
+
+  def __init__(self, file_path, digest):
+    self.file_path = file_path
+    self.digest = digest
+
+    self.sections = {}  # section index: list of pages' content
+
+  def __repr__(self):
+    return '<%s: file=%s, digest=%s>' % (self.__class__.__name__, self.file_path, self.digest)
+
+  def get_pages(self, section):
+    """
+    Return content of section's pages. Content is created when section is
+    requested for the first time, the last page is padded with zeros.
+
+    :param ducky.mm.binary.Section section: loaded section.
+    :rtype: ``list`` of ``bytearray``
+    """
+
+    if section.index not in self.sections:
+      payload = bytearray(section.payload)
+      payload += bytearray(align(PAGE_SIZE, len(payload)) - len(payload))
+
+      self.sections[section.index] = [payload[i:i + PAGE_SIZE] for i in range(0, len(payload), PAGE_SIZE)]
+
+    return self.sections[section.index]
+
+class ImageCache(object):
+  """
+  Process-wide cache of shared images, keyed by binary's path and hash of its
+  content. Image stays in cache as long as there is a machine using it.
+  """
+
+  def __init__(self):
+    self.images = weakref.WeakValueDictionary()
+
+  def get_image(self, file_path):
+    """
+    Return shared image of a binary, create new one if there is no image
+    of the same binary yet.
+
+    :param str file_path: path to binary.
+    :rtype: ducky.boot.SharedImage
+    """
+
+    with open(file_path, 'rb') as f:
+      digest = hashlib.sha1(f.read()).hexdigest()
+
+    key = (os.path.realpath(file_path), digest)
+
+    image = self.images.get(key)
+
+    if image is None:
+      image = self.images[key] = SharedImage(*key)
+
+    return image
+
+#: Images shared by all machines running in this process.
+IMAGE_CACHE = ImageCache()
+
 class MMapAreaState(SnapshotNode):
   def __init__(self):
     super(MMapAreaState, self).__init__('address', 'size', 'path', 'offset')
@@ -134,9 +273,10 @@ class MMapArea(object):
   :param int pages_start: first page of the area.
   :param int pages_cnt: number of pages in the area.
   :param mm.binary.SectionFlags flags: flags applied to this area.
+  :param bool shared: if ``True``, area is mmaped as shared.
   """
 
-  def __init__(self, ptr, address, size, file_path, offset, pages_start, pages_cnt, flags):
+  def __init__(self, ptr, address, size, file_path, offset, pages_start, pages_cnt, flags, shared = False):
     super(MMapArea, self).__init__()
 
     self.ptr = ptr
@@ -148,9 +288,10 @@ class MMapArea(object):
     self.pages_start = pages_start
     self.pages_cnt = pages_cnt
     self.flags = flags
+    self.shared = shared
 
   def __repr__(self):
-    return '<MMapArea: address=%s, size=%s, filepath=%s, pages-start=%s, pages-cnt=%i, flags=%s>' % (UINT32_FMT(self.address), self.size, self.file_path, self.pages_start, self.pages_cnt, self.flags.to_string())
+    return '<MMapArea: address=%s, size=%s, filepath=%s, pages-start=%s, pages-cnt=%i, flags=%s, shared=%s>' % (UINT32_FMT(self.address), self.size, self.file_path, self.pages_start, self.pages_cnt, self.flags.to_string(), self.shared)
 
   def save_state(self, parent):
     pass
@@ -170,16 +311,23 @@ class ROMLoader(IMachineWorker):
 
     self.opened_mmap_files = {}  # path: (cnt, file)
     self.mmap_areas = {}
+    self.shared_images = []
 
     self.logger = self.machine.LOGGER
     self.DEBUG = self.machine.DEBUG
 
-  def _get_mmap_fileno(self, file_path):
+  def _get_mmap_fileno(self, file_path, writable = True):
     if file_path not in self.opened_mmap_files:
-      self.opened_mmap_files[file_path] = [0, open(file_path, 'r+b')]
+      self.opened_mmap_files[file_path] = [0, open(file_path, 'r+b' if writable else 'rb')]
 
     desc = self.opened_mmap_files[file_path]
 
+    # mmap keeps its own duplicate of the descriptor, existing areas are
+    # not affected when the file is reopened
+    if writable and '+' not in desc[1].mode:
+      desc[1].close()
+      desc[1] = open(file_path, 'r+b')
+
     desc[0] += 1
     return desc[1].fileno()
 
@@ -201,7 +349,8 @@ class ROMLoader(IMachineWorker):
       should reflect.
     :param u24 address: address where new area should start.
     :param u24 size: length of area, in bytes.
-    :param int offset: starting point of the area in mmaped file.
+    :param int offset: starting point of the area in mmaped file. Must be
+      multiple of :py:data:`mmap.ALLOCATIONGRANULARITY`.
     :param ducky.mm.binary.SectionFlags flags: specifies required flags for mmaped
       pages.
     :param bool shared: if ``True``, content of external file is mmaped as
@@ -240,14 +389,15 @@ class ROMLoader(IMachineWorker):
     # limitation is not possible to overcome.
     mmap_prot = mmap.PROT_READ | mmap.PROT_WRITE
 
+    # Private mapping never writes into the file, read access is enough
     ptr = mmap.mmap(
-      self._get_mmap_fileno(file_path),
+      self._get_mmap_fileno(file_path, writable = shared),
       size,
       flags = mmap_flags,
       prot = mmap_prot,
       offset = offset)
 
-    area = MMapArea(ptr, address, size, file_path, ptr, pages_start, pages_cnt, flags)
+    area = MMapArea(ptr, address, size, file_path, offset, pages_start, pages_cnt, flags, shared = shared)
 
     for i in range(pages_start, pages_start + pages_cnt):
       mc.register_page(MMapMemoryPage(area, mc, i, ptr, offset = (i - pages_start) * PAGE_SIZE))
@@ -256,7 +406,14 @@ class ROMLoader(IMachineWorker):
 
     return area
 
-  def unmmap_area(self, mmap_area):
+  def unmmap_area(self, mmap_area, close = True):
+    """
+    Remove mmap area from memory.
+
+    :param bool close: if not set, mmap object is not closed explicitly, and
+      its pages can be still read by their remaining holders.
+    """
+
     mc = self.machine.memory
 
     for pg in mc.get_pages(pages_start = mmap_area.pages_start, pages_cnt = mmap_area.pages_cnt):
@@ -264,10 +421,36 @@ class ROMLoader(IMachineWorker):
 
     del self.mmap_areas[mmap_area.address]
 
-    mmap_area.ptr.close()
+    if close is True:
+      mmap_area.ptr.close()
 
     self._put_mmap_fileno(mmap_area.file_path)
 
+  def forked(self):
+    """
+    Changes made by a clone must not reach the external file, and other
+    clones, therefore content of every shared area is copied into
+    a private, anonymous mmap.
+    """
+
+    self.DEBUG('%s.forked', self.__class__.__name__)
+
+    mc = self.machine.memory
+
+    for area in itervalues(self.mmap_areas):
+      if not area.shared:
+        continue
+
+      ptr = mmap.mmap(-1, area.size)
+      ptr[:] = area.ptr[:]
+
+      for pg in mc.get_pages(pages_start = area.pages_start, pages_cnt = area.pages_cnt):
+        pg.data = ptr
+
+      area.ptr.close()
+      area.ptr = ptr
+      area.shared = False
+
   def setup_hdt(self):
     """
     Initialize memory area containing :ref:`HDT`.
@@ -342,8 +525,7 @@ class ROMLoader(IMachineWorker):
 
       __alloc_pages(len(img))
 
-      for address, b in zip(range(hdt_address, hdt_address + len(img)), img):
-        self.machine.memory.write_u8(address, b)
+      self.machine.memory.write_bytes(hdt_address, img)
 
   def setup_mmaps(self):
     self.DEBUG('%s.setup_mmaps', self.__class__.__name__)
@@ -400,6 +582,9 @@ class ROMLoader(IMachineWorker):
     base = DEFAULT_BOOTLOADER_ADDRESS if base is None else base
     mc = self.machine.memory
 
+    file_size = os.path.getsize(filepath)
+    image = None
+
     with File.open(self.machine.LOGGER, filepath, 'r') as f:
       for section in f.sections:
         self.DEBUG('%s.setup_bootloader: section=%s, base=%s', self.__class__.__name__, section.name, UINT32_FMT(section.header.base))
@@ -411,8 +596,30 @@ class ROMLoader(IMachineWorker):
         section_base = base + section.header.base
         self.DEBUG('%s.setup_bootloader:   place to %s', self.__class__.__name__, UINT32_FMT(section_base))
 
+        if self._is_mmapable_section(section, section_base, file_size):
+          self.DEBUG('%s.setup_bootloader: read-only, aligned section, mmap it', self.__class__.__name__)
+
+          size = align(PAGE_SIZE, section.header.data_size)
+          area = self.mmap_area(filepath, section_base, size, offset = section.header.offset, flags = SectionFlags.from_encoding(section.header.flags))
+
+          # Private mapping, the file is not modified
+          area.ptr[section.header.data_size:size] = bytes(bytearray(size - section.header.data_size))
+          continue
+
         pages_start, pages_cnt = area_to_pages(section_base, section.header.data_size)
 
+        if self._is_shareable_section(section, section_base):
+          self.DEBUG('%s.setup_bootloader: read-only, aligned section, share it', self.__class__.__name__)
+
+          if image is None:
+            image = IMAGE_CACHE.get_image(filepath)
+            self.shared_images.append(image)
+
+          for i, data in enumerate(image.get_pages(section)):
+            mc.register_page(SharedMemoryPage(mc, pages_start + i, data))
+
+          continue
+
         for i in range(pages_start, pages_start + pages_cnt):
           mc.alloc_specific_page(i)
 
@@ -420,9 +627,41 @@ class ROMLoader(IMachineWorker):
           self.DEBUG('%s.setup_bootloader: BSS section, allocating pages is good enough', self.__class__.__name__)
           continue
 
-        for b in section.payload:
-          self.machine.memory.write_u8(section_base, b)
-          section_base += 1
+        mc.write_bytes(section_base, section.payload)
+
+  def _is_mmapable_section(self, section, section_base, file_size):
+    """
+    Check whether section can be mmaped directly from its binary file. Only
+    read-only sections with content can be mmaped, their address in memory
+    must be page-aligned, their offset in file must be aligned to
+    :py:data:`mmap.ALLOCATIONGRANULARITY`, and file must contain all pages
+    of such section - see ``--mmapable-sections`` option of assembler and
+    linker.
+    """
+
+    if not self._is_shareable_section(section, section_base):
+      return False
+
+    header = section.header
+
+    if header.offset % mmap.ALLOCATIONGRANULARITY != 0:
+      return False
+
+    return header.offset + align(PAGE_SIZE, header.data_size) <= file_size
+
+  def _is_shareable_section(self, section, section_base):
+    """
+    Check whether section's pages can be shared with other machines that load
+    the same binary. Only read-only sections with content can be shared, and
+    their address in memory must be page-aligned.
+    """
+
+    header = section.header
+
+    if header.flags.writable == 1 or header.flags.bss == 1 or header.data_size == 0:
+      return False
+
+    return section_base % PAGE_SIZE == 0
 
   def poke(self, address, value, length):
     self.DEBUG('%s.poke: addr=%s, value=%s, length=%s', self.__class__.__name__, UINT32_FMT(address), UINT32_FMT(value), length)
@@ -449,5 +688,9 @@ class ROMLoader(IMachineWorker):
   def halt(self):
     self.DEBUG('%s.halt', self.__class__.__name__)
 
+    # Machine's lazy last_state may still reference pages of these areas, mmap
+    # objects are closed once the last of their pages is released.
     for area in list(self.mmap_areas.values()):
-      self.unmmap_area(area)
+      self.unmmap_area(area, close = False)
+
+    self.shared_images = []
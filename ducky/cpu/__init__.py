@@ -12,7 +12,7 @@ from .. import profiler
 from ..interfaces import IMachineWorker, ISnapshotable
 from ..mm import UINT8_FMT, UINT16_FMT, UINT32_FMT, PAGE_SIZE, PAGE_MASK, PAGE_SHIFT, PageTableEntry, UINT64_FMT, WORD_SIZE
 from .registers import Registers, REGISTER_NAMES
-from .instructions import DuckyInstructionSet, EncodingContext
+from .instructions import DuckyInstructionSet, EncodingContext, get_instruction_set
 from ..errors import ExceptionList, AccessViolationError, InvalidResourceError, ExecutionException, InvalidOpcodeError, MemoryAccessError, InvalidExceptionError, PrivilegedInstructionError, InvalidFrameError, UnalignedAccessError
 from ..util import LoggingCapable, Flags
 from ..snapshot import SnapshotNode
@@ -35,7 +35,7 @@ class CPUState(SnapshotNode):
 
 class CPUCoreState(SnapshotNode):
   def __init__(self):
-    super(CPUCoreState, self).__init__('cpuid', 'coreid', 'registers', 'exit_code', 'alive', 'running', 'idle', 'evt_address', 'pt_address', 'pt_enabled', 'flags')
+    super(CPUCoreState, self).__init__('cpuid', 'coreid', 'registers', 'exit_code', 'alive', 'running', 'idle', 'evt_address', 'pt_address', 'pt_enabled', 'flags', 'instruction_set', 'instruction_set_stack')
 
 class InterruptVector(object):
   """
@@ -285,6 +285,29 @@ class MMU(ISnapshotable):
 
     self.core.debug.post_memory(args[0], read = False)
 
+  def _debug_wrap(self, wrapper, method, watched_pages):
+    """
+    Wrap memory-access method with a debugging wrapper. Only accesses to
+    pages with a memory watchpoint are passed to the wrapper, others go
+    directly to ``method``.
+
+    :param wrapper: ``_debug_wrapper_read`` or ``_debug_wrapper_write``.
+    :param method: memory-access method.
+    :param set watched_pages: indices of watched pages, or ``None`` when all
+      accesses must be passed to the wrapper.
+    """
+
+    if watched_pages is None:
+      return partial(wrapper, method)
+
+    def __debug_access(addr, *args, **kwargs):
+      if (addr >> PAGE_SHIFT) not in watched_pages:
+        return method(addr, *args, **kwargs)
+
+      return wrapper(method, addr, *args, **kwargs)
+
+    return __debug_access
+
   def _set_access_methods(self):
     """
     Set parent core's memory-access methods to proper shortcuts. Methods named
@@ -302,12 +325,14 @@ class MMU(ISnapshotable):
       self.core.MEM_OUT32 = getattr(self, '_' + set_name + '_write_u32')
 
     def __wrap_debug():
-      self.core.MEM_IN8   = partial(self._debug_wrapper_read,  self.core.MEM_IN8)
-      self.core.MEM_IN16  = partial(self._debug_wrapper_read,  self.core.MEM_IN16)
-      self.core.MEM_IN32  = partial(self._debug_wrapper_read,  self.core.MEM_IN32)
-      self.core.MEM_OUT8  = partial(self._debug_wrapper_write, self.core.MEM_OUT8)
-      self.core.MEM_OUT16 = partial(self._debug_wrapper_write, self.core.MEM_OUT16)
-      self.core.MEM_OUT32 = partial(self._debug_wrapper_write, self.core.MEM_OUT32)
+      watched_pages = None if self.core.debug.watches_all_pages() else self.core.debug.watched_pages
+
+      self.core.MEM_IN8   = self._debug_wrap(self._debug_wrapper_read,  self.core.MEM_IN8,   watched_pages)
+      self.core.MEM_IN16  = self._debug_wrap(self._debug_wrapper_read,  self.core.MEM_IN16,  watched_pages)
+      self.core.MEM_IN32  = self._debug_wrap(self._debug_wrapper_read,  self.core.MEM_IN32,  watched_pages)
+      self.core.MEM_OUT8  = self._debug_wrap(self._debug_wrapper_write, self.core.MEM_OUT8,  watched_pages)
+      self.core.MEM_OUT16 = self._debug_wrap(self._debug_wrapper_write, self.core.MEM_OUT16, watched_pages)
+      self.core.MEM_OUT32 = self._debug_wrap(self._debug_wrapper_write, self.core.MEM_OUT32, watched_pages)
 
     if self._pt_enabled is True:
       __set_methods('pt')
@@ -315,7 +340,7 @@ class MMU(ISnapshotable):
     else:
       __set_methods('nopt')
 
-    if self.core.debug is not None:
+    if self.core.debug is not None and self.core.debug.has_memory_points():
       __wrap_debug()
 
     self._instruction_cache.fetch_instr = self._fetch_instr_jit if self.core.jit is True else self._fetch_instr
@@ -668,27 +693,49 @@ class CPUCore(ISnapshotable, IMachineWorker):
     state.alive = self.alive
     state.running = self.running
 
+    state.instruction_set = self.instruction_set.instruction_set_id
+    state.instruction_set_stack = [inst_set.instruction_set_id for inst_set in self.instruction_set_stack]
+
     if self.has_coprocessor('math'):
       self.math_coprocessor.save_state(state)
 
   def load_state(self, state):
+    """
+    Restore core from a snapshot. Core is expected to be already booted, and
+    it is halted, suspended or put to sleep when its saved state says so.
+    """
+
+    self.mmu.reset()
+
     self.flags = CoreFlags.from_int(state.flags)
 
-    for i, reg in enumerate(REGISTER_NAMES):
-      self.registers[reg] = state.registers[i]
+    for i, _ in enumerate(REGISTER_NAMES):
+      self.registers[i] = state.registers[i]
+
+    self.current_ip = self.registers[Registers.IP]
 
     self.evt_address = state.evt_address
     self.mmu.pt_address = state.pt_address
     self.mmu.pt_enabled = state.pt_enabled
 
+    self.instruction_set = get_instruction_set(state.instruction_set)
+    self.instruction_set_stack = [get_instruction_set(i) for i in state.instruction_set_stack]
+
     self.exit_code = state.exit_code
-    self.idle = state.idle
-    self.alive = state.alive
-    self.running = state.running
 
     if self.has_coprocessor('math'):
       self.math_coprocessor.load_state(state.get_children()['math_coprocessor'])
 
+    if state.alive is not True:
+      if self.alive is True:
+        self.halt()
+
+    elif state.running is not True:
+      if self.running is True:
+        self.suspend()
+
+    self.change_runnable_state(idle = state.idle)
+
   def init_debug_set(self):
     if self.debug is None:
       from .. import debugging
@@ -1098,6 +1145,9 @@ class CPUCore(ISnapshotable, IMachineWorker):
       else:
         self.cpu.machine.reactor.task_suspended(self)
 
+    if idle is True:
+      self.cpu.machine.clock.wake_up()
+
   def suspend(self):
     self.DEBUG('CPUCore.suspend')
 
@@ -8,11 +8,112 @@ suspend core), and bind both pieces together - when point gets
 triggered, execute list of actions.
 """
 
-from six import itervalues
+import ast
 
+from ctypes import c_uint as u32_t
+from six import itervalues, integer_types
+
+from .cpu.registers import Registers, REGISTER_NAMES
+from .mm import PAGE_SHIFT
 from .util import str2int, UINT8_FMT, UINT16_FMT, UINT32_FMT
 from .errors import InvalidResourceError
 
+#: Names of core flags usable in conditions, and corresponding core attributes.
+CONDITION_FLAGS = {
+  'privileged': 'privileged',
+  'hwint':      'hwint_allowed',
+  'equal':      'arith_equal',
+  'zero':       'arith_zero',
+  'overflow':   'arith_overflow',
+  'sign':       'arith_sign'
+}
+
+#: Memory readers usable in conditions, and corresponding memory controller methods.
+CONDITION_READERS = {
+  'mem8':  'read_u8',
+  'mem16': 'read_u16',
+  'mem32': 'read_u32'
+}
+
+_CONDITION_NODES = tuple([getattr(ast, name) for name in (
+  'Expression', 'BoolOp', 'And', 'Or', 'BinOp', 'UnaryOp', 'Compare', 'Call', 'Name', 'Load',
+  'Add', 'Sub', 'Mult', 'FloorDiv', 'Mod', 'LShift', 'RShift', 'BitOr', 'BitXor', 'BitAnd',
+  'Invert', 'Not', 'UAdd', 'USub', 'Eq', 'NotEq', 'Lt', 'LtE', 'Gt', 'GtE'
+)])
+
+_CONDITION_CONSTANT = ast.Constant if hasattr(ast, 'Constant') else ast.Num
+
+def compile_condition(expression):
+  """
+  Compile condition into a Python function.
+
+  Condition is an expression, written in Python syntax, using integers,
+  arithmetic, bitwise, logical and comparison operators, and following names:
+
+    - registers - ``r0`` to ``r29``, ``fp``, ``sp``, ``ip``, ``cnt``,
+    - flags - ``privileged``, ``hwint``, ``equal``, ``zero``, ``overflow``,
+      ``sign``,
+    - memory readers - ``mem8(address)``, ``mem16(address)``,
+      ``mem32(address)``.
+
+  For example, ``r0 == 0x10 and mem32(sp) != 0``.
+
+  Expression is checked and compiled just once, resulting function reads only
+  the values the expression uses.
+
+  :param str expression: condition.
+  :returns: function accepting a CPU core, and returning a true value if the
+    condition is satisfied.
+  :raises InvalidResourceError: when expression is not a valid condition.
+  """
+
+  try:
+    tree = ast.parse(expression.strip(), mode = 'eval')
+
+  except SyntaxError as e:
+    raise InvalidResourceError('Invalid condition: %s: %s' % (expression, e))
+
+  names = set()
+
+  for node in ast.walk(tree):
+    if not isinstance(node, _CONDITION_NODES + (_CONDITION_CONSTANT,)):
+      raise InvalidResourceError('Invalid condition: %s: %s not allowed' % (expression, node.__class__.__name__))
+
+    if isinstance(node, ast.Call):
+      if not isinstance(node.func, ast.Name) or node.func.id not in CONDITION_READERS or len(node.args) != 1 or node.keywords:
+        raise InvalidResourceError('Invalid condition: %s: only mem8(), mem16() and mem32() calls are allowed' % expression)
+
+    elif isinstance(node, ast.Name):
+      if node.id not in REGISTER_NAMES and node.id not in CONDITION_FLAGS and node.id not in CONDITION_READERS:
+        raise InvalidResourceError('Invalid condition: %s: unknown name %s' % (expression, node.id))
+
+      names.add(node.id)
+
+    elif isinstance(node, _CONDITION_CONSTANT):
+      value = node.value if hasattr(node, 'value') else node.n
+
+      if not isinstance(value, integer_types) or isinstance(value, bool):
+        raise InvalidResourceError('Invalid condition: %s: only integers are allowed' % expression)
+
+  lines = ['def __condition(core):']
+
+  for name in sorted(names):
+    if name in CONDITION_FLAGS:
+      lines.append('  %s = core.%s' % (name, CONDITION_FLAGS[name]))
+
+    elif name in CONDITION_READERS:
+      lines.append('  %s = core.mmu.memory.%s' % (name, CONDITION_READERS[name]))
+
+    else:
+      lines.append('  %s = core.registers[%i]' % (name, REGISTER_NAMES.index(name)))
+
+  lines.append('  return (%s)' % expression.strip())
+
+  namespace = {}
+  exec(compile('\n'.join(lines), '<condition: %s>' % expression, 'exec'), {'__builtins__': {}}, namespace)
+
+  return namespace['__condition']
+
 class Action(object):
   """
   Base class of all debugging actions.
@@ -45,17 +146,37 @@ class Point(object):
   :param bool active: if not ``True``, point is not active and will not trigger.
   :param int countdown: if greater than zero, point has to trigger ``countdown`` times
     before its actions are executed for the first time.
+  :param str condition: if set, point triggers only when this condition is
+    satisfied. See :py:func:`compile_condition`.
   """
 
-  def __init__(self, debugging_set, active = True, countdown = 0):
+  def __init__(self, debugging_set, active = True, countdown = 0, condition = None):
     super(Point, self).__init__()
 
     self.active = active
     self.countdown = countdown
     self.debugging_set = debugging_set
 
+    self.condition = condition
+    self.condition_fn = compile_condition(condition) if condition else None
+
+    #: Name of the chain point was added to.
+    self.chain = None
+
     self.actions = []
 
+  def index_key(self):
+    """
+    Points can be indexed by an address, and then evaluated only when this
+    address is accessed or executed, instead of being evaluated each time
+    their chain is checked.
+
+    :returns: address point is interested in, or ``None`` when point must
+      be evaluated each time.
+    """
+
+    return None
+
   def is_triggered(self, core, *args, **kwargs):
     """
     Test point's condition.
@@ -77,6 +198,7 @@ class SuspendCoreAction(Action):
   """
 
   def act(self, core, point):
+    core.INFO('Breakpoint triggered: %s', point)
     core.suspend()
 
   def __repr__(self):
@@ -137,7 +259,7 @@ class LogValueAction(Action):
     data = self.get_values(core, point)
     data.update({
       'watchpoint': repr(point),
-      'ip':         UINT32_FMT(core.registers.ip),
+      'ip':         UINT32_FMT(core.registers[Registers.IP]),
       'value':      self.formatter(data['value'])
     })
 
@@ -206,7 +328,7 @@ class LogRegisterContentAction(LogValueAction):
     values = {'value': 0}
     for r in self.registers:
       values[r] = r
-      values[r + '_value'] = UINT32_FMT(getattr(core.registers, r).value)
+      values[r + '_value'] = UINT32_FMT(core.registers[REGISTER_NAMES.index(r)])
 
     return values
 
@@ -219,6 +341,107 @@ class LogRegisterContentAction(LogValueAction):
 
     return LogRegisterContentAction(debugging_set.core.LOGGER, _get('registers'))
 
+class TraceAction(Action):
+  """
+  When triggered, stores content of registers and memory locations in a ring
+  buffer. Buffer is allocated just once, and when it is full, the oldest
+  records are overwritten. Nothing is logged, buffer has to be dumped on
+  demand - e.g. by ``trace-dump`` console command. Point with this action
+  is a tracepoint.
+
+  Each record contains ``IP`` and ``CNT`` registers, followed by requested
+  registers and memory locations.
+
+  :param logging.Logger logger: logger instance used for logging.
+  :param list registers: list of register names.
+  :param list addresses: list of addresses of 32-bit memory locations.
+  :param int size: number of records buffer can hold.
+  """
+
+  def __init__(self, logger, registers = None, addresses = None, size = 1024):
+    super(TraceAction, self).__init__(logger)
+
+    self.registers = registers or []
+    self.addresses = addresses or []
+    self.size = size
+
+    self._register_indices = [Registers.IP.value, Registers.CNT.value] + [REGISTER_NAMES.index(r) for r in self.registers]
+    self.width = len(self._register_indices) + len(self.addresses)
+
+    self.buffer = (u32_t * (self.size * self.width))()
+
+    #: Total number of stored records, including the overwritten ones.
+    self.count = 0
+
+  def __repr__(self):
+    return '<TraceAction: registers=%s, addresses=%s, size=%i>' % (','.join(self.registers), ','.join([UINT32_FMT(address) for address in self.addresses]), self.size)
+
+  def act(self, core, point):
+    buff, i = self.buffer, (self.count % self.size) * self.width
+    registers = core.registers
+
+    for index in self._register_indices:
+      buff[i] = registers[index]
+      i += 1
+
+    if self.addresses:
+      reader = core.mmu.memory.read_u32
+
+      for address in self.addresses:
+        buff[i] = reader(address)
+        i += 1
+
+    self.count += 1
+
+  def get_records(self):
+    """
+    Get stored records, from the oldest to the newest one.
+
+    :returns: list of lists of values, one list for each record.
+    """
+
+    stored = min(self.count, self.size)
+    first = self.count - stored
+    width, buff = self.width, self.buffer
+
+    records = []
+
+    for n in range(first, first + stored):
+      i = (n % self.size) * width
+      records.append(buff[i:i + width])
+
+    return records
+
+  def get_table(self):
+    """
+    Get stored records formatted as a table, with header in the first row.
+    """
+
+    table = [
+      ['IP', 'CNT'] + self.registers + [UINT32_FMT(address) for address in self.addresses]
+    ]
+
+    for record in self.get_records():
+      table.append([UINT32_FMT(record[0]), record[1]] + [UINT32_FMT(value) for value in record[2:]])
+
+    return table
+
+  def clear(self):
+    """
+    Remove all stored records.
+    """
+
+    self.count = 0
+
+  @staticmethod
+  def create_from_config(debugging_set, config, section):
+    _get, _getbool, _getint = config.create_getters(section)
+
+    registers = [r.strip() for r in _get('registers', '').split(',') if r.strip()]
+    addresses = [str2int(address.strip()) for address in _get('addresses', '').split(',') if address.strip()]
+
+    return TraceAction(debugging_set.core.LOGGER, registers = registers, addresses = addresses, size = _getint('size', 1024))
+
 class BreakPoint(Point):
   def __init__(self, debugging_set, ip, *args, **kwargs):
     super(BreakPoint, self).__init__(debugging_set, *args, **kwargs)
@@ -230,6 +453,9 @@ class BreakPoint(Point):
 
     return core.IP() == self.ip
 
+  def index_key(self):
+    return self.ip
+
   def __repr__(self):
     return '<BreakPoint: IP=%s>' % UINT32_FMT(self.ip)
 
@@ -237,7 +463,7 @@ class BreakPoint(Point):
   def create_from_config(debugging_set, config, section):
     _get, _getbool, _getint = config.create_getters(section)
 
-    return BreakPoint(debugging_set, _getint('address'), active = _getbool('active', True), countdown = _getint('countdown', 0))
+    return BreakPoint(debugging_set, _getint('address'), active = _getbool('active', True), countdown = _getint('countdown', 0), condition = _get('condition', None))
 
 class MemoryWatchPoint(Point):
   def __init__(self, debugging_set, address, read, *args, **kwargs):
@@ -257,6 +483,9 @@ class MemoryWatchPoint(Point):
 
     return address == self.address
 
+  def index_key(self):
+    return self.address
+
   def __repr__(self):
     return '<MemoryWatchPoint: address=%s>' % UINT32_FMT(self.address)
 
@@ -264,16 +493,88 @@ class MemoryWatchPoint(Point):
   def create_from_config(debugging_set, config, section):
     _get, _getbool, _getint = config.create_getters(section)
 
-    return MemoryWatchPoint(debugging_set, _getint('address'), _getbool('read', None), active = _getbool('active', True), countdown = _getint('countdown', 0))
+    return MemoryWatchPoint(debugging_set, _getint('address'), _getbool('read', None), active = _getbool('active', True), countdown = _getint('countdown', 0), condition = _get('condition', None))
+
+class DebuggingChain(object):
+  """
+  Points evaluated at the same stage of execution. Points are indexed by
+  their :py:meth:`Point.index_key`, points without a key are evaluated each
+  time.
+  """
+
+  def __init__(self):
+    super(DebuggingChain, self).__init__()
+
+    self.points = []
+    self.indexed = {}
+    self.unindexed = []
+
+  def add(self, p):
+    self.points.append(p)
+
+    key = p.index_key()
+
+    if key is None:
+      self.unindexed.append(p)
+
+    else:
+      self.indexed.setdefault(key, []).append(p)
+
+  def remove(self, p):
+    self.points.remove(p)
+
+    key = p.index_key()
+
+    if key is None:
+      self.unindexed.remove(p)
+      return
+
+    points = self.indexed[key]
+    points.remove(p)
+
+    if not points:
+      del self.indexed[key]
+
+  def get_points(self, key):
+    """
+    Get points that should be evaluated for ``key``.
+
+    :param u32_t key: current IP, or accessed address.
+    :rtype: list
+    """
+
+    points = self.indexed.get(key)
+
+    if points is None:
+      return self.unindexed
+
+    if not self.unindexed:
+      return points
+
+    return points + self.unindexed
 
 class DebuggingSet(object):
+  #: Names of available chains.
+  CHAINS = ('pre-step', 'post-step', 'pre-memory', 'post-memory')
+
   def __init__(self, core):
     super(DebuggingSet, self).__init__()
 
     self.core = core
-    self.points = []
 
-    self.triggered_points = []
+    self.chains = dict([(name, DebuggingChain()) for name in DebuggingSet.CHAINS])
+
+    self.chain_pre_step = self.chains['pre-step']
+    self.chain_post_step = self.chains['post-step']
+    self.chain_pre_memory = self.chains['pre-memory']
+    self.chain_post_memory = self.chains['post-memory']
+
+    self.triggered_step = []
+    self.triggered_memory = []
+
+    #: Pages with at least one memory watchpoint. Set is updated in place,
+    #: MMU keeps reference to it.
+    self.watched_pages = set()
 
     C = core.cpu.machine.console
 
@@ -281,7 +582,8 @@ class DebuggingSet(object):
       ('bp-list', cmd_bp_list),
       ('bp-break', cmd_bp_add_breakpoint),
       ('bp-mwatch', cmd_bp_add_memory_watchpoint),
-      ('bp-active', cmd_bp_active)
+      ('bp-active', cmd_bp_active),
+      ('trace-dump', cmd_trace_dump)
     ]
 
     for name, handler in console_commands:
@@ -290,35 +592,69 @@ class DebuggingSet(object):
 
       C.register_command(name, handler)
 
-    for chain in ('step', 'memory'):
-      setattr(self, 'triggered_%s' % chain, [])
+  def has_memory_points(self):
+    """
+    Returns ``True`` when there are any memory points, therefore memory
+    accesses must be checked.
+
+    :rtype: bool
+    """
+
+    return bool(self.chain_pre_memory.points or self.chain_post_memory.points)
 
-      for stage in ('pre', 'post'):
-        setattr(self, 'chain_%s_%s' % (stage, chain), [])
+  def watches_all_pages(self):
+    """
+    Returns ``True`` when there are memory points that are not indexed by
+    address, therefore every memory access must be checked.
+
+    :rtype: bool
+    """
+
+    return bool(self.chain_pre_memory.unindexed or self.chain_post_memory.unindexed)
+
+  def _memory_points_changed(self):
+    self.watched_pages.clear()
+    self.watched_pages.update([address >> PAGE_SHIFT for chain in (self.chain_pre_memory, self.chain_post_memory) for address in chain.indexed])
+
+    self.core.mmu._set_access_methods()
 
   def add_point(self, p, chain):
     self.core.DEBUG('adding point %s to chain %s', p, chain)
 
-    getattr(self, 'chain_' + chain.replace('-', '_')).append(p)
+    self.chains[chain].add(p)
+    p.chain = chain
+
+    if chain.endswith('-memory'):
+      self._memory_points_changed()
+
+  def remove_point(self, p, chain = None):
+    chain = chain or p.chain
 
-  def remove_point(self, p, chain):
     self.core.DEBUG('removing point %s from chain %s', p, chain)
 
-    getattr(self, 'chain_' + chain.replace('-', '_')).remove(p)
+    self.chains[chain].remove(p)
+    p.chain = None
 
-  def __check_chain(self, stage, chain, clean_triggered = False, *args, **kwargs):
-    D = self.core.DEBUG
+    if chain.endswith('-memory'):
+      self._memory_points_changed()
+
+  def get_trace_actions(self):
+    """
+    Get all trace actions of all points.
+
+    :rtype: list of TraceAction
+    """
 
-    D('__check_chain: stage=%s, chain=%s, clean_triggered=%s', stage, chain, clean_triggered)
+    return [a for chain in itervalues(self.chains) for p in chain.points for a in p.actions if isinstance(a, TraceAction)]
 
-    triggered = getattr(self, 'triggered_' + chain)
-    chain = getattr(self, 'chain_%s_%s' % (stage, chain))
+  def __check_points(self, points, triggered, *args, **kwargs):
+    D = self.core.DEBUG
 
-    D('__check_chain: before check: chain=%s, triggered=%s', str(chain), str(triggered))
+    D('__check_points: points=%s, triggered=%s', points, triggered)
 
     triggered_in_loop = 0
 
-    for p in chain:
+    for p in points:
       D(repr(p))
 
       if not p.active:
@@ -329,6 +665,10 @@ class DebuggingSet(object):
         D('not triggered, skipping')
         continue
 
+      if p.condition_fn is not None and not p.condition_fn(self.core):
+        D('condition not satisfied, skipping')
+        continue
+
       if p in triggered:
         D('already triggered by this step, ignore')
         continue
@@ -340,33 +680,52 @@ class DebuggingSet(object):
         D('countdown %i, skip for now', p.countdown)
         continue
 
-      self.core.INFO('Breakpoint triggered: %s', p)
+      D('point triggered: %s', p)
       triggered.append(p)
       triggered_in_loop += 1
 
       for action in p.actions:
         action.act(self.core, p)
 
-    D('__check_chain: after check: chain=%s, triggered=%s', str(chain), str(triggered))
-
-    if clean_triggered is True:
-      triggered[:] = []
-
-    D('__check_chain: after cleanup: chain=%s, triggered=%s', str(chain), str(triggered))
-
     return triggered_in_loop > 0
 
   def pre_step(self):
-    return self.__check_chain('pre', 'step')
+    points = self.chain_pre_step.get_points(self.core.registers[Registers.IP])
+
+    if not points:
+      return False
+
+    return self.__check_points(points, self.triggered_step)
 
   def post_step(self):
-    return self.__check_chain('post', 'step', clean_triggered = True)
+    points = self.chain_post_step.get_points(self.core.registers[Registers.IP])
+    triggered = self.triggered_step
+
+    ret = self.__check_points(points, triggered) if points else False
+
+    if triggered:
+      triggered[:] = []
+
+    return ret
 
   def pre_memory(self, address = None, read = None):
-    return self.__check_chain('pre', 'memory', address = address, read = read)
+    points = self.chain_pre_memory.get_points(address)
+
+    if not points:
+      return False
+
+    return self.__check_points(points, self.triggered_memory, address = address, read = read)
 
   def post_memory(self, address = None, read = None):
-    return self.__check_chain('post', 'memory', clean_triggered = True, address = address, read = read)
+    points = self.chain_post_memory.get_points(address)
+    triggered = self.triggered_memory
+
+    ret = self.__check_points(points, triggered, address = address, read = read) if points else False
+
+    if triggered:
+      triggered[:] = []
+
+    return ret
 
 def cmd_bp_list(console, cmd):
   """
@@ -457,3 +816,21 @@ def cmd_bp_active(console, cmd):
   point.active = not point.active
 
   console.writeln('# OK: %s', point)
+
+def cmd_trace_dump(console, cmd):
+  """
+  Print records stored by tracepoints: trace-dump [clear]
+  """
+
+  clear = len(cmd) >= 2 and cmd[1] == 'clear'
+
+  for core in console.master.machine.cores:
+    if core.debug is None:
+      continue
+
+    for action in core.debug.get_trace_actions():
+      console.writeln('%s: %s, %i records', core.cpuid_prefix, action, action.count)
+      console.table(action.get_table())
+
+      if clear is True:
+        action.clear()
@@ -4,13 +4,16 @@ Emulating different virtual devices like keyboard, display, disks...
 
 import importlib
 
-from ..interfaces import IMachineWorker
+from ..interfaces import IMachineWorker, ISnapshotable
 from ..mm import VirtualMemoryPage
 
-class Device(IMachineWorker):
+class Device(ISnapshotable, IMachineWorker):
   """
   Base class for all devices. Serves more like an API description.
 
+  Devices with an internal state should save it into a snapshot node named
+  after the device.
+
   :param ducky.machine.Machine machine: VM this device belongs to.
   :param str klass: device family (input, output, snapshot, ...)
   :param str name: device name. Maps directly to a section of config
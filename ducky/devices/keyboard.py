@@ -1,5 +1,30 @@
 """
 Keyboard controller - provides events for pressed and released keys.
+
+By default, guest reads input one byte at a time, using ``DATA`` port. Guest
+can switch controller to a ring buffer mode by storing address of a ring
+buffer into ``RING_ADDRESS`` port, and its size into ``RING_SIZE`` port. The
+ring buffer lives in guest's (physical) memory, and has following layout:
+
++--------+-----------------------------------------------------------------+
+| Offset | Content                                                         |
++--------+-----------------------------------------------------------------+
+| 0x00   | ``u32_t`` producer index, updated by controller                 |
++--------+-----------------------------------------------------------------+
+| 0x04   | ``u32_t`` consumer index, updated by guest                      |
++--------+-----------------------------------------------------------------+
+| 0x08   | ``RING_SIZE`` bytes of data                                     |
++--------+-----------------------------------------------------------------+
+
+Both indices are free-running, i.e. they are never reset to zero, and byte
+position in the data area is ``index & (RING_SIZE - 1)`` - therefore, ring
+size must be a power of two. Ring is empty when both indices are equal.
+
+Controller copies input into the ring as soon as it's available, and triggers
+IRQ only when the ring was empty before. When guest finds the ring empty, it
+should read ``DATA`` port - controller then refills the ring with pending
+input (or halts the machine when all input has been consumed) - and, if the
+ring remains empty, wait for the IRQ.
 """
 
 import enum
@@ -11,15 +36,20 @@ from . import DeviceFrontend, DeviceBackend, MMIOMemoryPage
 from ..errors import InvalidResourceError
 from ..mm import UINT8_FMT, addr_to_page, UINT32_FMT, u32_t
 from ..hdt import HDTEntry_Device
+from ..snapshot import SnapshotNode
 
 DEFAULT_IRQ = 0x01
 DEFAULT_MMIO_ADDRESS = 0x8000
 
+RING_HEADER_SIZE = 8
+
 class KeyboardPorts(enum.IntEnum):
-  STATUS = 0x00
-  DATA   = 0x01
+  STATUS       = 0x00
+  DATA         = 0x01
+  RING_ADDRESS = 0x04
+  RING_SIZE    = 0x08
 
-  LAST   = 0x01
+  LAST         = 0x0B
 
 class HDTEntry_Keyboard(HDTEntry_Device):
   _fields_ = HDTEntry_Device.ENTRY_HEADER + [
@@ -33,6 +63,10 @@ class HDTEntry_Keyboard(HDTEntry_Device):
 
     logger.debug('%s: mmio-address=%s', self.__class__.__name__, UINT32_FMT(self.mmio_address))
 
+class KeyboardState(SnapshotNode):
+  def __init__(self):
+    super(KeyboardState, self).__init__('ring_address', 'ring_size')
+
 class KeyboardMMIOMemoryPage(MMIOMemoryPage):
   def read_u8(self, offset):
     self.DEBUG('%s.read_u8: offset=%s', self.__class__.__name__, UINT8_FMT(offset))
@@ -41,6 +75,10 @@ class KeyboardMMIOMemoryPage(MMIOMemoryPage):
       return 0x00
 
     if offset == KeyboardPorts.DATA:
+      if self._device.ring_size:
+        self._device._refill_ring(allow_halt = True)
+        return 0xFF
+
       b = self._device._read_char()
       if b is None:
         self.DEBUG('%s.get: empty input, signal it downstream', self.__class__.__name__)
@@ -52,6 +90,19 @@ class KeyboardMMIOMemoryPage(MMIOMemoryPage):
     self.WARN('%s.read_u8: attempt to read raw offset: offset=%s', self.__class__.__name__, UINT8_FMT(offset))
     return 0x00
 
+  def write_u32(self, offset, value):
+    self.DEBUG('%s.write_u32: offset=%s, value=%s', self.__class__.__name__, UINT8_FMT(offset), UINT32_FMT(value))
+
+    if offset == KeyboardPorts.RING_ADDRESS:
+      self._device.ring_address = value
+      return
+
+    if offset == KeyboardPorts.RING_SIZE:
+      self._device.setup_ring(value)
+      return
+
+    self.WARN('%s.write_u32: attempt to write raw offset: offset=%s, value=%s', self.__class__.__name__, UINT8_FMT(offset), UINT32_FMT(value))
+
 class ControlMessages(enum.IntEnum):
   HALT = 1025
 
@@ -147,7 +198,7 @@ class Frontend(DeviceFrontend):
 
     self._comm_queue.write_in(buff)
 
-    self.machine.trigger_irq(self.backend)
+    self.backend.input_available()
 
 class Backend(DeviceBackend):
   def __init__(self, machine, name, mmio_address = None, irq = None):
@@ -160,6 +211,9 @@ class Backend(DeviceBackend):
     self._comm_queue = machine.comm_channel.create_queue(name)
     self._key_queue = deque()
 
+    self.ring_address = 0x00000000
+    self.ring_size = 0
+
   @staticmethod
   def create_from_config(machine, config, section):
     return Backend(machine, section,
@@ -195,8 +249,7 @@ class Backend(DeviceBackend):
         return
 
       if isinstance(e, (list, bytearray, bytes)):
-        for key in e:
-          self._key_queue.append(key)
+        self._key_queue.extend(bytearray(e))
 
       elif isinstance(e, ControlMessages):
         self._key_queue.append(e)
@@ -221,3 +274,113 @@ class Backend(DeviceBackend):
       return None
 
     return b
+
+  def save_state(self, parent):
+    state = parent.add_child(self.name, KeyboardState())
+
+    state.ring_address = self.ring_address
+    state.ring_size = self.ring_size
+
+  def load_state(self, state):
+    # Ring itself lives in the memory, and it's been restored already
+    self.ring_address = state.ring_address
+    self.ring_size = state.ring_size
+
+  def setup_ring(self, size):
+    """
+    Switch controller to ring buffer mode, or back to byte-by-byte mode.
+
+    :param int size: size of ring's data area, must be a power of two. ``0``
+      disables ring buffer mode.
+    """
+
+    self.machine.DEBUG('%s.setup_ring: address=%s, size=%s', self.__class__.__name__, UINT32_FMT(self.ring_address), size)
+
+    if size & (size - 1):
+      self.machine.WARN('%s.setup_ring: ring size must be a power of two: size=%s', self.__class__.__name__, size)
+      return
+
+    self.ring_size = size
+
+    if not size:
+      return
+
+    self.machine.memory.write_u32(self.ring_address, 0x00000000)
+    self.machine.memory.write_u32(self.ring_address + 4, 0x00000000)
+
+    self._refill_ring()
+
+  def input_available(self):
+    """
+    Called by frontend when new input has been added to the queue.
+    """
+
+    self.machine.DEBUG('%s.input_available', self.__class__.__name__)
+
+    if not self.ring_size:
+      self.machine.trigger_irq(self)
+      return
+
+    if self._refill_ring() is True:
+      self.machine.trigger_irq(self)
+
+  def _refill_ring(self, allow_halt = False):
+    """
+    Copy as much pending input as possible into guest's ring buffer.
+
+    :param bool allow_halt: if set, and ring is empty and there is no input
+      left, halt the machine.
+    :rtype: bool
+    :returns: ``True`` when ring was empty, and now contains new data.
+    """
+
+    self._process_input_events()
+
+    q = self._key_queue
+
+    if not q:
+      return False
+
+    memory = self.machine.memory
+    address, size = self.ring_address, self.ring_size
+
+    producer = memory.read_u32(address)
+    consumer = memory.read_u32(address + 4)
+    used = (producer - consumer) & 0xFFFFFFFF
+
+    self.machine.DEBUG('%s._refill_ring: producer=%s, consumer=%s, used=%s, pending=%s', self.__class__.__name__, producer, consumer, used, len(q))
+
+    if used > size:
+      self.machine.WARN('%s._refill_ring: corrupted ring: producer=%s, consumer=%s, size=%s', self.__class__.__name__, producer, consumer, size)
+      return False
+
+    if allow_halt is True and used == 0 and q[0] == ControlMessages.HALT:
+      q.popleft()
+      self.machine.halt()
+      return False
+
+    buff = bytearray()
+    free = size - used
+
+    while q and free:
+      if q[0] == ControlMessages.HALT:
+        break
+
+      buff.append(q.popleft())
+      free -= 1
+
+    if not buff:
+      return False
+
+    data = address + RING_HEADER_SIZE
+    start = producer & (size - 1)
+    head = min(len(buff), size - start)
+
+    memory.write_bytes(data + start, buff[0:head])
+
+    if head < len(buff):
+      memory.write_bytes(data, buff[head:])
+
+    memory.write_u32(address, (producer + len(buff)) & 0xFFFFFFFF)
+
+    return used == 0
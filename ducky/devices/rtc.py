@@ -1,5 +1,4 @@
 import enum
-import time
 import datetime
 
 from . import Device, MMIOMemoryPage
@@ -7,6 +6,7 @@ from ..errors import InvalidResourceError
 from ..mm import u8_t, UINT8_FMT, addr_to_page, u32_t, UINT32_FMT
 from ..reactor import RunInIntervalTask
 from ..hdt import HDTEntry_Device
+from ..snapshot import SnapshotNode
 
 DEFAULT_IRQ  = 0x00
 DEFAULT_FREQ = 100
@@ -33,6 +33,10 @@ class HDTEntry_RTC(HDTEntry_Device):
 
     logger.debug('%s: mmio-address=%s', self.__class__.__name__, UINT32_FMT(self.mmio_address))
 
+class RTCState(SnapshotNode):
+  def __init__(self):
+    super(RTCState, self).__init__('frequency', 'stamp')
+
 class RTCMMIOMemoryPage(MMIOMemoryPage):
   def read_u8(self, offset):
     self.DEBUG('%s.read_u8: offset=%s', self.__class__.__name__, UINT8_FMT(offset))
@@ -86,11 +90,14 @@ class RTCTask(RunInIntervalTask):
     self.update_tick()
 
   def update_tick(self):
-    self.tick = 1.0 / float(self.rtc.frequency)
-    self.machine.DEBUG('rtc: new frequency: %i => %f' % (self.rtc.frequency, self.tick))
+    self.tick = 1000000000 // self.rtc.frequency
+    self.machine.DEBUG('rtc: new frequency: %i => %i' % (self.rtc.frequency, self.tick))
+
+  def next_deadline(self):
+    return self.stamp + self.tick
 
   def on_tick(self, task):
-    stamp = time.time()
+    stamp = self.machine.clock.now()
     diff = stamp - self.stamp
     self.machine.DEBUG('rtc: tick: stamp=%s, last=%s, diff=%s, tick=%s, ?=%s' % (stamp, self.stamp, diff, self.tick, diff < self.tick))
     if diff < self.tick:
@@ -141,14 +148,28 @@ class RTC(Device):
   def create_hdt_entries(logger, config, section):
     return [HDTEntry_RTC(logger, config, section)]
 
+  def save_state(self, parent):
+    state = parent.add_child(self.name, RTCState())
+
+    state.frequency = self.frequency
+    state.stamp = self.timer_task.stamp
+
+  def load_state(self, state):
+    self.frequency = state.frequency
+    self.timer_task.stamp = state.stamp
+    self.timer_task.update_tick()
+
   def boot(self):
     self.machine.DEBUG('RTC.boot')
 
     self._mmio_page = RTCMMIOMemoryPage(self, self.machine.memory, addr_to_page(self._mmio_address))
     self.machine.memory.register_page(self._mmio_page)
 
+    self.timer_task.stamp = self.machine.clock.now()
+
     self.machine.reactor.add_task(self.timer_task)
     self.machine.reactor.task_runnable(self.timer_task)
+    self.machine.clock.add_deadline_source(self.timer_task.next_deadline)
 
     now = datetime.datetime.now()
 
@@ -157,3 +178,4 @@ class RTC(Device):
   def halt(self):
     self.machine.memory.unregister_page(self._mmio_page)
     self.machine.reactor.remove_task(self.timer_task)
+    self.machine.clock.remove_deadline_source(self.timer_task.next_deadline)
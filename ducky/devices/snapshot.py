@@ -1,3 +1,5 @@
+import os
+
 from . import Device
 
 class SnapshotStorage(Device):
@@ -11,27 +13,27 @@ class SnapshotStorage(Device):
   def save_snapshot(self, snapshot):
     pass
 
-  def halt(self):
-    self.machine.capture_state()
-
-
 class FileSnapshotStorage(SnapshotStorage):
-  def __init__(self, machine, name, filepath = None, *args, **kwargs):
+  def __init__(self, machine, name, filepath = None, compression = None, *args, **kwargs):
     super(FileSnapshotStorage, self).__init__(machine, name, *args, **kwargs)
 
     self.filepath = filepath
+    self.compression = compression
 
   @staticmethod
   def create_from_config(machine, config, section):
-    return FileSnapshotStorage(machine, section, filepath = config.get(section, 'filepath', None))
+    return FileSnapshotStorage(machine, section, filepath = config.get(section, 'filepath', None), compression = config.get(section, 'compression', None))
 
   def save_snapshot(self, snapshot):
-    snapshot.save(self.filepath)
+    snapshot.save(self.filepath, compression = self.compression)
     self.machine.tenh('snapshot: saved in file %s', self.filepath)
 
   def boot(self):
     self.machine.tenh('snapshot: storage ready, backed by file %s', self.filepath)
 
+  def forked(self):
+    self.filepath = '%s.%i' % (self.filepath, os.getpid())
+
   def halt(self):
     super(FileSnapshotStorage, self).halt()
 
@@ -40,4 +42,4 @@ class FileSnapshotStorage(SnapshotStorage):
 class DefaultFileSnapshotStorage(FileSnapshotStorage):
   @staticmethod
   def create_from_config(machine, config, section):
-    return DefaultFileSnapshotStorage(machine, section, filepath = 'ducky-snapshot.bin')
+    return DefaultFileSnapshotStorage(machine, section, filepath = 'ducky-snapshot.bin', compression = config.get(section, 'compression', None))
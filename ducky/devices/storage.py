@@ -124,6 +124,10 @@ class FileBackedStorage(Storage):
     self.filepath = filepath
     self.file = None
 
+    #: Blocks written since the machine has been forked, ``None`` while
+    #: writes go directly into the file.
+    self.overlay = None
+
   @staticmethod
   def create_from_config(machine, config, section):
     return FileBackedStorage(machine, section, sid = config.getint(section, 'sid', None), filepath = config.get(section, 'filepath', None))
@@ -141,6 +145,21 @@ class FileBackedStorage(Storage):
     self.file.flush()
     self.file.close()
 
+  def forked(self):
+    """
+    Storage file is shared with the parent and other clones, therefore
+    child reopens it for reading only, and keeps modified blocks in its
+    private overlay.
+    """
+
+    self.machine.DEBUG('FileBackedStorage.forked')
+
+    if self.file is not None:
+      self.file.close()
+      self.file = open(self.filepath, 'rb')
+
+    self.overlay = {}
+
   if six.PY2:
     def _read(self, cnt):
       return bytearray([ord(c) for c in self.file.read(cnt)])
@@ -160,11 +179,30 @@ class FileBackedStorage(Storage):
 
     self.file.seek(start * BLOCK_SIZE)
 
-    return self._read(cnt * BLOCK_SIZE)
+    buff = self._read(cnt * BLOCK_SIZE)
+
+    if not self.overlay:
+      return buff
+
+    buff = bytearray(buff)
+
+    for i in range(0, cnt):
+      block = self.overlay.get(start + i)
+
+      if block is not None:
+        buff[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE] = block
+
+    return buff
 
   def do_write_blocks(self, start, cnt, buff):
     self.machine.DEBUG('%s.do_write_blocks: start=%s, cnt=%s', self.__class__.__name__, start, cnt)
 
+    if self.overlay is not None:
+      for i in range(0, cnt):
+        self.overlay[start + i] = bytearray(buff[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE])
+
+      return
+
     self.file.seek(start * BLOCK_SIZE)
     self._write(buff)
     self.file.flush()
@@ -3,7 +3,6 @@ SimpleVGA is very basic implementation of VGA-like device, with text
 and graphic modes.
 """
 
-import array
 import enum
 import functools
 
@@ -17,6 +16,7 @@ from ..mm import PAGE_SIZE, ExternalMemoryPage, addr_to_page, u8_t
 from ..util import sizeof_fmt, F, UINT16_FMT, UINT32_FMT, UINT8_FMT
 from ..reactor import RunInIntervalTask
 from ..streams import OutputStream
+from ..snapshot import SnapshotNode
 
 #: Default memory size, in bytes
 DEFAULT_MEMORY_SIZE = 64 * 1024
@@ -45,6 +45,10 @@ class SimpleVGACommands(enum.IntEnum):
   MEMORY_BANK_ID = 0x0030
 
 
+class SimpleVGAState(SnapshotNode):
+  def __init__(self):
+    super(SimpleVGAState, self).__init__('mode', 'bank', 'memory')
+
 class Mode(object):
   def __init__(self, _type, width, height, depth):
     self.type = _type
@@ -52,7 +56,10 @@ class Mode(object):
     self.height = height
     self.depth = depth
 
-    self.required_memory = self.width * self.height * (self.depth if self.type == 't' else self.depth // 8)
+    #: Number of bytes of graphic memory covering one line of the screen.
+    self.row_size = self.width * self.depth if self.type == 't' else (self.width * self.depth + 7) // 8
+
+    self.required_memory = self.row_size * self.height
 
   def __cmp__(self, other):
     return self.type == other.type and self.width == other.width and self.height == other.height and self.depth == other.depth
@@ -60,6 +67,9 @@ class Mode(object):
   def __eq__(self, other):
     return self.__cmp__(other)
 
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
   def __repr__(self):
     return self.to_string()
 
@@ -90,7 +100,7 @@ class Mode(object):
              cols = self.width,
              rows = self.height,
              entities = 'chars' if self.type == 't' else 'pixels',
-             memory_per_entity = self.depth if self.type == 't' else self.depth * 8,
+             memory_per_entity = self.depth,
              memory_label = 'bytes per char' if self.type == 't' else 'bits color depth'
              )
 
@@ -132,78 +142,373 @@ class Char(LittleEndianStructure):
   def from_u16(u):
     return Char.from_u8(u & 0x00FF, u >> 8)
 
+#: ANSI colors of character foreground
+PALETTE_FG = [30, 34, 32, 36, 31, 35, 31, 37,  90,  94,  92,  96,  91,  95, 33,  97]
+
+#: ANSI colors of character background
+PALETTE_BG = [40, 44, 42, 46, 41, 45, 41, 47, 100, 104, 102, 106, 101, 105, 43, 107]
+
+def _cell_prefix(attrs):
+  c = Char.from_u8(0, attrs)
+
+  return ('\033[%d;%d;%dm' % (5 if c.blink == 1 else 0, PALETTE_FG[c.fg], PALETTE_BG[c.bg])).encode('ascii')
+
+#: Escape sequences for all possible attribute bytes, indexed by attribute byte
+CELL_PREFIXES = [_cell_prefix(attrs) for attrs in range(0, 256)]
+
+#: Escape sequence ending each character cell
+CELL_SUFFIX = '\033[0m'.encode('ascii')
+
+#: Attributes of characters in text modes with 1 byte per char
+DEFAULT_CHAR_ATTRS = 0x0F
+
+def _rgb_palette():
+  palette = [
+    (0x00, 0x00, 0x00), (0x00, 0x00, 0xAA), (0x00, 0xAA, 0x00), (0x00, 0xAA, 0xAA),
+    (0xAA, 0x00, 0x00), (0xAA, 0x00, 0xAA), (0xAA, 0x55, 0x00), (0xAA, 0xAA, 0xAA),
+    (0x55, 0x55, 0x55), (0x55, 0x55, 0xFF), (0x55, 0xFF, 0x55), (0x55, 0xFF, 0xFF),
+    (0xFF, 0x55, 0x55), (0xFF, 0x55, 0xFF), (0xFF, 0xFF, 0x55), (0xFF, 0xFF, 0xFF)
+  ]
+
+  levels = [0x00, 0x33, 0x66, 0x99, 0xCC, 0xFF]
+  palette += [(r, g, b) for r in levels for g in levels for b in levels]
+  palette += [(8 + 10 * i, 8 + 10 * i, 8 + 10 * i) for i in range(0, 24)]
+
+  return palette
+
+#: 256 color palette - 16 standard VGA colors, 6x6x6 color cube, and 24 shades of gray
+PALETTE_RGB = _rgb_palette()
+
+#: Palettes of graphic modes, by color depth
+GRAPHIC_PALETTES = {
+  1: [(0x00, 0x00, 0x00), (0xFF, 0xFF, 0xFF)],
+  2: [(0x00, 0x00, 0x00), (0x55, 0xFF, 0xFF), (0xFF, 0x55, 0xFF), (0xFF, 0xFF, 0xFF)],
+  4: PALETTE_RGB[0:16],
+  8: PALETTE_RGB
+}
+
+def _translation_table(values):
+  return bytes(bytearray(values + [0 for _ in range(len(values), 256)]))
+
+class FramebufferRenderer(object):
+  """
+  Converts content of graphic memory in graphic modes to raw RGB or YUV data.
+
+  Framebuffer is packed - each byte holds ``8 / depth`` pixels, the leftmost
+  pixel in its most significant bits - and each line of pixels starts at
+  a byte boundary. Pixel values are indices into palette of the mode.
+
+  All conversions are done by translating and interleaving whole buffers,
+  using tables prepared in advance.
+
+  :param ducky.devices.svga.Mode mode: graphic mode.
+  """
+
+  def __init__(self, mode):
+    if mode.depth not in GRAPHIC_PALETTES:
+      raise InvalidResourceError(F('Unhandled color depth: mode={mode}', mode = mode))
+
+    self.mode = mode
+    self.size = mode.row_size * mode.height
+
+    depth = mode.depth
+    mask = (1 << depth) - 1
+
+    self.pixels_per_byte = 8 // depth
+    self.unpack_tables = [_translation_table([(b >> (8 - depth * (i + 1))) & mask for b in range(0, 256)]) for i in range(0, self.pixels_per_byte)]
+
+    palette = GRAPHIC_PALETTES[depth]
+
+    self.rgb_tables = [_translation_table([color[i] for color in palette]) for i in range(0, 3)]
+
+    def __clamp(v):
+      return min(255, max(0, int(round(v))))
+
+    self.yuv_tables = [
+      _translation_table([__clamp(0.299 * r + 0.587 * g + 0.114 * b) for r, g, b in palette]),
+      _translation_table([__clamp(-0.169 * r - 0.331 * g + 0.500 * b + 128) for r, g, b in palette]),
+      _translation_table([__clamp(0.500 * r - 0.419 * g - 0.081 * b + 128) for r, g, b in palette])
+    ]
+
+  def indices(self, framebuffer):
+    """
+    Unpack framebuffer into a buffer of palette indices, one byte per pixel.
+
+    :param framebuffer: graphic memory, e.g. a ``memoryview``.
+    :rtype: bytearray
+    """
+
+    mode = self.mode
+    packed = bytes(framebuffer[0:self.size])
+
+    if self.pixels_per_byte == 1:
+      pixels = bytearray(packed)
+
+    else:
+      pixels = bytearray(len(packed) * self.pixels_per_byte)
+
+      for i, table in enumerate(self.unpack_tables):
+        pixels[i::self.pixels_per_byte] = packed.translate(table)
+
+    row_pixels = mode.row_size * self.pixels_per_byte
+
+    if row_pixels == mode.width:
+      return pixels
+
+    # Lines are padded to a byte boundary, drop padding pixels
+    trimmed = bytearray()
+
+    for row in range(0, mode.height):
+      trimmed += pixels[row * row_pixels:row * row_pixels + mode.width]
+
+    return trimmed
+
+  def to_rgb(self, framebuffer):
+    """
+    Convert framebuffer to packed RGB data, 3 bytes per pixel.
+
+    :rtype: bytearray
+    """
+
+    pixels = bytes(self.indices(framebuffer))
+    rgb = bytearray(len(pixels) * 3)
+
+    for i, table in enumerate(self.rgb_tables):
+      rgb[i::3] = pixels.translate(table)
+
+    return rgb
+
+  def to_yuv(self, framebuffer):
+    """
+    Convert framebuffer to planar YUV 4:4:4 data - all Y values, followed by
+    all U values and all V values.
+
+    :rtype: bytearray
+    """
+
+    pixels = bytes(self.indices(framebuffer))
+    yuv = bytearray()
+
+    for table in self.yuv_tables:
+      yuv += pixels.translate(table)
+
+    return yuv
+
+#: Nominal frame rate of Y4M streams
+Y4M_FRAME_RATE = 5
+
+class PPMFrameWriter(object):
+  """
+  Writes frames as a sequence of binary PPM images.
+
+  :param ducky.streams.OutputStream stream: output stream.
+  """
+
+  def __init__(self, stream):
+    self.stream = stream
+
+  def write_frame(self, renderer, framebuffer):
+    buff = bytearray(('P6\n%d %d\n255\n' % (renderer.mode.width, renderer.mode.height)).encode('ascii'))
+    buff += renderer.to_rgb(framebuffer)
+
+    self.stream.write(buff)
+
+    return True
+
+class Y4MFrameWriter(object):
+  """
+  Writes frames as YUV4MPEG2 stream. All frames must have the same dimensions
+  as the first one.
+
+  :param ducky.streams.OutputStream stream: output stream.
+  """
+
+  def __init__(self, stream):
+    self.stream = stream
+    self.size = None
+
+  def write_frame(self, renderer, framebuffer):
+    mode = renderer.mode
+    buff = bytearray()
+
+    if self.size is None:
+      self.size = (mode.width, mode.height)
+      buff += ('YUV4MPEG2 W%d H%d F%d:1 Ip A1:1 C444\n' % (mode.width, mode.height, Y4M_FRAME_RATE)).encode('ascii')
+
+    elif self.size != (mode.width, mode.height):
+      return False
+
+    buff += b'FRAME\n'
+    buff += renderer.to_yuv(framebuffer)
+
+    self.stream.write(buff)
+
+    return True
+
+#: Available frame formats
+FRAME_WRITERS = {
+  'ppm': PPMFrameWriter,
+  'y4m': Y4MFrameWriter
+}
+
 class DisplayRefreshTask(RunInIntervalTask):
+  """
+  Periodically renders content of graphic memory into display's output stream.
+
+  The first frame, and any frame following a mode change, is drawn completely.
+  Following frames redraw only rows modified since the previous frame, and
+  each frame is passed to the stream by a single write.
+
+  In graphic modes, frames are converted to raw images and passed to display's
+  frame writer, but only when framebuffer has been modified since the last
+  frame.
+  """
+
   def __init__(self, display):
     super(DisplayRefreshTask, self).__init__(200, self.on_tick)
 
     self.display = display
-    self.first_tick = True
 
     self.write = display.stream_out.write
 
+    # Mode of the last completely drawn frame
+    self.drawn_mode = None
+
+    # Line cursor is on, relative to the top border of the frame
+    self.cursor = 0
+
+    self.buffer = bytearray()
+
+    self.renderer = None
+    self.frames_written = False
+
   def on_tick(self, task):
     self.display.machine.DEBUG('Display: refresh display')
 
     gpu = self.display.gpu
     mode = gpu.active_mode
 
-    palette_fg = [30, 34, 32, 36, 31, 35, 31, 37,  90,  94,  92,  96,  91,  95, 33,  97]
-    palette_bg = [40, 44, 42, 46, 41, 45, 41, 47, 100, 104, 102, 106, 101, 105, 43, 107]
-
     if mode.type == 't':
-      screen = []
+      self._refresh_text(gpu, mode)
 
-      if mode.depth not in (1, 2):
-        self.display.machine.WARN(F('Unhandled character depth: mode={mode}', mode = self.active_mode))
+    elif mode.type == 'g' and mode.depth in GRAPHIC_PALETTES:
+      self._refresh_graphic(gpu, mode)
+
+    else:
+      self.display.machine.WARN(F('Unhandled gpu mode: mode={mode}', mode = gpu.active_mode))
+
+  def _refresh_graphic(self, gpu, mode):
+    writer = self.display.frames_writer
+
+    if writer is None:
+      self.display.machine.DEBUG('Display: no frame output')
+      return
+
+    rows = gpu.clear_dirty()
+
+    if self.renderer is not None and self.renderer.mode == mode and self.frames_written is True:
+      if rows is not None and not [row for row in rows if row < mode.height]:
+        self.display.machine.DEBUG('Display: no change')
         return
 
-      for row in range(0, mode.height):
-        line = []
+    else:
+      self.renderer = FramebufferRenderer(mode)
 
-        for col in range(0, mode.width):
-          if mode.depth == 1:
-            c = Char.from_u8(gpu.memory[row * mode.width + col], 0)
-            c.fg = 15
-            c.bg = 0
+    if writer.write_frame(self.renderer, memoryview(gpu.memory)) is not True:
+      self.display.machine.WARN(F('Frame rejected by output: mode={mode}', mode = mode))
+      return
 
-          else:
-            c = Char.from_u8(gpu.memory[(row * mode.width + col) * 2], gpu.memory[(row * mode.width + col) * 2 + 1])
+    self.frames_written = True
 
-          self.display.machine.DEBUG('  c=%s', c)
+  def _move_cursor(self, buff, line):
+    if line < self.cursor:
+      buff += ('\033[%dF' % (self.cursor - line)).encode('ascii')
 
-          char = F('\033[{blink:d};{fg:d};{bg:d}m{char}\033[0m',
-                   blink = 5 if c.blink == 1 else 0,
-                   fg = palette_fg[c.fg],
-                   bg = palette_bg[c.bg],
-                   char = ' ' if c.codepoint == 0 else chr(c.codepoint)
-                   )
-          line.append(char)
+    elif line > self.cursor:
+      buff += ('\033[%dE' % (line - self.cursor)).encode('ascii')
 
-        screen.append(''.join(line))
+    self.cursor = line
 
-      def __line(l):
-        return [ord(c) for c in l] + [ord('\n')]
+  def _render_text_row(self, buff, gpu, mode, row):
+    memory = gpu.memory
+    start = row * mode.row_size
+    cells = memory[start:start + mode.row_size]
 
-      if self.first_tick:
-        self.first_tick = False
-      else:
-        self.write(__line(F('\033[{rows:d}F', rows = mode.height + 3)))
+    if mode.depth == 1:
+      prefix = CELL_PREFIXES[DEFAULT_CHAR_ATTRS]
 
-      self.write(__line('-' * mode.width))
-      for line in screen:
-        self.write(__line(line))
-      self.write(__line('-' * mode.width))
+      for codepoint in cells:
+        buff += prefix
+        buff.append((codepoint & 0x7F) or 0x20)
+        buff += CELL_SUFFIX
 
     else:
-      self.display.machine.WARN(F('Unhandled gpu mode: mode={mode}', mode = gpu.active_mode))
+      for i in range(0, mode.row_size, 2):
+        buff += CELL_PREFIXES[cells[i + 1]]
+        buff.append((cells[i] & 0x7F) or 0x20)
+        buff += CELL_SUFFIX
+
+    buff.append(0x0A)
+
+  def _refresh_text(self, gpu, mode):
+    if mode.depth not in (1, 2):
+      self.display.machine.WARN(F('Unhandled character depth: mode={mode}', mode = mode))
+      return
+
+    buff = self.buffer
+    del buff[:]
+
+    if self.drawn_mode is None or self.drawn_mode != mode:
+      gpu.clear_dirty()
+
+      if self.drawn_mode is not None:
+        self._move_cursor(buff, 0)
+
+      border = b'-' * mode.width + b'\n'
+
+      buff += border
+      for row in range(0, mode.height):
+        self._render_text_row(buff, gpu, mode, row)
+      buff += border
+
+      self.drawn_mode = mode
+      self.cursor = mode.height + 2
+
+    else:
+      rows = gpu.clear_dirty()
+      rows = range(0, mode.height) if rows is None else sorted([row for row in rows if row < mode.height])
+
+      if not rows:
+        self.display.machine.DEBUG('Display: no change')
+        return
+
+      for row in rows:
+        self._move_cursor(buff, row + 1)
+        self._render_text_row(buff, gpu, mode, row)
+        self.cursor = row + 2
+
+      self._move_cursor(buff, mode.height + 2)
+
+    self.write(buff)
 
 class Display(Device):
-  def __init__(self, machine, name, gpu = None, stream_out = None, *args, **kwargs):
+  def __init__(self, machine, name, gpu = None, stream_out = None, frames_out = None, frames_format = None, *args, **kwargs):
     super(Display, self).__init__(machine, 'display', name, *args, **kwargs)
 
     self.gpu = gpu
     self.stream_out = stream_out
 
+    self.frames_out = frames_out
+    self.frames_writer = None
+
+    if frames_out is not None:
+      frames_format = frames_format or 'ppm'
+
+      if frames_format not in FRAME_WRITERS:
+        raise InvalidResourceError(F('Unknown frame format: format={format}', format = frames_format))
+
+      self.frames_writer = FRAME_WRITERS[frames_format](frames_out)
+
     self.gpu.master = self
 
     self.refresh_task = DisplayRefreshTask(self)
@@ -223,7 +528,16 @@ class Display(Device):
     gpu = Display.get_slave_gpu(machine, config, section)
     stream_out =  OutputStream.create(machine, config.get(section, 'stream_out', '<stdout>'))
 
-    return Display(machine, section, gpu = gpu, stream_out = stream_out)
+    frames_out = config.get(section, 'frames_out', None)
+    frames_format = config.get(section, 'frames_format', None)
+
+    if frames_out is not None:
+      if frames_format is None:
+        frames_format = 'y4m' if frames_out.endswith('.y4m') else 'ppm'
+
+      frames_out = OutputStream.create(machine, frames_out)
+
+    return Display(machine, section, gpu = gpu, stream_out = stream_out, frames_out = frames_out, frames_format = frames_format)
 
   def boot(self):
     self.machine.DEBUG('Display.boot')
@@ -236,6 +550,12 @@ class Display(Device):
 
     self.machine.tenh(F('display: generic {name} connected to gpu {gpu}, output stream {stream}', name = self.name, gpu = self.gpu.name, stream = self.stream_out))
 
+  def forked(self):
+    self.stream_out.forked()
+
+    if self.frames_out is not None:
+      self.frames_out.forked()
+
   def halt(self):
     self.machine.DEBUG('Display.halt')
 
@@ -244,6 +564,10 @@ class Display(Device):
     self.machine.reactor.remove_task(self.refresh_task)
     self.gpu.halt()
 
+    if self.frames_out is not None:
+      self.frames_out.flush()
+      self.frames_out.close()
+
     self.machine.DEBUG('Display: halted')
 
 
@@ -263,7 +587,10 @@ class SimpleVGAMemoryPage(ExternalMemoryPage):
     return self.data[self.dev.bank_offsets[self.dev.active_bank] + self.offset + offset]
 
   def put(self, offset, b):
-    self.data[self.dev.bank_offsets[self.dev.active_bank] + self.offset + offset] = b
+    offset += self.dev.bank_offsets[self.dev.active_bank] + self.offset
+
+    self.data[offset] = b
+    self.dev.dirty_rows.add(offset // self.dev.row_size)
 
 
 class SimpleVGAMMIOMemoryPage(MMIOMemoryPage):
@@ -374,6 +701,12 @@ class SimpleVGA(Device):
     self.active_mode = None
     self.boot_mode = boot_mode or DEFAULT_BOOT_MODE
 
+    # Damage tracking - set of modified rows, and a flag signaling the whole
+    # screen needs to be redrawn.
+    self.row_size = self.boot_mode.row_size
+    self.dirty_rows = set()
+    self.dirty_all = True
+
     if self.boot_mode not in self.modes:
       raise InvalidResourceError(F('Boot mode not available: boot_mode={mode}, modes={modes}', mode = self.boot_mode, modes = self.modes))
 
@@ -381,7 +714,7 @@ class SimpleVGA(Device):
       if mode.required_memory > self.memory_size:
         raise InvalidResourceError(F('Not enough memory for mode: mode={mode}, required={bytes_required:d} bytes, available={bytes_available:d} bytes', mode = mode, bytes_required = mode.required_memory, bytes_available = self.memory_size))
 
-    self.memory = self.data = array.array('B', [0 for _ in range(0, self.memory_size)])
+    self.memory = self.data = bytearray(self.memory_size)
     self.bank_offsets = list(range(0, self.memory_size, self.memory_size // self.memory_banks))
     self.pages_per_bank = self.memory_size // PAGE_SIZE // self.memory_banks
 
@@ -421,6 +754,24 @@ class SimpleVGA(Device):
              mode = self.active_mode.to_pretty_string() if self.active_mode is not None else (self.boot_mode.to_pretty_string() + ' boot')
              )
 
+  def save_state(self, parent):
+    state = parent.add_child(self.name, SimpleVGAState())
+
+    mode = self.active_mode
+
+    state.mode = [mode.type, mode.width, mode.height, mode.depth] if mode is not None else None
+    state.bank = self.active_bank
+    state.memory = bytearray(self.memory)
+
+  def load_state(self, state):
+    self.memory[:] = state.memory
+    self.active_bank = state.bank
+
+    if state.mode is not None:
+      self.set_mode(Mode(*state.mode))
+
+    self.dirty_all = True
+
   def reset(self):
     self.state = None
     self.active_mode = None
@@ -429,8 +780,30 @@ class SimpleVGA(Device):
     for pg in self.pages:
       pg.clear()
 
+    self.dirty_all = True
+
   def set_mode(self, mode):
     self.active_mode = mode
+    self.row_size = mode.row_size
+
+    self.dirty_all = True
+
+  def clear_dirty(self):
+    """
+    Reset damage tracking.
+
+    :rtype: set
+    :returns: set of rows modified since the last call, or ``None`` if the
+      whole screen has been modified.
+    """
+
+    rows, self.dirty_rows = self.dirty_rows, set()
+
+    if self.dirty_all is True:
+      self.dirty_all = False
+      return None
+
+    return rows
 
   def boot(self):
     self.machine.DEBUG('SimpleVGA.boot')
@@ -161,6 +161,13 @@ class StreamIOTerminal(Terminal):
 
     self.machine.DEBUG('Standard terminal halted.')
 
+  def forked(self):
+    for stream in self._streams_in:
+      stream.forked()
+
+    if self._stream_out is not None:
+      self._stream_out.forked()
+
 class StandardIOTerminal(StreamIOTerminal):
   @staticmethod
   def create_from_config(machine, config, section):
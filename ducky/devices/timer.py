@@ -0,0 +1,333 @@
+"""
+High-resolution programmable timer.
+
+Timer provides a free-running, 64-bit counter of nanoseconds, driven by
+machine's clock, and a set of comparators. Each comparator can be programmed
+to trigger its own IRQ once, after a given interval, or periodically.
+
+Counter is read by reading ``COUNTER_LO`` port first - this latches the whole
+counter, and the upper half can be then read from ``COUNTER_HI`` port.
+
+Each comparator has its own set of ports, starting at
+``FIRST_COMPARATOR + index * COMPARATOR_PORTS_SIZE``. Interval, in
+nanoseconds, is set by writing ``INTERVAL_LO`` and ``INTERVAL_HI`` ports,
+and comparator is armed by writing ``TIMER_ENABLED`` flag (optionally with
+``TIMER_PERIODIC`` flag) into its ``CONTROL`` port. Writing ``0`` disarms
+the comparator.
+"""
+
+import enum
+
+from . import Device, MMIOMemoryPage
+from ..errors import InvalidResourceError, ExceptionList
+from ..mm import UINT8_FMT, addr_to_page, u16_t, u32_t, UINT32_FMT
+from ..interfaces import IReactorTask
+from ..hdt import HDTEntry_Device
+from ..snapshot import SnapshotNode
+
+DEFAULT_MMIO_ADDRESS = 0x8500
+DEFAULT_IRQ = 0x03
+DEFAULT_COMPARATORS = 4
+
+#: Maximal number of comparators - their ports must fit into one page
+MAX_COMPARATORS = 8
+
+TIMER_ENABLED  = 0x00000001  #: Comparator is armed
+TIMER_PERIODIC = 0x00000002  #: Comparator is re-armed after triggering its IRQ
+
+TIMER_USER = TIMER_ENABLED | TIMER_PERIODIC  #: Flags that user can set
+
+class TimerPorts(enum.IntEnum):
+  COUNTER_LO       = 0x00
+  COUNTER_HI       = 0x04
+  COMPARATORS      = 0x08
+
+  FIRST_COMPARATOR = 0x10
+
+class ComparatorPorts(enum.IntEnum):
+  CONTROL     = 0x00
+  INTERVAL_LO = 0x04
+  INTERVAL_HI = 0x08
+  IRQ         = 0x0C
+
+COMPARATOR_PORTS_SIZE = 0x10
+
+class HDTEntry_Timer(HDTEntry_Device):
+  _fields_ = HDTEntry_Device.ENTRY_HEADER + [
+    ('mmio_address', u32_t),
+    ('irq',          u16_t),
+    ('comparators',  u16_t)
+  ]
+
+  def __init__(self, logger, config, section):
+    super(HDTEntry_Timer, self).__init__(logger, section, 'High-resolution timer')
+
+    self.mmio_address = config.getint(section, 'mmio-address', DEFAULT_MMIO_ADDRESS)
+    self.irq = config.getint(section, 'irq', DEFAULT_IRQ)
+    self.comparators = config.getint(section, 'comparators', DEFAULT_COMPARATORS)
+
+    logger.debug('%s: mmio-address=%s, irq=%s, comparators=%s', self.__class__.__name__, UINT32_FMT(self.mmio_address), self.irq, self.comparators)
+
+class TimerState(SnapshotNode):
+  def __init__(self):
+    super(TimerState, self).__init__('comparators')
+
+class TimerMMIOMemoryPage(MMIOMemoryPage):
+  def read_u32(self, offset):
+    self.DEBUG('%s.read_u32: offset=%s', self.__class__.__name__, UINT8_FMT(offset))
+
+    dev = self._device
+
+    if offset == TimerPorts.COUNTER_LO:
+      dev.latch_counter()
+      return dev.latched_counter & 0xFFFFFFFF
+
+    if offset == TimerPorts.COUNTER_HI:
+      return (dev.latched_counter >> 32) & 0xFFFFFFFF
+
+    if offset == TimerPorts.COMPARATORS:
+      return len(dev.comparators)
+
+    comparator, port = dev.get_comparator(offset)
+
+    if comparator is not None:
+      if port == ComparatorPorts.CONTROL:
+        return comparator.flags
+
+      if port == ComparatorPorts.INTERVAL_LO:
+        return comparator.interval & 0xFFFFFFFF
+
+      if port == ComparatorPorts.INTERVAL_HI:
+        return (comparator.interval >> 32) & 0xFFFFFFFF
+
+      if port == ComparatorPorts.IRQ:
+        return comparator.irq
+
+    self.WARN('%s.read_u32: attempt to read unhandled MMIO offset: offset=%s', self.__class__.__name__, UINT8_FMT(offset))
+    return 0x00000000
+
+  def write_u32(self, offset, value):
+    self.DEBUG('%s.write_u32: offset=%s, value=%s', self.__class__.__name__, UINT8_FMT(offset), UINT32_FMT(value))
+
+    value &= 0xFFFFFFFF
+
+    comparator, port = self._device.get_comparator(offset)
+
+    if comparator is not None:
+      if port == ComparatorPorts.CONTROL:
+        comparator.set_flags(value)
+        return
+
+      if port == ComparatorPorts.INTERVAL_LO:
+        comparator.interval = (comparator.interval & 0xFFFFFFFF00000000) | value
+        return
+
+      if port == ComparatorPorts.INTERVAL_HI:
+        comparator.interval = (comparator.interval & 0x00000000FFFFFFFF) | (value << 32)
+        return
+
+    self.WARN('%s.write_u32: attempt to write unhandled MMIO offset: offset=%s, value=%s', self.__class__.__name__, UINT8_FMT(offset), UINT32_FMT(value))
+
+class Comparator(object):
+  """
+  One of timer's comparators.
+
+  :param ducky.devices.timer.Timer timer: timer this comparator belongs to.
+  :param int index: index of this comparator.
+  :param int irq: IRQ triggered by this comparator.
+  """
+
+  def __init__(self, timer, index, irq):
+    self.timer = timer
+    self.index = index
+    self.irq = irq
+
+    self.flags = 0x00000000
+    self.interval = 0
+    self.deadline = None
+
+  def __repr__(self):
+    return '<Comparator #%i: irq=%s, flags=%s, interval=%s, deadline=%s>' % (self.index, self.irq, UINT32_FMT(self.flags), self.interval, self.deadline)
+
+  def set_flags(self, flags):
+    """
+    Set comparator's flags, and arm or disarm it accordingly. Interval is
+    measured from this moment.
+    """
+
+    self.flags = flags & TIMER_USER
+
+    if self.flags & TIMER_ENABLED and self.interval > 0:
+      self.deadline = self.timer.machine.clock.now() + self.interval
+
+    else:
+      self.flags &= ~TIMER_ENABLED
+      self.deadline = None
+
+    self.timer.update_deadline()
+
+  def fire(self, now):
+    """
+    Trigger comparator's IRQ, and re-arm it if it's periodic. Periods missed
+    since the deadline are skipped.
+
+    :param int now: current time of machine's clock.
+    """
+
+    self.timer.machine.DEBUG('%s.fire: now=%s', self, now)
+
+    self.timer.machine.trigger_irq(self)
+
+    if self.flags & TIMER_PERIODIC:
+      self.deadline += ((now - self.deadline) // self.interval + 1) * self.interval
+
+    else:
+      self.flags &= ~TIMER_ENABLED
+      self.deadline = None
+
+class TimerTask(IReactorTask):
+  """
+  Checks comparators' deadlines, and fires those that expired. Task is
+  runnable only while there is at least one armed comparator.
+  """
+
+  def __init__(self, timer):
+    self.timer = timer
+
+  def run(self):
+    timer = self.timer
+
+    now = timer.machine.clock.now()
+
+    if now < timer.deadline:
+      return
+
+    for comparator in timer.comparators:
+      if comparator.deadline is not None and comparator.deadline <= now:
+        comparator.fire(now)
+
+    timer.update_deadline()
+
+class Timer(Device):
+  """
+  High-resolution programmable timer.
+
+  :param ducky.machine.Machine machine: machine this device belongs to.
+  :param str name: name of this device.
+  :param u32_t mmio_address: base address of MMIO ports.
+  :param int irq: IRQ of the first comparator, following comparators use
+    subsequent IRQs.
+  :param int comparators: number of comparators.
+  """
+
+  def __init__(self, machine, name, mmio_address = None, irq = None, comparators = None, *args, **kwargs):
+    super(Timer, self).__init__(machine, 'timer', name, *args, **kwargs)
+
+    self.irq = irq if irq is not None else DEFAULT_IRQ
+
+    comparators = comparators if comparators is not None else DEFAULT_COMPARATORS
+
+    if not 0 < comparators <= MAX_COMPARATORS:
+      raise InvalidResourceError('Number of timer comparators must be between 1 and %i' % MAX_COMPARATORS)
+
+    if self.irq < ExceptionList.FIRST_HW or self.irq + comparators - 1 > ExceptionList.LAST_HW:
+      raise InvalidResourceError('Timer IRQs must be hardware IRQs')
+
+    self.comparators = [Comparator(self, i, self.irq + i) for i in range(0, comparators)]
+
+    #: The nearest deadline of all comparators, ``None`` when no comparator is armed.
+    self.deadline = None
+    self.latched_counter = 0
+
+    self.timer_task = TimerTask(self)
+
+    self._mmio_address = mmio_address or DEFAULT_MMIO_ADDRESS
+    self._mmio_page = None
+
+  @staticmethod
+  def create_from_config(machine, config, section):
+    return Timer(machine,
+                 section,
+                 mmio_address = config.getint(section, 'mmio-address', DEFAULT_MMIO_ADDRESS),
+                 irq = config.getint(section, 'irq', DEFAULT_IRQ),
+                 comparators = config.getint(section, 'comparators', DEFAULT_COMPARATORS))
+
+  @staticmethod
+  def create_hdt_entries(logger, config, section):
+    return [HDTEntry_Timer(logger, config, section)]
+
+  def save_state(self, parent):
+    state = parent.add_child(self.name, TimerState())
+
+    state.comparators = [[comparator.flags, comparator.interval, comparator.deadline] for comparator in self.comparators]
+
+  def load_state(self, state):
+    for comparator, (flags, interval, deadline) in zip(self.comparators, state.comparators):
+      comparator.flags = flags
+      comparator.interval = interval
+      comparator.deadline = deadline
+
+    self.update_deadline()
+
+  def __repr__(self):
+    return 'high-resolution timer on [%s] as %s, %i comparators, irq %i' % (UINT32_FMT(self._mmio_address), self.name, len(self.comparators), self.irq)
+
+  def get_comparator(self, offset):
+    """
+    Translate MMIO offset to comparator and its port.
+
+    :param int offset: offset in timer's MMIO page.
+    :returns: tuple of comparator and port offset, ``(None, None)`` when
+      offset does not belong to any comparator.
+    """
+
+    if offset < TimerPorts.FIRST_COMPARATOR:
+      return None, None
+
+    index, port = divmod(offset - TimerPorts.FIRST_COMPARATOR, COMPARATOR_PORTS_SIZE)
+
+    if index >= len(self.comparators):
+      return None, None
+
+    return self.comparators[index], port
+
+  def latch_counter(self):
+    self.latched_counter = self.machine.clock.now() & 0xFFFFFFFFFFFFFFFF
+
+  def next_deadline(self):
+    return self.deadline
+
+  def update_deadline(self):
+    """
+    Find the nearest deadline, and suspend or wake up timer task accordingly.
+    """
+
+    deadlines = [comparator.deadline for comparator in self.comparators if comparator.deadline is not None]
+
+    self.deadline = min(deadlines) if deadlines else None
+
+    if self.deadline is None:
+      self.machine.reactor.task_suspended(self.timer_task)
+
+    else:
+      self.machine.reactor.task_runnable(self.timer_task)
+      self.machine.clock.wake_up()
+
+  def boot(self):
+    self.machine.DEBUG('%s.boot', self.__class__.__name__)
+
+    self._mmio_page = TimerMMIOMemoryPage(self, self.machine.memory, addr_to_page(self._mmio_address))
+    self.machine.memory.register_page(self._mmio_page)
+
+    self.machine.reactor.add_task(self.timer_task)
+    self.machine.clock.add_deadline_source(self.next_deadline)
+    self.update_deadline()
+
+    self.machine.tenh('timer: %s', self)
+
+  def halt(self):
+    self.machine.DEBUG('%s.halt', self.__class__.__name__)
+
+    self.machine.memory.unregister_page(self._mmio_page)
+    self.machine.reactor.remove_task(self.timer_task)
+    self.machine.clock.remove_deadline_source(self.next_deadline)
@@ -4,6 +4,11 @@ It does not care about dimensions of the display, it kknow only how to
 "print" characters. Suited for the most basic output possible - just "print"
 chars by writing to this device, and you'll get this written into a stream
 attached to the frontend (``stdout``, file, ...).
+
+Besides the single-byte ``DATA`` port, device provides a write buffer: guest
+stores (physical) address of a string into ``BUFFER_ADDRESS`` port, and by
+storing its length into ``BUFFER_LENGTH`` port the whole string is passed to
+the frontend at once.
 """
 
 import enum
@@ -11,11 +16,18 @@ from . import DeviceFrontend, DeviceBackend, MMIOMemoryPage
 from ..mm import UINT8_FMT, addr_to_page, UINT32_FMT, u32_t
 from ..interfaces import IReactorTask
 from ..hdt import HDTEntry_Device
+from ..snapshot import SnapshotNode
 
 DEFAULT_MMIO_ADDRESS = 0x8200
 
 class TTYPorts(enum.IntEnum):
-  DATA = 0x00
+  DATA           = 0x00
+  BUFFER_ADDRESS = 0x04
+  BUFFER_LENGTH  = 0x08
+
+class TTYState(SnapshotNode):
+  def __init__(self):
+    super(TTYState, self).__init__('buffer_address')
 
 class TTYMMIOMemoryPage(MMIOMemoryPage):
   def write_u8(self, offset, value):
@@ -28,6 +40,19 @@ class TTYMMIOMemoryPage(MMIOMemoryPage):
 
     self.WARN('%s.write_u8: attempt to write to a virtual page: offset=%s', self.__class__.__name__, UINT8_FMT(offset))
 
+  def write_u32(self, offset, value):
+    self.DEBUG('%s.write_u32: offset=%s, value=%s', self.__class__.__name__, UINT8_FMT(offset), UINT32_FMT(value))
+
+    if offset == TTYPorts.BUFFER_ADDRESS:
+      self._device.buffer_address = value
+      return
+
+    if offset == TTYPorts.BUFFER_LENGTH:
+      self._device.write_buffer(value)
+      return
+
+    self.WARN('%s.write_u32: attempt to write to a virtual page: offset=%s', self.__class__.__name__, UINT8_FMT(offset))
+
 class HDTEntry_TTY(HDTEntry_Device):
   _fields_ = HDTEntry_Device.ENTRY_HEADER + [
     ('mmio_address', u32_t)
@@ -49,20 +74,24 @@ class FrontendFlushTask(IReactorTask):
     self._queue = queue
     self._stream = stream
 
+    self._buffer = bytearray()
+
   def set_output(self, stream):
     self._stream = stream
 
   def run(self):
     self._machine.DEBUG('%s.run', self.__class__.__name__)
 
-    b = self._queue.read_out()
-    if b is None:
+    buff = self._buffer
+    del buff[:]
+
+    if self._queue.drain_out(buff) == 0:
       self._machine.DEBUG('%s.run: no events', self.__class__.__name__)
       self._frontend.sleep_flush()
       return
 
-    self._machine.DEBUG('%s.run: event=%r', self.__class__.__name__, b)
-    self._stream.write([b])
+    self._machine.DEBUG('%s.run: events=%r', self.__class__.__name__, buff)
+    self._stream.write(buff)
 
 class Frontend(DeviceFrontend):
   def __init__(self, machine, name):
@@ -139,6 +168,8 @@ class Backend(DeviceBackend):
 
     self.comm_queue = machine.comm_channel.create_queue(name)
 
+    self.buffer_address = 0x00000000
+
   @staticmethod
   def create_from_config(machine, config, section):
     return Backend(machine, section,
@@ -151,14 +182,35 @@ class Backend(DeviceBackend):
   def __repr__(self):
     return 'basic tty on [%s] as %s' % (UINT32_FMT(self._mmio_address), self.name)
 
+  def save_state(self, parent):
+    state = parent.add_child(self.name, TTYState())
+
+    state.buffer_address = self.buffer_address
+
+  def load_state(self, state):
+    self.buffer_address = state.buffer_address
+
   def tenh(self, s, *args):
     self.machine.DEBUG('%s.tenh: s="%s", args=%s', self.__class__.__name__, s, args)
 
     s = s % args
 
-    for c in s:
-      self.comm_queue.write_out(ord(c))
+    self.comm_queue.write_out_many([ord(c) for c in s])
+    self.frontend.wakeup_flush()
+
+  def write_buffer(self, length):
+    """
+    Pass content of guest's write buffer to the frontend.
+
+    :param int length: number of bytes, starting at ``buffer_address``.
+    """
+
+    self.machine.DEBUG('%s.write_buffer: address=%s, length=%s', self.__class__.__name__, UINT32_FMT(self.buffer_address), length)
+
+    if length == 0:
+      return
 
+    self.comm_queue.write_out_many(self.machine.memory.read_bytes(self.buffer_address, length))
     self.frontend.wakeup_flush()
 
   def tenh_enable(self):
@@ -115,6 +115,10 @@ class UnknownFileError(AssemblerError):
   def __init__(self, **kwargs):
     super(UnknownFileError, self).__init__(message = 'Unknown file: {info}'.format(**kwargs), **kwargs)
 
+class PreprocessorError(AssemblerError):
+  def __init__(self, **kwargs):
+    super(PreprocessorError, self).__init__(message = 'Preprocessor error: {info}'.format(**kwargs), **kwargs)
+
 class DisassembleMismatchError(AssemblerError):
   def __init__(self, **kwargs):
     super(DisassembleMismatchError, self).__init__(message = 'Disassembled instruction does not match input: {info}'.format(**kwargs), **kwargs)
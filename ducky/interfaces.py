@@ -43,6 +43,17 @@ class IMachineWorker(object):
 
     pass
 
+  def forked(self):
+    """
+    Called in a child process, right after the machine has been cloned by
+    :py:meth:`ducky.machine.Machine.fork`. Memory is shared with the parent
+    in copy-on-write manner, but open files, shared mmaps and similar
+    resources are still shared, and object should replace them with its
+    own, private ones.
+    """
+
+    pass
+
   def halt(self):
     """
     Terminate service. It will never be requested again, object can destroy
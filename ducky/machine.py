@@ -30,9 +30,22 @@ from .boot import ROMLoader
 
 from functools import partial
 
+def status_to_exit_code(status):
+  """
+  Translate status of a child process, as returned by ``os.waitpid``, to its
+  exit code.
+
+  :param int status: status of the child.
+  :rtype: int
+  :returns: exit code of the child, or negative number of the signal that
+    killed the child.
+  """
+
+  return os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
 class MachineState(SnapshotNode):
   def __init__(self):
-    super(MachineState, self).__init__('nr_cpus', 'nr_cores')
+    super(MachineState, self).__init__('nr_cpus', 'nr_cores', 'clock', 'irqs')
 
   def get_cpu_states(self):
     return [__state for __name, __state in iteritems(self.get_children()) if __name.startswith('cpu')]
@@ -59,6 +72,9 @@ class CommQueue(object):
   def write_in(self, o):
     self.queue_in.append(o)
 
+  def write_out_many(self, items):
+    self.queue_out.extend(items)
+
   def read_out(self):
     q = self.queue_out
 
@@ -69,6 +85,25 @@ class CommQueue(object):
 
     return q.popleft() if q else None
 
+  def drain_out(self, buff):
+    """
+    Move all pending outgoing items to a buffer.
+
+    :param bytearray buff: items are appended to this buffer.
+    :rtype: int
+    :returns: number of items moved.
+    """
+
+    q = self.queue_out
+    if not q:
+      return 0
+
+    cnt = len(q)
+    buff.extend(q)
+    q.clear()
+
+    return cnt
+
 class CommChannel(object):
   def __init__(self, machine):
     self.machine = machine
@@ -87,6 +122,213 @@ class CommChannel(object):
     del self._queues[name]
 
 
+#: Source of host's monotonic time, in seconds
+_monotonic = getattr(time, 'monotonic', time.time)
+
+#: Default time of one instruction in virtual clock mode, in nanoseconds
+DEFAULT_INSTRUCTION_TIME = 10
+
+class Clock(object):
+  """
+  Base class of machine clocks. Clock measures time since its creation, with
+  nanosecond resolution.
+
+  Devices planning to wake up the machine at some moment in the future (e.g.
+  timers) can register their deadline sources - callables that return the
+  nearest deadline of the device, or ``None``.
+
+  :param ducky.machine.Machine machine: machine this clock belongs to.
+  """
+
+  def __init__(self, machine):
+    self.machine = machine
+
+    self.deadline_sources = []
+
+  def now(self):
+    """
+    :rtype: int
+    :returns: nanoseconds since the clock was created.
+    """
+
+    raise NotImplementedError('%s does not implement now method' % self.__class__.__name__)
+
+  def add_deadline_source(self, source):
+    self.deadline_sources.append(source)
+    self.wake_up()
+
+  def remove_deadline_source(self, source):
+    self.deadline_sources.remove(source)
+
+  def next_deadline(self):
+    """
+    :rtype: int
+    :returns: the nearest of deadlines of all registered sources, or ``None``
+      if there is none.
+    """
+
+    deadlines = [deadline for deadline in [source() for source in self.deadline_sources] if deadline is not None]
+
+    return min(deadlines) if deadlines else None
+
+  def restore(self, stamp):
+    """
+    Set clock to a given time, e.g. when machine is restored from a snapshot.
+
+    :param int stamp: new time, in nanoseconds.
+    """
+
+    raise NotImplementedError('%s does not implement restore method' % self.__class__.__name__)
+
+  def wake_up(self):
+    """
+    Called when something happened that may allow the clock to move forward,
+    e.g. a core became idle, or a deadline source armed a new deadline.
+    """
+
+    pass
+
+  def boot(self):
+    pass
+
+  def halt(self):
+    pass
+
+class HostClock(Clock):
+  """
+  Machine clock, backed by host's monotonic time.
+  """
+
+  def __init__(self, machine):
+    super(HostClock, self).__init__(machine)
+
+    self.start = _monotonic()
+
+  def now(self):
+    return int((_monotonic() - self.start) * 1000000000)
+
+  def restore(self, stamp):
+    self.start = _monotonic() - float(stamp) / 1000000000
+
+class ClockFastForwardTask(IReactorTask):
+  """
+  When all living cores are idle, there are no IRQs waiting for delivery,
+  and there is no IO pending, nothing but a timer can wake the machine up.
+  This task then moves virtual clock to the nearest deadline.
+
+  When there is no deadline to move to, task suspends itself, and it's made
+  runnable again by :py:meth:`ducky.machine.VirtualClock.wake_up`.
+
+  :param ducky.machine.VirtualClock clock: clock to move.
+  """
+
+  def __init__(self, clock):
+    self.clock = clock
+
+  def run(self):
+    clock = self.clock
+    machine = clock.machine
+
+    if not machine.living_cores:
+      return
+
+    for core in machine.living_cores:
+      if core.idle is not True:
+        return
+
+    if machine.reactor.events or any(machine.irq_router_task.queue):
+      return
+
+    deadline = clock.next_deadline()
+
+    if deadline is None:
+      machine.reactor.task_suspended(self)
+      return
+
+    if deadline <= clock.now():
+      return
+
+    if machine.reactor.has_pending_io():
+      return
+
+    clock.skip_to(deadline)
+
+class VirtualClock(Clock):
+  """
+  Machine clock, derived from number of executed instructions, and time
+  skipped while the machine was idle. As long as the machine runs the same
+  code, with the same input, it observes the same time.
+
+  :param int instruction_time: time of one instruction, in nanoseconds.
+  """
+
+  def __init__(self, machine, instruction_time = None):
+    super(VirtualClock, self).__init__(machine)
+
+    self.instruction_time = instruction_time or DEFAULT_INSTRUCTION_TIME
+    self.skipped = 0
+
+    self._cores = []
+    self._cnt = None
+
+    self.fast_forward_task = ClockFastForwardTask(self)
+
+  def now(self):
+    if not self._cores:
+      return self.skipped
+
+    cnt = self._cnt
+
+    return max([core.registers[cnt] for core in self._cores]) * self.instruction_time + self.skipped
+
+  def skip_to(self, stamp):
+    """
+    Move clock forward, to a given time.
+
+    :param int stamp: new time, in nanoseconds. If it lies in the past, clock
+      is not changed.
+    """
+
+    now = self.now()
+
+    if stamp <= now:
+      return
+
+    self.machine.DEBUG('%s.skip_to: now=%s, stamp=%s', self.__class__.__name__, now, stamp)
+
+    self.skipped += stamp - now
+
+  def restore(self, stamp):
+    self.skipped = 0
+    self.skipped = stamp - self.now()
+
+  def wake_up(self):
+    reactor = self.machine.reactor
+
+    # Clock may not be booted yet, or it's been halted already
+    if self.fast_forward_task not in reactor.tasks:
+      return
+
+    reactor.task_runnable(self.fast_forward_task)
+
+  def boot(self):
+    from .cpu.registers import Registers
+
+    self._cnt = Registers.CNT
+    self._cores = self.machine.cores
+
+    self.machine.reactor.add_task(self.fast_forward_task)
+    self.machine.reactor.task_runnable(self.fast_forward_task)
+
+  def halt(self):
+    self.machine.reactor.remove_task(self.fast_forward_task)
+
+#: Available machine clocks
+CLOCKS = {
+  'host':    HostClock,
+  'virtual': VirtualClock
+}
+
 class IRQRouterTask(IReactorTask):
   """
   This task is responsible for distributing triggered IRQs between CPU cores.
@@ -129,6 +371,13 @@ class IRQRouterTask(IReactorTask):
     if not any(self.queue):
       self.machine.reactor.task_suspended(self)
 
+#: Policies of capturing machine's state when machine halts: ``never``
+#: captures nothing, ``on-error`` captures state when machine failed or any
+#: core exited with non-zero exit code, and ``always`` captures state every
+#: time. When state is not captured, ``last_state`` provides its lazy view.
+CAPTURE_STATE_POLICIES = ('never', 'on-error', 'always')
+DEFAULT_CAPTURE_STATE_POLICY = 'on-error'
+
 class HaltMachineTask(IReactorTask):
   def __init__(self, machine):
     self.machine = machine
@@ -192,6 +441,8 @@ class Machine(ISnapshotable, IMachineWorker):
 
     self.reactor = Reactor(self)
 
+    self.clock = HostClock(self)
+
     # Setup logging
     self.LOGGER = logger or create_logger()
     self.DEBUG = self.LOGGER.debug
@@ -231,6 +482,16 @@ class Machine(ISnapshotable, IMachineWorker):
     self.devices = collections.defaultdict(dict)
 
     self.last_state = None
+    self.capture_state_on_halt = DEFAULT_CAPTURE_STATE_POLICY
+
+    #: Set when machine is halted because of an unhandled exception.
+    self.failed = False
+
+    #: PIDs of machine's clones, created by :py:meth:`Machine.fork`.
+    self.children = []
+
+    #: PIDs of processes saving checkpoints, see :py:meth:`Machine.checkpoint`.
+    self.checkpoints = []
 
   @property
   def cores(self):
@@ -306,20 +567,58 @@ class Machine(ISnapshotable, IMachineWorker):
 
     raise InvalidResourceError(F('No such storage: sid={sid:d}', sid = sid))
 
-  def save_state(self, parent):
+  def save_state(self, parent, dirty_only = False, lazy = False):
+    """
+    :param bool dirty_only: if set, only memory pages modified since the last
+      checkpoint are saved.
+    :param bool lazy: if set, state of CPUs, memory and devices is captured
+      only when it is accessed for the first time.
+    """
+
     state = parent.add_child('machine', MachineState())
 
     state.nr_cpus = self.nr_cpus
     state.nr_cores = self.nr_cores
 
-    for cpu in self.cpus:
-      cpu.save_state(state)
+    state.clock = self.clock.now()
+    state.irqs = [irq for irq, triggered in enumerate(self.irq_router_task.queue) if triggered is True]
+
+    parts = [('cpu{}'.format(cpu.id), cpu.save_state) for cpu in self.cpus]
+    if lazy is True:
+      # Pages are unregistered when machine halts, capture the current set of them
+      parts.append(('memory', partial(self.memory.save_state, dirty_only = dirty_only, pages = list(itervalues(self.memory.pages)))))
 
-    self.memory.save_state(state)
+    else:
+      parts.append(('memory', partial(self.memory.save_state, dirty_only = dirty_only)))
+    parts.append(('devices', self.save_devices_state))
+
+    for name, capture in parts:
+      if lazy is True:
+        state.add_lazy_child(name, capture)
+
+      else:
+        capture(state)
+
+  def save_devices_state(self, parent):
+    devices_state = parent.add_child('devices', SnapshotNode())
+
+    for devs in itervalues(self.devices):
+      for dev in itervalues(devs):
+        dev.save_state(devices_state)
 
   def load_state(self, state):
-    self.nr_cpus = state.nr_cpus
-    self.nr_cores = state.nr_cores
+    """
+    Restore machine from a snapshot. Machine must be configured the same way
+    it was when the snapshot was taken, and it is expected to be already
+    booted - restored state then replaces the initial one.
+
+    :param MachineState state: state of machine.
+    :raises ducky.errors.InvalidResourceError: when number of CPUs or cores
+      does not match the snapshot.
+    """
+
+    if state.nr_cpus != self.nr_cpus or state.nr_cores != self.nr_cores:
+      raise InvalidResourceError(F('CPU setup mismatch: snapshot={snapshot_cpus:d}x{snapshot_cores:d}, machine={machine_cpus:d}x{machine_cores:d}', snapshot_cpus = state.nr_cpus, snapshot_cores = state.nr_cores, machine_cpus = self.nr_cpus, machine_cores = self.nr_cores))
 
     for __cpu in self.cpus:
       cpu_state = state.get_children().get('cpu{}'.format(__cpu.id))
@@ -331,6 +630,22 @@ class Machine(ISnapshotable, IMachineWorker):
 
     self.memory.load_state(state.get_children()['memory'])
 
+    self.clock.restore(state.clock)
+
+    devices_state = state.get_children().get('devices')
+
+    if devices_state is not None:
+      for devs in itervalues(self.devices):
+        for dev in itervalues(devs):
+          if dev.name in devices_state.get_children():
+            dev.load_state(devices_state.get_child(dev.name))
+
+    for irq in state.irqs:
+      self.irq_router_task.queue[irq] = True
+      self.reactor.task_runnable(self.irq_router_task)
+
+    self.memory.clear_dirty_pages()
+
   def setup_devices(self):
     from .devices import get_driver
 
@@ -365,6 +680,22 @@ class Machine(ISnapshotable, IMachineWorker):
     # self.evt_address = machine_config.getint('cpu', 'evt-address', DEFAULT_EVT_ADDRESS)
     # self.pt_address = machine_config.getint('cpu', 'pt-address', DEFAULT_PT_ADDRESS)
 
+    clock = machine_config.get('machine', 'clock', 'host')
+
+    if clock not in CLOCKS:
+      raise InvalidResourceError(F('Unknown machine clock: clock={clock}', clock = clock))
+
+    if clock == 'virtual':
+      self.clock = VirtualClock(self, instruction_time = machine_config.getint('machine', 'instruction-time', DEFAULT_INSTRUCTION_TIME))
+
+    else:
+      self.clock = CLOCKS[clock](self)
+
+    self.capture_state_on_halt = machine_config.get('machine', 'capture-state-on-halt', DEFAULT_CAPTURE_STATE_POLICY)
+
+    if self.capture_state_on_halt not in CAPTURE_STATE_POLICIES:
+      raise InvalidResourceError(F('Unknown capture state policy: policy={policy}', policy = self.capture_state_on_halt))
+
     self.memory = mm.MemoryController(self, size = machine_config.getint('memory', 'size', 0x1000000))
 
     self.setup_devices()
@@ -431,6 +762,8 @@ class Machine(ISnapshotable, IMachineWorker):
     for __cpu in self.cpus:
       __cpu.boot()
 
+    self.clock.boot()
+
     self.running = True
 
   def run(self):
@@ -459,17 +792,89 @@ class Machine(ISnapshotable, IMachineWorker):
     for __cpu in self.cpus:
       __cpu.wake_up()
 
+  def fork(self):
+    """
+    Clone the machine into a child process, using ``os.fork()``. Guest memory
+    is shared with the child in copy-on-write manner, therefore cloning is
+    cheap even for a large, warmed-up machine. In the child, all devices and
+    the ROM loader are then given a chance to replace shared resources -
+    files, shared mmaps, output streams - by their private versions.
+
+    Machine must be in a quiescent state, i.e. not in the middle of
+    executing an instruction or running a reactor task. That holds before
+    :py:meth:`Machine.run` is called, or for a function scheduled by
+    :py:meth:`ducky.reactor.Reactor.add_call`.
+
+    :rtype: int
+    :returns: PID of the child in parent process, ``0`` in the child.
+    """
+
+    self.DEBUG('Machine.fork')
+
+    self.stdout.flush()
+    self.stderr.flush()
+
+    pid = os.fork()
+
+    if pid != 0:
+      self.DEBUG('Machine.fork: child=%s', pid)
+
+      self.children.append(pid)
+      return pid
+
+    # Neither clones nor checkpoint writers of the parent are our children
+    self.children = []
+    self.checkpoints = []
+
+    for devs in itervalues(self.devices):
+      for dev in itervalues(devs):
+        dev.forked()
+
+    self.rom_loader.forked()
+
+    return 0
+
+  def wait_children(self):
+    """
+    Wait for all clones of the machine to exit.
+
+    :rtype: list
+    :returns: list of ``(pid, exit code)`` pairs, in the order children were
+      created. Exit code of a child killed by a signal is the negative number
+      of the signal.
+    """
+
+    self.DEBUG('Machine.wait_children: children=%s', self.children)
+
+    exit_codes = []
+
+    for pid in self.children:
+      _, status = os.waitpid(pid, 0)
+
+      exit_codes.append((pid, status_to_exit_code(status)))
+
+    self.children = []
+
+    return exit_codes
+
   def die(self, exc):
     self.DEBUG('Machine.die: exc=%s', exc)
 
     self.EXCEPTION(exc)
 
+    self.failed = True
     self.halt()
 
   def halt(self):
     self.DEBUG('Machine.halt')
 
-    self.capture_state()
+    policy = self.capture_state_on_halt
+
+    if policy == 'always' or (policy == 'on-error' and (self.failed or any(core.exit_code != 0 for core in self.cores))):
+      self.capture_state()
+
+    else:
+      self.last_state = snapshot.VMState.lazy_vm_state(self)
 
     for __cpu in self.cpus:
       __cpu.halt()
@@ -484,6 +889,10 @@ class Machine(ISnapshotable, IMachineWorker):
 
     self.console.halt()
 
+    self.clock.halt()
+
+    self.wait_checkpoints()
+
     self.reactor.remove_task(self.irq_router_task)
     self.reactor.remove_task(self.check_living_cores_task)
 
@@ -499,16 +908,74 @@ class Machine(ISnapshotable, IMachineWorker):
     self.running = False
     self.halted = True
 
-  def capture_state(self, suspend = False):
+  def capture_state(self, suspend = False, parent = None):
     """
     Capture current state of the VM, and store it in it's `last_state` attribute.
 
     :param bool suspend: if `True`, suspend VM before taking snapshot.
+    :param str parent: if set, snapshot is incremental, containing only memory
+      pages modified since the last checkpoint, and ``parent`` is path to the
+      snapshot it builds upon.
     """
 
-    self.last_state = snapshot.VMState.capture_vm_state(self, suspend = suspend)
+    self.last_state = snapshot.VMState.capture_vm_state(self, suspend = suspend, parent = parent)
     return self.last_state
 
+  def checkpoint(self, filename, parent = None, compression = None):
+    """
+    Save snapshot of the VM into a file, without pausing the VM for the whole
+    serialization. See :py:meth:`ducky.snapshot.VMState.checkpoint_vm_state`.
+
+    To take a checkpoint of a running VM, schedule this method by
+    :py:meth:`ducky.reactor.Reactor.add_call`.
+
+    :param str filename: path to the snapshot file.
+    :param str parent: if set, snapshot is incremental, see
+      :py:meth:`Machine.capture_state`.
+    :param str compression: compression of sections in the file.
+    :rtype: int
+    :returns: PID of the process saving the snapshot.
+    """
+
+    self.DEBUG('Machine.checkpoint: filename=%s, parent=%s, compression=%s', filename, parent, compression)
+
+    self.wait_checkpoints(block = False)
+
+    pid = snapshot.VMState.checkpoint_vm_state(self, filename, parent = parent, compression = compression)
+    self.checkpoints.append(pid)
+
+    return pid
+
+  def wait_checkpoints(self, block = True):
+    """
+    Collect processes saving checkpoints.
+
+    :param bool block: if set, wait until all checkpoints are saved,
+      otherwise collect only those that already finished.
+    :rtype: list
+    :returns: list of ``(pid, exit code)`` pairs of collected processes.
+    """
+
+    self.DEBUG('Machine.wait_checkpoints: checkpoints=%s, block=%s', self.checkpoints, block)
+
+    exit_codes = []
+
+    for pid in self.checkpoints[:]:
+      _pid, status = os.waitpid(pid, 0 if block else os.WNOHANG)
+
+      if _pid == 0:
+        continue
+
+      exit_code = status_to_exit_code(status)
+
+      if exit_code != 0:
+        self.ERROR('Failed to save checkpoint: pid=%s, exit_code=%s', pid, exit_code)
+
+      self.checkpoints.remove(pid)
+      exit_codes.append((pid, exit_code))
+
+    return exit_codes
+
 def cmd_boot(console, cmd):
   """
   Setup HW, load binaries, init everything
@@ -547,10 +1014,8 @@ def cmd_snapshot(console, cmd):
 
   M = console.master.machine
 
-  state = snapshot.VMState.capture_vm_state(M)
-
   filename = 'ducky-core.{}'.format(os.getpid())
-  state.save(filename)
+  M.checkpoint(filename)
 
-  M.INFO('Snapshot saved as %s', filename)
-  console.writeln('Snapshot saved as %s', filename)
+  M.INFO('Snapshot is being saved as %s', filename)
+  console.writeln('Snapshot is being saved as %s', filename)
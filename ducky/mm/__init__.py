@@ -73,6 +73,39 @@ class MemoryPageState(SnapshotNode):
   def __init__(self, *args, **kwargs):
     super(MemoryPageState, self).__init__('index', 'content')
 
+class LazyMemoryPageState(MemoryPageState):
+  """
+  Page state whose content is read from a snapshot file when it is accessed
+  for the first time.
+
+  :param int index: index of the page.
+  :param loader: object providing content of the page.
+  :param int chunk: index of the chunk the page is stored in.
+  :param int offset: index of the page in the chunk.
+  """
+
+  def __init__(self, index, loader, chunk, offset):
+    self._content = None
+
+    super(LazyMemoryPageState, self).__init__()
+
+    self.index = index
+
+    self._loader = loader
+    self._chunk = chunk
+    self._offset = offset
+
+  @property
+  def content(self):
+    if self._content is None:
+      self._content = self._loader.load(self._chunk, self._offset)
+
+    return self._content
+
+  @content.setter
+  def content(self, content):
+    self._content = content
+
 class MemoryPage(object):
   """
   Base class for all memory pages of any kinds.
@@ -110,6 +143,8 @@ class MemoryPage(object):
 
     self.base_address = self.index * PAGE_SIZE
 
+    self.dirty_pages = controller.dirty_pages
+
   def __repr__(self):
     return '<%s index=%i, base=%s>' % (self.__class__.__name__, self.index, UINT32_FMT(self.base_address))
 
@@ -124,7 +159,7 @@ class MemoryPage(object):
     state = parent.add_child('page_{}'.format(self.index), MemoryPageState())
 
     state.index = self.index
-    state.content = [ord(i) if isinstance(i, str) else i for i in self.data]
+    state.content = bytearray(self.data)
 
     return state
 
@@ -133,8 +168,7 @@ class MemoryPage(object):
     Restore page from a snapshot.
     """
 
-    for i in range(0, PAGE_SIZE):
-      self.data[i] = state.content[i]
+    self.data[0:PAGE_SIZE] = state.content[0:PAGE_SIZE]
 
   def __len__(self):
     """
@@ -225,6 +259,34 @@ class MemoryPage(object):
 
     raise NotImplementedError('Not allowed to access memory on this address: page={}, offset={}'.format(self.index, offset))
 
+  def read_bytes(self, offset, length):
+    """
+    Read a continuous sequence of bytes.
+
+    By default, bytes are read one by one, using :py:meth:`read_u8`. Child
+    classes with a better access to their storage should override this method.
+
+    :param int offset: offset of the first requested byte.
+    :param int length: number of bytes to read.
+    :rtype: bytearray
+    """
+
+    return bytearray([self.read_u8(offset + i) for i in range(0, length)])
+
+  def write_bytes(self, offset, data):
+    """
+    Write a continuous sequence of bytes.
+
+    By default, bytes are written one by one, using :py:meth:`write_u8`. Child
+    classes with a better access to their storage should override this method.
+
+    :param int offset: offset of the first modified byte.
+    :param bytearray data: bytes to write.
+    """
+
+    for i, b in enumerate(data):
+      self.write_u8(offset + i, b)
+
 class AnonymousMemoryPage(MemoryPage):
   """
   "Anonymous" memory page - this page is just a plain array of bytes, and is
@@ -244,6 +306,8 @@ class AnonymousMemoryPage(MemoryPage):
     for i in range(0, PAGE_SIZE):
       self.data[i] = 0
 
+    self.dirty_pages.add(self.index)
+
   def read_u8(self, offset):
     self.DEBUG('%s.read_u8: page=%s, offset=%s', self.__class__.__name__, self.index, offset)
 
@@ -263,12 +327,14 @@ class AnonymousMemoryPage(MemoryPage):
     self.DEBUG('%s.do_write_u8: page=%s, offset=%s, value=%s', self.__class__.__name__, self.index, offset, value)
 
     self.data[offset] = value
+    self.dirty_pages.add(self.index)
 
   def write_u16(self, offset, value):
     self.DEBUG('%s.write_u16: page=%s, offset=%s, value=%s', self.__class__.__name__, self.index, offset, value)
 
     self.data[offset]     =  value & 0x00FF
     self.data[offset + 1] = (value & 0xFF00) >> 8
+    self.dirty_pages.add(self.index)
 
   def write_u32(self, offset, value):
     self.DEBUG('%s.write_u32: page=%s, offset=%s, value=%s', self.__class__.__name__, self.index, offset, value)
@@ -277,6 +343,18 @@ class AnonymousMemoryPage(MemoryPage):
     self.data[offset + 1] = (value &     0xFF00) >> 8
     self.data[offset + 2] = (value &   0xFF0000) >> 16
     self.data[offset + 3] = (value & 0xFF000000) >> 24
+    self.dirty_pages.add(self.index)
+
+  def read_bytes(self, offset, length):
+    self.DEBUG('%s.read_bytes: page=%s, offset=%s, length=%s', self.__class__.__name__, self.index, offset, length)
+
+    return self.data[offset:offset + length]
+
+  def write_bytes(self, offset, data):
+    self.DEBUG('%s.write_bytes: page=%s, offset=%s, length=%s', self.__class__.__name__, self.index, offset, len(data))
+
+    self.data[offset:offset + len(data)] = data
+    self.dirty_pages.add(self.index)
 
 class VirtualMemoryPage(MemoryPage):
   """
@@ -308,10 +386,19 @@ class ExternalMemoryPage(MemoryPage):
     state = super(ExternalMemoryPage, self).save_state(parent)
 
     if self.data:
-      state.content = [ord(i) if isinstance(i, str) else i for i in self.data[self.offset:self.offset + PAGE_SIZE]]
+      state.content = bytearray(self.data[self.offset:self.offset + PAGE_SIZE])
 
     else:
-      state.content = []
+      state.content = bytearray()
+
+    return state
+
+  def load_state(self, state):
+    if not self.data:
+      return
+
+    for i, b in enumerate(state.content[0:PAGE_SIZE]):
+      self.put(i, b)
 
   def clear(self):
     self.DEBUG('%s.clear', self.__class__.__name__)
@@ -319,6 +406,8 @@ class ExternalMemoryPage(MemoryPage):
     for i in range(0, PAGE_SIZE):
       self.data[i] = 0
 
+    self.dirty_pages.add(self.index)
+
   def get(self, offset):
     """
     Get one byte from page. Override this method in case you need a different
@@ -361,12 +450,14 @@ class ExternalMemoryPage(MemoryPage):
     self.DEBUG('%s.write_u8: page=%s, offset=%s, value=%s', self.__class__.__name__, self.index, offset, value)
 
     self.put(offset, value)
+    self.dirty_pages.add(self.index)
 
   def write_u16(self, offset, value):
     self.DEBUG('%s.write_u16: page=%s, offset=%s, value=%s', self.__class__.__name__, self.index, offset, value)
 
     self.put(offset, value & 0x00FF)
     self.put(offset + 1, (value & 0xFF00) >> 8)
+    self.dirty_pages.add(self.index)
 
   def write_u32(self, offset, value):
     self.DEBUG('%s.write_u32: page=%s, offset=%s, value=%s', self.__class__.__name__, self.index, offset, value)
@@ -375,6 +466,7 @@ class ExternalMemoryPage(MemoryPage):
     self.put(offset + 1, (value & 0xFF00) >> 8)
     self.put(offset + 2, (value & 0xFF0000) >> 16)
     self.put(offset + 3, (value & 0xFF000000) >> 24)
+    self.dirty_pages.add(self.index)
 
 class MemoryRegionState(SnapshotNode):
   def __init__(self):
@@ -417,8 +509,15 @@ class MemoryRegion(ISnapshotable, object):
     pass
 
 class MemoryState(SnapshotNode):
+  """
+  State of memory controller. Incremental snapshot contains only modified
+  pages, and its ``live_pages`` field lists indices of all pages that
+  existed when the snapshot was captured. For full snapshots, ``live_pages``
+  is ``None``.
+  """
+
   def __init__(self):
-    super(MemoryState, self).__init__('size')
+    super(MemoryState, self).__init__('size', 'live_pages')
 
   def get_page_states(self):
     return [__state for __name, __state in iteritems(self.get_children()) if __name.startswith('page_')]
@@ -457,21 +556,61 @@ class MemoryController(object):
     self.pages_cnt = size // PAGE_SIZE
     self.pages = {}
 
-  def save_state(self, parent):
-    self.DEBUG('mc.save_state')
+    #: Indices of pages modified since the last checkpoint.
+    self.dirty_pages = set()
+
+  def clear_dirty_pages(self):
+    """
+    Forget all page modifications, e.g. when a checkpoint has been taken.
+    """
+
+    # Pages keep reference to this set, it must be cleared in place
+    self.dirty_pages.clear()
+
+  def save_state(self, parent, dirty_only = False, pages = None):
+    """
+    :param bool dirty_only: if set, only pages modified since the last
+      checkpoint are saved.
+    :param list pages: if set, these pages are saved instead of pages
+      registered at the moment.
+    """
+
+    self.DEBUG('mc.save_state: dirty_only=%s', dirty_only)
 
     state = parent.add_child('memory', MemoryState())
 
     state.size = self.size
 
-    for page in itervalues(self.pages):
+    dirty_pages = self.dirty_pages
+    pages = list(pages if pages is not None else itervalues(self.pages))
+
+    if dirty_only is True:
+      state.live_pages = sorted([page.index for page in pages])
+
+    for page in pages:
+      if dirty_only is True and page.index not in dirty_pages:
+        continue
+
       page.save_state(state)
 
   def load_state(self, state):
-    self.size = state.size
+    """
+    Restore content of memory pages. Pages missing in this controller are
+    allocated as anonymous pages.
+
+    :raises ducky.errors.InvalidResourceError: when saved memory size does not
+      match size of this controller.
+    """
+
+    if state.size != self.size:
+      raise InvalidResourceError('Memory size mismatch: snapshot=%s, memory=%s' % (state.size, self.size))
+
+    for page_state in state.get_page_states():
+      page = self.pages.get(page_state.index)
+
+      if page is None:
+        page = self.alloc_specific_page(page_state.index)
 
-    for page_state in state.get_children():
-      page = self.get_page(page_state.index)
       page.load_state(page_state)
 
   def __set_page(self, pg):
@@ -736,6 +875,55 @@ class MemoryController(object):
 
     return self.get_page((addr & PAGE_MASK) >> PAGE_SHIFT).read_u32(addr & (PAGE_SIZE - 1))
 
+  def read_bytes(self, addr, length):
+    """
+    Read a continuous sequence of bytes, possibly spanning several pages.
+
+    :param u32_t addr: address of the first byte.
+    :param int length: number of bytes to read.
+    :rtype: bytearray
+    """
+
+    self.DEBUG('mc.read_bytes: addr=%s, length=%s', UINT32_FMT(addr), length)
+
+    buff = bytearray()
+
+    while length > 0:
+      offset = addr & (PAGE_SIZE - 1)
+      chunk = min(length, PAGE_SIZE - offset)
+
+      buff += self.get_page((addr & PAGE_MASK) >> PAGE_SHIFT).read_bytes(offset, chunk)
+
+      addr += chunk
+      length -= chunk
+
+    return buff
+
+  def write_bytes(self, addr, data):
+    """
+    Write a continuous sequence of bytes, possibly spanning several pages.
+
+    :param u32_t addr: address of the first byte.
+    :param bytearray data: bytes to write.
+    """
+
+    self.DEBUG('mc.write_bytes: addr=%s, length=%s', UINT32_FMT(addr), len(data))
+
+    if not isinstance(data, bytearray):
+      data = bytearray(data)
+
+    length = len(data)
+    start = 0
+
+    while start < length:
+      offset = addr & (PAGE_SIZE - 1)
+      chunk = min(length - start, PAGE_SIZE - offset)
+
+      self.get_page((addr & PAGE_MASK) >> PAGE_SHIFT).write_bytes(offset, data[start:start + chunk])
+
+      addr += chunk
+      start += chunk
+
   def write_u8(self, addr, value):
     self.DEBUG('mc.write_u8: addr=%s, value=%s', UINT32_FMT(addr), UINT8_FMT(value))
 
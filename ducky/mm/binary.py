@@ -1,10 +1,11 @@
 import enum
+import mmap
 
-from six import itervalues, PY2
+from six import itervalues
 from six.moves import range
 
-from ..mm import u8_t, u16_t, u32_t, UINT32_FMT
-from ..util import BinaryFile, StringTable, Flags, str2bytes, bytes2str
+from ..mm import u8_t, u16_t, u32_t, UINT32_FMT, PAGE_SIZE
+from ..util import BinaryFile, StringTable, Flags, str2bytes, bytes2str, align
 from ..log import get_logger
 from ctypes import LittleEndianStructure, sizeof
 
@@ -163,8 +164,7 @@ class Section(object):
   def _read_header(self):
     self.DEBUG('%s._read_header: index=%d', self.__class__.__name__, self.index)
 
-    self.parent.seek(sizeof(FileHeader) + self.index * sizeof(SectionHeader))
-    self._header = self.parent.read_struct(SectionHeader)
+    self._header = self.parent.get_section_headers()[self.index]
 
   def _create_header(self):
     self.DEBUG('%s._create_header: index=%d', self.__class__.__name__, self.index)
@@ -197,18 +197,15 @@ class Section(object):
     self.parent.seek(self.header.offset)
 
     if self.header.type == SectionTypes.SYMBOLS:
-      self._payload = [self.parent.read_struct(SymbolEntry) for _ in range(0, self.header.file_size // sizeof(SymbolEntry))]
+      self._payload = self.parent.read_array(SymbolEntry, self.header.file_size // sizeof(SymbolEntry))
       return
 
     if self.header.type == SectionTypes.RELOC:
-      self._payload = [self.parent.read_struct(RelocEntry) for _ in range(0, self.header.file_size // sizeof(RelocEntry))]
+      self._payload = self.parent.read_array(RelocEntry, self.header.file_size // sizeof(RelocEntry))
       return
 
-    if PY2:
-      self._payload = bytearray([ord(c) for c in self.parent.read(self.header.file_size)])
-
-    else:
-      self._payload = bytearray(self.parent.read(self.header.file_size))
+    self._payload = bytearray(self.header.file_size)
+    self.parent.readinto(self._payload)
 
   def _create_payload(self):
     if self.header.type in (SectionTypes.PROGBITS, SectionTypes.STRINGS):
@@ -229,9 +226,7 @@ class Section(object):
       return
 
     if self.header.type in (SectionTypes.SYMBOLS, SectionTypes.RELOC):
-      for entry in self._payload:
-        self.parent.write_struct(entry)
-
+      self.parent.write_array(self._payload)
       return
 
     from ..mm import MalformedBinaryError
@@ -286,10 +281,15 @@ class File(BinaryFile):
   def open(*args, **kwargs):
     return BinaryFile.do_open(*args, klass = File, **kwargs)
 
+  @staticmethod
+  def open_buffer(*args, **kwargs):
+    return BinaryFile.do_open_buffer(*args, klass = File, **kwargs)
+
   def setup(self):
     self._header = None
 
     self._sections = {}
+    self._section_headers = None
 
     self._string_section = None
     self._string_table = None
@@ -356,6 +356,20 @@ class File(BinaryFile):
     return self._header
 
   # Sections
+  def get_section_headers(self):
+    """
+    Return headers of all sections stored in file. Headers are read just once,
+    all of them at once.
+
+    :rtype: ``list`` of :py:class:`SectionHeader`
+    """
+
+    if self._section_headers is None:
+      self.seek(sizeof(FileHeader))
+      self._section_headers = self.read_array(SectionHeader, self.header.sections)
+
+    return self._section_headers
+
   def create_section(self, name = None):
     self.DEBUG('%s: create_section: name=%s', self.name, name)
 
@@ -445,24 +459,53 @@ class File(BinaryFile):
   def sections(self):
     return (self.get_section_by_index(i) for i in range(0, self.header.sections))
 
-  def fix_offsets(self):
+  def fix_offsets(self, mmapable_sections = False):
+    """
+    Compute offsets of sections in file.
+
+    :param bool mmapable_sections: if set, loadable sections with content
+      are placed on offsets aligned to :py:data:`mmap.ALLOCATIONGRANULARITY`,
+      and followed by enough space to cover their last memory page, so they
+      can be mmaped directly from file.
+    :returns: minimal size of file.
+    """
+
     assert 'w' in self.mode
 
     for index in range(0, self.header.sections):
       self.get_section_by_index(index).prepare_write()
 
     offset = sizeof(FileHeader) + self.header.sections * sizeof(SectionHeader)
+    file_size = offset
 
     for index in range(0, self.header.sections):
       section = self.get_section_by_index(index)
+
+      if mmapable_sections is True and section.header.type == SectionTypes.PROGBITS and section.header.flags.loadable == 1 and section.header.flags.bss != 1:
+        offset = align(mmap.ALLOCATIONGRANULARITY, offset)
+        file_size = max(file_size, offset + align(PAGE_SIZE, section.header.file_size))
+
       section.header.offset = offset
 
       offset += section.header.file_size
 
-  def save(self):
-    self.fix_offsets()
+    return max(file_size, offset)
+
+  def save(self, mmapable_sections = False):
+    """
+    Write file header and all sections into file.
+
+    :param bool mmapable_sections: see :py:meth:`File.fix_offsets`.
+    """
+
+    file_size = self.fix_offsets(mmapable_sections = mmapable_sections)
 
     self._write_header(self.header)
 
     for section in itervalues(self._sections):
       section.write()
+
+    self.seek(0, 2)
+
+    if self.tell() < file_size:
+      self.write(bytearray(file_size - self.tell()))
@@ -21,8 +21,10 @@ the `real` ones. Both kinds mimic API of :py:class:`profile.Profile` - the
 import collections
 import os
 import os.path
+import random
 
-from six.moves import cPickle as pickle
+from ctypes import LittleEndianStructure, c_ubyte as u8_t, c_ushort as u16_t, c_uint as u32_t, c_ulonglong as u64_t, sizeof
+from six import iteritems, itervalues
 
 try:
   from cProfile import Profile as RealMachineProfiler
@@ -30,6 +32,51 @@ try:
 except ImportError:
   from profile import Profile as RealMachineProfiler
 
+#: Default sampling period of code profilers, given as an instruction count.
+DEFAULT_FREQUENCY = 17
+
+#: Magic number of code profile files.
+PROFILE_MAGIC = 0xDEAF
+
+#: Version of code profile files.
+PROFILE_VERSION = 1
+
+#: Magic number of call graph profile files.
+CALLGRAPH_MAGIC = 0xDEAC
+
+#: Version of call graph profile files.
+CALLGRAPH_VERSION = 1
+
+#: Parent index of the root node of call graph.
+CALLGRAPH_NO_PARENT = 0xFFFFFFFF
+
+class ProfileHeader(LittleEndianStructure):
+  _pack_ = 0
+  _fields_ = [
+    ('magic',   u16_t),
+    ('version', u16_t),
+    ('records', u32_t)
+  ]
+
+class ProfileEntry(LittleEndianStructure):
+  _pack_ = 0
+  _fields_ = [
+    ('ip',                 u32_t),
+    ('instruction_set_id', u8_t),
+    ('padding',            u8_t * 3),
+    ('count',              u64_t)
+  ]
+
+class CallGraphEntry(LittleEndianStructure):
+  _pack_ = 0
+  _fields_ = [
+    ('parent',             u32_t),
+    ('ip',                 u32_t),
+    ('instruction_set_id', u8_t),
+    ('padding',            u8_t * 3),
+    ('count',              u64_t)
+  ]
+
 class DummyCPUCoreProfiler(object):
   """
   Dummy code profiler class. Base class for all code profilers.
@@ -38,7 +85,7 @@ class DummyCPUCoreProfiler(object):
   :param int frequency: sampling frequency, given as an instruction count.
   """
 
-  def __init__(self, core, frequency = 17):
+  def __init__(self, core, frequency = DEFAULT_FREQUENCY):
     super(DummyCPUCoreProfiler, self).__init__()
 
     self.core = core
@@ -99,32 +146,258 @@ class ProfileRecord(object):
 class RealCPUCoreProfiler(DummyCPUCoreProfiler):
   """
   Real code profiler. This class actually does collect data.
+
+  Samples are aggregated as they are taken, into a hit counter for each
+  sampled instruction, therefore memory consumption does not depend on the
+  length of the run. Distance between two samples is randomized, with
+  ``frequency`` being its mean value, to avoid aliasing with loops whose
+  length is a multiple of sampling period.
   """
 
-  def __init__(self, core):
-    super(RealCPUCoreProfiler, self).__init__(core)
+  def __init__(self, core, frequency = DEFAULT_FREQUENCY):
+    super(RealCPUCoreProfiler, self).__init__(core, frequency = frequency)
+
+    #: Hit counts, indexed by ``(instruction set id, ip)`` pairs.
+    self.counts = collections.defaultdict(int)
+
+    self._countdown = self._next_countdown()
+
+  def _next_countdown(self):
+    return random.randint(1, 2 * self.frequency - 1)
+
+  def take_sample(self):
+    if self.enabled is not True:
+      return
+
+    self._countdown -= 1
+
+    if self._countdown > 0:
+      return
+
+    self._countdown = self._next_countdown()
+    self.counts[(self.core.instruction_set.instruction_set_id, self.core.current_ip)] += 1
+
+  def dump_stats(self, filename):
+    """
+    Save collected data into file. File starts with
+    :py:class:`ProfileHeader`, followed by an array of
+    :py:class:`ProfileEntry` records.
+
+    :param string filename: path to file.
+    """
+
+    header = ProfileHeader()
+    header.magic = PROFILE_MAGIC
+    header.version = PROFILE_VERSION
+    header.records = len(self.counts)
+
+    entries = (ProfileEntry * len(self.counts))()
+
+    for entry, ((instruction_set_id, ip), count) in zip(entries, iteritems(self.counts)):
+      entry.ip = ip
+      entry.instruction_set_id = instruction_set_id
+      entry.count = count
+
+    with open(filename, 'wb') as f:
+      f.write(bytearray(header))
+      f.write(bytearray(entries))
+
+class CallGraphNode(object):
+  """
+  Node of call graph, representing one call path - sequence of called
+  routines, starting at the root of the graph.
+
+  :param CallGraphNode parent: caller's node, ``None`` for the root node.
+  :param u32_t ip: address of the called routine.
+  :param int instruction_set_id: instruction set the routine was entered with.
+  """
+
+  __slots__ = ('parent', 'ip', 'instruction_set_id', 'children', 'count')
+
+  def __init__(self, parent, ip, instruction_set_id):
+    self.parent = parent
+    self.ip = ip
+    self.instruction_set_id = instruction_set_id
+
+    #: Callees, indexed by their addresses.
+    self.children = {}
+
+    #: Number of instructions executed by this routine itself, when called
+    #: along this path.
+    self.count = 0
+
+class RealCPUCoreCallGraphProfiler(DummyCPUCoreProfiler):
+  """
+  Call graph profiler. Follows guest's call stack, and counts instructions
+  executed along each call path.
+
+  Profiler does not inspect executed instructions, it relies on stack frames
+  core keeps in :py:attr:`ducky.cpu.CPUCore.frames` - these are created by
+  ``call`` and by entering an exception routine, and removed by ``ret`` and
+  ``retint``. Each step costs just a comparison of stack depths, call graph
+  is walked only when the depth changed. Frames are not tracked when JIT is
+  enabled, therefore all instructions are then attributed to the root node.
+
+  Every instruction is counted, ``frequency`` is not used.
+  """
+
+  def __init__(self, core, frequency = DEFAULT_FREQUENCY):
+    super(RealCPUCoreCallGraphProfiler, self).__init__(core, frequency = frequency)
+
+    if core.jit is True:
+      core.WARN('Call graph profiler: stack frames are not tracked with JIT enabled')
+
+    self.root = CallGraphNode(None, 0, 0)
+
+    self._node = self.root
+    self._depth = 0
+
+  def enable(self):
+    from .cpu.registers import Registers
+
+    if self._node is self.root and self.root.count == 0:
+      self.root.ip = self.core.registers[Registers.IP]
+      self.root.instruction_set_id = self.core.instruction_set.instruction_set_id
 
-    self.data = []
+    super(RealCPUCoreCallGraphProfiler, self).enable()
 
   def take_sample(self):
     if self.enabled is not True:
       return
 
-    if self.core.registers.cnt.value % self.frequency != 0:
+    # Instruction was executed before the frame it might have created or
+    # removed, therefore it belongs to the current node.
+    node = self._node
+    node.count += 1
+
+    frames = self.core.frames
+    depth = len(frames)
+
+    if depth == self._depth:
       return
 
-    self.data.append((self.core.instruction_set.instruction_set_id, self.core.current_ip))
+    while self._depth > depth:
+      node = node.parent
+      self._depth -= 1
+
+    while self._depth < depth:
+      ip = frames[self._depth].IP
+      child = node.children.get(ip)
+
+      if child is None:
+        child = node.children[ip] = CallGraphNode(node, ip, self.core.instruction_set.instruction_set_id)
+
+      node = child
+      self._depth += 1
+
+    self._node = node
 
   def dump_stats(self, filename):
-    processed = collections.defaultdict(ProfileRecord)
+    """
+    Save collected data into file. File starts with
+    :py:class:`ProfileHeader`, followed by an array of
+    :py:class:`CallGraphEntry` records, one for each node. Parent node is
+    always stored before its children.
+
+    :param string filename: path to file.
+    """
+
+    nodes = []
+    parents = []
+    queue = [(self.root, CALLGRAPH_NO_PARENT)]
+
+    while queue:
+      node, parent = queue.pop()
+
+      index = len(nodes)
+      nodes.append(node)
+      parents.append(parent)
+
+      queue.extend([(child, index) for child in itervalues(node.children)])
+
+    header = ProfileHeader()
+    header.magic = CALLGRAPH_MAGIC
+    header.version = CALLGRAPH_VERSION
+    header.records = len(nodes)
 
-    for inst_set, ip in self.data:
-      processed[ip].ip = ip
-      processed[ip].instruction_set_id = inst_set
-      processed[ip].count += 1
+    entries = (CallGraphEntry * len(nodes))()
+
+    for entry, node, parent in zip(entries, nodes, parents):
+      entry.parent = parent
+      entry.ip = node.ip
+      entry.instruction_set_id = node.instruction_set_id
+      entry.count = node.count
 
     with open(filename, 'wb') as f:
-      pickle.dump(processed, f)
+      f.write(bytearray(header))
+      f.write(bytearray(entries))
+
+def read_profile_header(filename):
+  """
+  Read header of a profile file.
+
+  :param string filename: path to file.
+  :rtype: ProfileHeader
+  :returns: file header, or ``None`` when file is too short.
+  """
+
+  with open(filename, 'rb') as f:
+    header = ProfileHeader()
+
+    if f.readinto(header) != sizeof(header):
+      return None
+
+    return header
+
+def _read_records(filename, magic, version, entry_class, chunk_size):
+  with open(filename, 'rb') as f:
+    header = ProfileHeader()
+
+    if f.readinto(header) != sizeof(header) or header.magic != magic:
+      raise ValueError('Not a code profile: %s' % filename)
+
+    if header.version != version:
+      raise ValueError('Unsupported version of code profile: %s: version=%i' % (filename, header.version))
+
+    remaining = header.records
+
+    while remaining > 0:
+      entries = (entry_class * min(chunk_size, remaining))()
+
+      if f.readinto(entries) != sizeof(entries):
+        raise ValueError('Truncated code profile: %s' % filename)
+
+      for entry in entries:
+        yield entry
+
+      remaining -= len(entries)
+
+def read_profile(filename, chunk_size = 4096):
+  """
+  Read code profile file, created by :py:meth:`RealCPUCoreProfiler.dump_stats`.
+  Records are read in chunks, the whole file is never kept in memory.
+
+  :param string filename: path to file.
+  :param int chunk_size: number of records read at once.
+  :returns: generator of :py:class:`ProfileEntry` instances.
+  :raises ValueError: when file is not a code profile.
+  """
+
+  return _read_records(filename, PROFILE_MAGIC, PROFILE_VERSION, ProfileEntry, chunk_size)
+
+def read_callgraph(filename, chunk_size = 4096):
+  """
+  Read call graph profile file, created by
+  :py:meth:`RealCPUCoreCallGraphProfiler.dump_stats`.
+
+  :param string filename: path to file.
+  :param int chunk_size: number of records read at once.
+  :returns: generator of :py:class:`CallGraphEntry` instances, in the order
+    they were stored - parent is always yielded before its children.
+  :raises ValueError: when file is not a call graph profile.
+  """
+
+  return _read_records(filename, CALLGRAPH_MAGIC, CALLGRAPH_VERSION, CallGraphEntry, chunk_size)
 
 class DummyMachineProfiler(object):
   """
@@ -175,6 +448,7 @@ class ProfilerStore(object):
 
     self.machine_profiler_class = DummyMachineProfiler
     self.core_profiler_class    = DummyCPUCoreProfiler
+    self.core_profiler_frequency = DEFAULT_FREQUENCY
 
     self.profilers = []
 
@@ -185,12 +459,19 @@ class ProfilerStore(object):
 
     self.machine_profiler_class = RealMachineProfiler
 
-  def enable_cpu(self):
+  def enable_cpu(self, frequency = None, callgraph = False):
     """
     Each newly created code profiler will be the real one.
+
+    :param int frequency: mean sampling period of code profilers, given as
+      an instruction count. :py:data:`DEFAULT_FREQUENCY` is used when not
+      set.
+    :param bool callgraph: if set, call graph profilers are created instead
+      of sampling ones.
     """
 
-    self.core_profiler_class = RealCPUCoreProfiler
+    self.core_profiler_class = RealCPUCoreCallGraphProfiler if callgraph is True else RealCPUCoreProfiler
+    self.core_profiler_frequency = frequency or DEFAULT_FREQUENCY
 
   def is_machine_enabled(self):
     """
@@ -208,7 +489,7 @@ class ProfilerStore(object):
     :rtype: bool
     """
 
-    return self.core_profiler_class == RealCPUCoreProfiler
+    return self.core_profiler_class is not DummyCPUCoreProfiler
 
   def get_machine_profiler(self):
     """
@@ -230,7 +511,7 @@ class ProfilerStore(object):
     :rtype: DummyCPUCoreProfiler
     """
 
-    p = self.core_profiler_class(core)
+    p = self.core_profiler_class(core, frequency = self.core_profiler_frequency)
 
     self.profilers.append(p)
 
@@ -271,6 +271,19 @@ class Reactor(object):
     if not self.fds:
       self.remove_task(self.fds_task)
 
+  def has_pending_io(self):
+    """
+    Check whether any of registered file descriptors is ready for IO. Nothing
+    is read or written, callbacks are fired by reactor's main loop as usual.
+
+    :rtype: bool
+    """
+
+    if not self.fds:
+      return False
+
+    return bool(self.fds_task.poll.poll(0))
+
   def run(self):
     """
     Starts reactor loop. Enters endless loop, calling runnable tasks and events,
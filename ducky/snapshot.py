@@ -1,11 +1,166 @@
-from six import print_, iteritems
+"""
+Snapshots of virtual machine's state.
+
+State of a machine is captured as a tree of :py:class:`SnapshotNode` objects,
+and stored in a binary file with the following layout:
+
++--------------------+----------------------------------------------------------+
+| ``SnapshotHeader`` | magic cookie, format version, offset of section table    |
++--------------------+----------------------------------------------------------+
+| section payloads   | ``STATE`` sections, one per subtree of the machine state |
+|                    | (CPUs with their registers, memory, devices, ...), page  |
+|                    | chunks of the ``PAGES`` section, ``PAGE_INDEX`` section  |
++--------------------+----------------------------------------------------------+
+| section table      | array of ``SnapshotSectionHeader`` structures            |
++--------------------+----------------------------------------------------------+
+
+Memory pages are not part of ``STATE`` sections. Runs of consecutive pages are
+stored as raw chunks of at most :py:data:`CHUNK_PAGES` pages, each chunk
+optionally compressed, and ``PAGE_INDEX`` section lists all chunks. When
+reading a snapshot, file is memory-mapped, and content of pages is loaded
+only when it is accessed for the first time.
+"""
+
+import base64
+import enum
+import importlib
+import json
+import mmap
+import os
+import zlib
+
+from six import print_, iteritems, PY2
 from six.moves import cPickle as pickle
+from ctypes import LittleEndianStructure, c_ubyte as u8_t, c_ushort as u16_t, c_uint as u32_t, sizeof
+
+from .util import BinaryFile, str2bytes, bytes2str
+from .log import get_logger
+
+try:
+  import lzma
+
+except ImportError:
+  lzma = None
+
+#: Maximal number of pages stored in one chunk.
+CHUNK_PAGES = 64
+
+#: Maximal number of snapshots in a chain of incremental snapshots.
+MAX_CHAIN_LENGTH = 1024
+
+#: Snapshot nodes deeper than this get their own ``STATE`` section.
+STATE_SPLIT_DEPTH = 2
+
+class MalformedSnapshotError(Exception):
+  pass
+
+class SnapshotSectionTypes(enum.IntEnum):
+  UNKNOWN    = 0
+  STATE      = 1
+  PAGES      = 2
+  PAGE_INDEX = 3
+
+class SnapshotCompression(enum.IntEnum):
+  NONE = 0
+  ZLIB = 1
+  LZMA = 2
+
+SNAPSHOT_COMPRESSIONS = {
+  'none': SnapshotCompression.NONE,
+  'zlib': SnapshotCompression.ZLIB,
+  'lzma': SnapshotCompression.LZMA
+}
+
+class SnapshotHeader(LittleEndianStructure):
+  _pack_ = 0
+  _fields_ = [
+    ('magic',    u16_t),
+    ('version',  u16_t),
+    ('sections', u16_t),
+    ('padding',  u16_t),
+    ('table',    u32_t)
+  ]
+
+  def __repr__(self):
+    return '<SnapshotHeader: magic=0x%04X, version=%d, sections=%d, table=%d>' % (self.magic, self.version, self.sections, self.table)
+
+class SnapshotSectionHeader(LittleEndianStructure):
+  _pack_ = 0
+  _fields_ = [
+    ('type',        u8_t),
+    ('compression', u8_t),
+    ('padding',     u16_t),
+    ('offset',      u32_t),
+    ('file_size',   u32_t),
+    ('data_size',   u32_t)
+  ]
+
+  def __repr__(self):
+    return '<SnapshotSectionHeader: type=%s, compression=%s, offset=%d, file_size=%d, data_size=%d>' % (self.type, self.compression, self.offset, self.file_size, self.data_size)
+
+class PageChunkEntry(LittleEndianStructure):
+  _pack_ = 0
+  _fields_ = [
+    ('first_page',  u32_t),
+    ('pages_cnt',   u16_t),
+    ('compression', u8_t),
+    ('padding',     u8_t),
+    ('offset',      u32_t),
+    ('file_size',   u32_t)
+  ]
+
+  def __repr__(self):
+    return '<PageChunkEntry: first_page=%d, pages_cnt=%d, compression=%s, offset=%d, file_size=%d>' % (self.first_page, self.pages_cnt, self.compression, self.offset, self.file_size)
+
+def compress(compression, data):
+  """
+  Compress data using requested method.
+
+  :param SnapshotCompression compression: compression method.
+  :param bytes data: data to compress.
+  :rtype: bytes
+  """
+
+  if compression == SnapshotCompression.NONE:
+    return bytes(data)
 
-from .util import BinaryFile
+  if compression == SnapshotCompression.ZLIB:
+    return zlib.compress(bytes(data), 1)
+
+  if compression == SnapshotCompression.LZMA:
+    if lzma is None:
+      raise MalformedSnapshotError('LZMA compression is not available')
+
+    return lzma.compress(bytes(data))
+
+  raise MalformedSnapshotError('Unknown compression method: %s' % compression)
+
+def decompress(compression, data):
+  """
+  Reverse operation to :py:func:`compress`.
+  """
+
+  if compression == SnapshotCompression.NONE:
+    return data
+
+  if compression == SnapshotCompression.ZLIB:
+    return zlib.decompress(data)
+
+  if compression == SnapshotCompression.LZMA:
+    if lzma is None:
+      raise MalformedSnapshotError('LZMA compression is not available')
+
+    return lzma.decompress(data)
+
+  raise MalformedSnapshotError('Unknown compression method: %s' % compression)
 
 class SnapshotNode(object):
+  # Nodes unpickled from snapshots of older format do not have their own
+  __lazy_children = {}
+
   def __init__(self, *fields):
     self.__children = {}
+    self.__lazy_children = {}
     self.__fields = fields
 
     for field in fields:
@@ -15,12 +170,33 @@ class SnapshotNode(object):
     self.__children[name] = child
     return child
 
+  def add_lazy_child(self, name, capture):
+    """
+    Register a child that is captured only when it is accessed for the first
+    time.
+
+    :param str name: name of the child.
+    :param callable capture: called with this node as the only argument, it is
+      expected to create the child, and add it by calling :py:meth:`add_child`.
+    """
+
+    self.__lazy_children[name] = capture
+
   def get_child(self, name):
+    if name in self.__lazy_children:
+      self.__lazy_children.pop(name)(self)
+
     return self.__children[name]
 
   def get_children(self):
+    for name in list(self.__lazy_children.keys()):
+      self.__lazy_children.pop(name)(self)
+
     return self.__children
 
+  def get_fields(self):
+    return self.__fields
+
   def print_node(self, level = 0):
     offset = '    ' * level
 
@@ -29,7 +205,7 @@ class SnapshotNode(object):
     for field in self.__fields:
       print_(offset, '  ', '{}: {}'.format(field, getattr(self, field)))
 
-    if self.__children:
+    if self.get_children():
       print_(offset, '  children:')
 
       for name, value in iteritems(self.__children):
@@ -41,23 +217,43 @@ class SnapshotNode(object):
           print_(offset, '    ', '{}: {}'.format(name, value))
 
 class VMState(SnapshotNode):
-  def __init__(self, logger):
-    super(VMState, self).__init__()
+  """
+  Root of snapshot tree.
+
+  :param logger: logger used when snapshot is saved.
+  """
+
+  def __init__(self, logger = None):
+    super(VMState, self).__init__('parent')
 
     self.logger = logger
 
   @staticmethod
-  def capture_vm_state(machine, suspend = True):
-    machine.DEBUG('capture_vm_state')
+  def capture_vm_state(machine, suspend = True, parent = None):
+    """
+    Capture state of a machine. Captured state becomes a new checkpoint,
+    all modifications of memory pages are forgotten.
+
+    :param ducky.machine.Machine machine: machine to capture.
+    :param bool suspend: if set, suspend machine while its state is captured.
+    :param str parent: if set, only pages modified since the last checkpoint
+      are captured, and ``parent`` is path to a snapshot of that checkpoint.
+      When relative, path is interpreted relatively to the directory of this
+      snapshot.
+    """
+
+    machine.DEBUG('capture_vm_state: parent=%s', parent)
 
     state = VMState(machine.LOGGER)
+    state.parent = parent
 
     if suspend:
       machine.DEBUG('suspend vm...')
       machine.suspend()
 
     machine.DEBUG('capture state...')
-    machine.save_state(state)
+    machine.save_state(state, dirty_only = parent is not None)
+    machine.memory.clear_dirty_pages()
 
     if suspend:
       machine.DEBUG('wake vm up...')
@@ -65,27 +261,484 @@ class VMState(SnapshotNode):
 
     return state
 
+  @staticmethod
+  def lazy_vm_state(machine):
+    """
+    Create state of a machine whose parts - CPUs, memory and devices - are
+    captured only when they are accessed for the first time. Unlike
+    :py:meth:`VMState.capture_vm_state`, this does not create a checkpoint,
+    modifications of memory pages are not forgotten. Memory pages registered
+    when the state is created are captured, even if they are unregistered
+    later, e.g. when the machine halts.
+
+    :param ducky.machine.Machine machine: machine to capture.
+    """
+
+    machine.DEBUG('lazy_vm_state')
+
+    state = VMState(machine.LOGGER)
+    machine.save_state(state, lazy = True)
+
+    return state
+
+  @staticmethod
+  def checkpoint_vm_state(machine, filename, parent = None, compression = None):
+    """
+    Capture state of a machine, and save it into a file, in background.
+    Machine is cloned by ``os.fork()``, and the child process captures and
+    saves its copy-on-write view of the machine while the original machine
+    keeps running. Machine is paused only for the duration of the fork,
+    independently of the size of its memory.
+
+    Machine must be in a quiescent state - see
+    :py:meth:`ducky.machine.Machine.fork`.
+
+    :param ducky.machine.Machine machine: machine to capture.
+    :param str filename: path to the snapshot file.
+    :param str parent: see :py:meth:`VMState.capture_vm_state`.
+    :param str compression: compression of sections in the file.
+    :rtype: int
+    :returns: PID of the process saving the snapshot.
+    """
+
+    machine.DEBUG('checkpoint_vm_state: filename=%s, parent=%s', filename, parent)
+
+    pid = os.fork()
+
+    if pid == 0:
+      exit_code = 1
+
+      try:
+        VMState.capture_vm_state(machine, suspend = False, parent = parent).save(filename, compression = compression)
+        exit_code = 0
+
+      except Exception as e:
+        machine.EXCEPTION(e)
+
+      finally:
+        os._exit(exit_code)
+
+    machine.memory.clear_dirty_pages()
+
+    return pid
+
   @staticmethod
   def load_vm_state(logger, filename):
-    return CoreDumpFile.open(logger, filename, 'r').load()
+    with CoreDumpFile.open(logger, filename, 'r') as f_in:
+      return f_in.load()
 
-  def save(self, filename):
+  def save(self, filename, compression = None):
     with CoreDumpFile.open(self.logger, filename, 'w') as f_out:
-      f_out.save(self)
+      f_out.save(self, compression = compression)
+
+def _encode_value(value):
+  if isinstance(value, (bytes, bytearray)) and not (PY2 and isinstance(value, str)):
+    return {'__bytes__': bytes2str(base64.b64encode(bytes(value)))}
+
+  if isinstance(value, (list, tuple)):
+    return [_encode_value(v) for v in value]
+
+  return value
+
+def _decode_value(value):
+  if isinstance(value, dict) and '__bytes__' in value:
+    return bytearray(base64.b64decode(str2bytes(value['__bytes__'])))
+
+  if isinstance(value, list):
+    return [_decode_value(v) for v in value]
+
+  return value
+
+def _is_page_state(node):
+  from .mm import MemoryPageState
+
+  return isinstance(node, MemoryPageState)
+
+def _encode_node(node, shallow = False):
+  """
+  Encode snapshot node into a JSON-friendly dictionary. Memory pages are
+  left out, their parent is just marked as their owner.
+
+  :param SnapshotNode node: node to encode.
+  :param bool shallow: if set, child nodes are not encoded.
+  """
+
+  encoded = {
+    'class':    '%s:%s' % (node.__class__.__module__, node.__class__.__name__),
+    'fields':   dict([(field, _encode_value(getattr(node, field))) for field in node.get_fields()]),
+    'children': {},
+    'pages':    False
+  }
+
+  for name, child in iteritems(node.get_children()):
+    if not isinstance(child, SnapshotNode):
+      encoded['children'][name] = {'value': _encode_value(child)}
+      continue
+
+    if _is_page_state(child):
+      encoded['pages'] = True
+      continue
+
+    if shallow is True:
+      continue
+
+    encoded['children'][name] = _encode_node(child)
+
+  return encoded
+
+def _decode_node(encoded, page_owners):
+  module, name = encoded['class'].split(':')
+  node = getattr(importlib.import_module(module), name)()
+
+  for field, value in iteritems(encoded['fields']):
+    setattr(node, field, _decode_value(value))
+
+  for child_name, child in iteritems(encoded['children']):
+    if 'value' in child:
+      node.add_child(child_name, _decode_value(child['value']))
+
+    else:
+      node.add_child(child_name, _decode_node(child, page_owners))
+
+  if encoded['pages'] is True:
+    page_owners.append(node)
+
+  return node
+
+class _PageLoader(object):
+  """
+  Provides content of pages stored in a memory-mapped snapshot file. Chunks
+  are decompressed when a page they contain is accessed for the first time.
+  """
+
+  def __init__(self, ptr, entries):
+    self.ptr = ptr
+    self.entries = entries
+
+    self.chunks = {}
+
+  def load(self, chunk_index, page_offset):
+    from .mm import PAGE_SIZE
+
+    chunk = self.chunks.get(chunk_index)
+
+    if chunk is None:
+      entry = self.entries[chunk_index]
+      chunk = self.chunks[chunk_index] = decompress(entry.compression, self.ptr[entry.offset:entry.offset + entry.file_size])
+
+    return bytearray(chunk[page_offset * PAGE_SIZE:(page_offset + 1) * PAGE_SIZE])
 
 class CoreDumpFile(BinaryFile):
+  MAGIC = 0xDEAE
+  VERSION = 1
+
   @staticmethod
   def open(*args, **kwargs):
     return BinaryFile.do_open(*args, klass = CoreDumpFile, **kwargs)
 
+  def _write_section(self, sections, typ, payload, compression = SnapshotCompression.NONE):
+    header = SnapshotSectionHeader()
+    header.type = typ
+    header.compression = compression
+    header.offset = self.tell()
+    header.data_size = len(payload)
+
+    payload = compress(compression, payload)
+    header.file_size = len(payload)
+
+    self.write(payload)
+    sections.append(header)
+
+    return header
+
+  def _write_state_sections(self, sections, node, path, compression):
+    depth = len(path)
+
+    if depth == 0:
+      payload = {'path': path, 'node': _encode_node(node, shallow = True)}
+      self._write_section(sections, SnapshotSectionTypes.STATE, str2bytes(json.dumps(payload)), compression = compression)
+
+      for name, child in iteritems(node.get_children()):
+        self._write_state_sections(sections, child, [name], compression)
+
+      return
+
+    if depth < STATE_SPLIT_DEPTH:
+      payload = {'path': path, 'node': _encode_node(node, shallow = True)}
+      self._write_section(sections, SnapshotSectionTypes.STATE, str2bytes(json.dumps(payload)), compression = compression)
+
+      for name, child in iteritems(node.get_children()):
+        if isinstance(child, SnapshotNode) and not _is_page_state(child):
+          self._write_state_sections(sections, child, path + [name], compression)
+
+      return
+
+    payload = {'path': path, 'node': _encode_node(node)}
+    self._write_section(sections, SnapshotSectionTypes.STATE, str2bytes(json.dumps(payload)), compression = compression)
+
+  def _collect_pages(self, node, pages):
+    for child in node.get_children().values():
+      if not isinstance(child, SnapshotNode):
+        continue
+
+      if _is_page_state(child):
+        pages.append(child)
+        continue
+
+      self._collect_pages(child, pages)
+
+    return pages
+
+  def _write_pages(self, sections, pages, compression):
+    """
+    Write runs of consecutive pages as chunks, followed by the index of
+    chunks.
+    """
+
+    entries = []
+
+    header = SnapshotSectionHeader()
+    header.type = SnapshotSectionTypes.PAGES
+    header.offset = self.tell()
+
+    run = []
+
+    from .mm import PAGE_SIZE
+
+    def __flush_run():
+      if not run:
+        return
+
+      data = bytearray()
+
+      for page in run:
+        content = bytearray(page.content)
+        data += content + bytearray(PAGE_SIZE - len(content))
+
+      entry = PageChunkEntry()
+      entry.first_page = run[0].index
+      entry.pages_cnt = len(run)
+      entry.offset = self.tell()
+
+      stored = compress(compression, data)
+
+      if len(stored) < len(data):
+        entry.compression = compression
+
+      else:
+        entry.compression = SnapshotCompression.NONE
+        stored = bytes(data)
+
+      entry.file_size = len(stored)
+
+      self.write(stored)
+      entries.append(entry)
+
+      header.data_size += len(data)
+      header.file_size += len(stored)
+
+      del run[:]
+
+    for page in sorted(pages, key = lambda x: x.index):
+      if run and (page.index != run[-1].index + 1 or len(run) == CHUNK_PAGES):
+        __flush_run()
+
+      run.append(page)
+
+    __flush_run()
+
+    sections.append(header)
+
+    payload = bytearray()
+    for entry in entries:
+      payload += bytearray(entry)
+
+    self._write_section(sections, SnapshotSectionTypes.PAGE_INDEX, payload)
+
+  def save(self, state, compression = None):
+    """
+    Write snapshot into the file.
+
+    :param VMState state: snapshot to save.
+    :param str compression: name of compression method applied to all
+      sections, one of keys of :py:data:`SNAPSHOT_COMPRESSIONS`. Default is
+      no compression.
+    """
+
+    self.DEBUG('CoreDumpFile.save: state=%s, compression=%s', state, compression)
+
+    if compression not in SNAPSHOT_COMPRESSIONS and compression is not None:
+      raise MalformedSnapshotError('Unknown compression method: %s' % compression)
+
+    compression = SNAPSHOT_COMPRESSIONS[compression or 'none']
+
+    header = SnapshotHeader()
+    header.magic = self.MAGIC
+    header.version = self.VERSION
+
+    self.write_struct(header)
+
+    sections = []
+
+    self._write_state_sections(sections, state, [], compression)
+
+    self._write_pages(sections, self._collect_pages(state, []), compression)
+
+    header.sections = len(sections)
+    header.table = self.tell()
+
+    for section in sections:
+      self.write_struct(section)
+
+    self.seek(0)
+    self.write_struct(header)
+    self.flush()
+
   def load(self):
+    """
+    Read snapshot from the file. Content of memory pages is read lazily, from
+    memory-mapped file, and it's accessible even after the file is closed.
+
+    :rtype: VMState
+    """
+
     self.DEBUG('CoreDumpFile.load')
 
-    return pickle.load(self)
+    self.seek(0)
+    header = self.read_struct(SnapshotHeader)
+
+    if header.magic != self.MAGIC:
+      self.WARN('%s: magic cookie not recognized, trying legacy format', self.name)
+
+      self.seek(0)
+      return pickle.load(self)
+
+    if header.version != self.VERSION:
+      raise MalformedSnapshotError('%s: unsupported snapshot version %s' % (self.name, header.version))
+
+    ptr = mmap.mmap(self.stream.fileno(), 0, access = mmap.ACCESS_READ)
+
+    state = VMState(get_logger())
+    page_owners = []
+    page_index = None
+
+    for i in range(0, header.sections):
+      offset = header.table + i * sizeof(SnapshotSectionHeader)
+      section = SnapshotSectionHeader.from_buffer_copy(ptr[offset:offset + sizeof(SnapshotSectionHeader)])
+
+      self.DEBUG('  %s', section)
+
+      if section.type == SnapshotSectionTypes.STATE:
+        payload = json.loads(bytes2str(decompress(section.compression, ptr[section.offset:section.offset + section.file_size])))
+
+        if not payload['path']:
+          for field, value in iteritems(payload['node']['fields']):
+            setattr(state, field, _decode_value(value))
+
+          continue
+
+        parent = state
+        for name in payload['path'][:-1]:
+          parent = parent.get_child(name)
+
+        parent.add_child(payload['path'][-1], _decode_node(payload['node'], page_owners))
+
+      elif section.type == SnapshotSectionTypes.PAGE_INDEX:
+        payload = ptr[section.offset:section.offset + section.file_size]
+        page_index = [PageChunkEntry.from_buffer_copy(payload[j:j + sizeof(PageChunkEntry)]) for j in range(0, len(payload), sizeof(PageChunkEntry))]
+
+      elif section.type != SnapshotSectionTypes.PAGES:
+        raise MalformedSnapshotError('%s: unknown section type %s' % (self.name, section.type))
+
+    if page_index and not page_owners:
+      raise MalformedSnapshotError('%s: memory pages without owner' % self.name)
+
+    if page_index:
+      from .mm import LazyMemoryPageState
+
+      loader = _PageLoader(ptr, page_index)
+      owner = page_owners[0]
+
+      for chunk_index, entry in enumerate(page_index):
+        for page_offset in range(0, entry.pages_cnt):
+          index = entry.first_page + page_offset
+          owner.add_child('page_{}'.format(index), LazyMemoryPageState(index, loader, chunk_index, page_offset))
+
+    return state
+
+def load_snapshot_chain(logger, filename):
+  """
+  Load snapshot, and all its parents.
+
+  :param str filename: path to the snapshot file.
+  :rtype: list
+  :returns: list of snapshots, starting with the one stored in ``filename``
+    and ending with the full snapshot the chain is based on.
+  """
+
+  chain = []
+
+  while filename is not None:
+    with CoreDumpFile.open(logger, filename, 'r') as f_in:
+      state = f_in.load()
+
+    chain.append(state)
+
+    if getattr(state, 'parent', None) is None:
+      break
+
+    if len(chain) > MAX_CHAIN_LENGTH:
+      raise MalformedSnapshotError('%s: snapshot chain is too long' % filename)
+
+    parent = state.parent
+
+    if not os.path.isabs(parent):
+      parent = os.path.join(os.path.dirname(filename), parent)
+
+    filename = parent
+
+  return chain
+
+def flatten_snapshot(logger, filename):
+  """
+  Create a full snapshot from an incremental one. Memory pages, missing in
+  an incremental snapshot because they were not modified, are taken from
+  its parents, the rest of machine state comes from the incremental
+  snapshot. Pages that did not exist anymore when a snapshot was captured
+  are not taken from snapshots older than this one.
+
+  :param str filename: path to the snapshot file.
+  :rtype: VMState
+  """
+
+  chain = load_snapshot_chain(logger, filename)
+  state = chain[0]
+
+  memory_state = state.get_child('machine').get_child('memory')
+
+  # Page can be taken from an ancestor only when it has been alive in all
+  # newer snapshots. Snapshots of older format do not record live pages.
+  live_pages = set(memory_state.live_pages) if getattr(memory_state, 'live_pages', None) is not None else None
+
+  for ancestor in chain[1:]:
+    ancestor_memory_state = ancestor.get_child('machine').get_child('memory')
+
+    for page_state in ancestor_memory_state.get_page_states():
+      if live_pages is not None and page_state.index not in live_pages:
+        continue
+
+      name = 'page_{}'.format(page_state.index)
+
+      if name not in memory_state.get_children():
+        memory_state.add_child(name, page_state)
+
+    ancestor_live_pages = getattr(ancestor_memory_state, 'live_pages', None)
+
+    if ancestor_live_pages is not None:
+      live_pages = set(ancestor_live_pages) if live_pages is None else live_pages & set(ancestor_live_pages)
 
-  def save(self, state):
-    self.DEBUG('CoreDumpFile.save: state=%s', state)
+  memory_state.live_pages = None
+  state.parent = None
+  state.logger = logger
 
-    logger, state.logger = state.logger, None
-    pickle.dump(state, self)
-    state.logger = logger
+  return state
@@ -132,6 +132,15 @@ class Stream(object):
 
     reactor.remove_fd(self.fd)
 
+  def forked(self):
+    """
+    Called by owner in a child process, after the machine has been cloned
+    by :py:meth:`ducky.machine.Machine.fork`. By default, stream remains
+    shared with the parent.
+    """
+
+    pass
+
   def _raw_read_stream(self, size = None):
     self.DEBUG('%s._raw_read_stream: size=%s', self.__class__.__name__, size)
 
@@ -260,6 +269,22 @@ class FileInputStream(InputStream):
   def __init__(self, machine, f, **kwargs):
     super(FileInputStream, self).__init__(machine, '<file %s>' % f.name, stream = f, fd = f.fileno())
 
+  def forked(self):
+    """
+    Position in the file is shared with the parent, therefore the file is
+    reopened, and its new descriptor replaces the original one, keeping
+    the position and any registration with reactor intact.
+    """
+
+    self.DEBUG('%s.forked', self.__class__.__name__)
+
+    position = os.lseek(self.fd, 0, os.SEEK_CUR)
+
+    fd = os.open(self.stream.name, os.O_RDONLY)
+    os.lseek(fd, position, os.SEEK_SET)
+    os.dup2(fd, self.fd)
+    os.close(fd)
+
 class MethodInputStream(InputStream):
   def __init__(self, machine, desc, **kwargs):
     super(MethodInputStream, self).__init__(machine, repr(desc), stream = desc)
@@ -368,6 +393,25 @@ class FileOutputStream(OutputStream):
   def __init__(self, machine, f, **kwargs):
     super(FileOutputStream, self).__init__(machine, '<file %s>' % f.name, stream = f, fd = f.fileno())
 
+  def forked(self):
+    """
+    Each clone writes into its own file, named after the original one,
+    with PID of the clone appended. Data buffered before the fork, not yet
+    written into the original file, end up in the new file.
+    """
+
+    self.DEBUG('%s.forked', self.__class__.__name__)
+
+    path = '%s.%i' % (self.stream.name, os.getpid())
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.dup2(fd, self.fd)
+    os.close(fd)
+
+    self.flush()
+
+    self.desc = '<file %s>' % path
+
 class FDOutputStream(OutputStream):
   def __init__(self, machine, fd, **kwargs):
     super(FDOutputStream, self).__init__(machine, '<fd %s>' % fd, fd = fd)
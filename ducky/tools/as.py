@@ -1,15 +1,18 @@
+import hashlib
 import os
+import shutil
 import sys
 
 from six import iteritems, PY2
 
 from ..errors import PatchTooLargeError, AssemblerError
 from ..log import get_logger
+from ..util import str2bytes
 
-def get_assembler_process(logger, buffer, file_in, options):
+def get_assembler_process(logger, buffer, file_in, options, preprocessor_cache = None):
   from ..asm import AssemblerProcess
 
-  return AssemblerProcess(file_in, defines = options.defines, includes = options.includes, logger = logger)
+  return AssemblerProcess(file_in, defines = options.defines, includes = list(options.includes), cpp = options.cpp, preprocessor_cache = preprocessor_cache, logger = logger)
 
 def encode_blob(logger, file_in, options):
   logger = get_logger()
@@ -209,11 +212,146 @@ def save_object_file(logger, sections, file_out, options):
 
     f_section.payload = reloc_content
 
-    f_out.save()
+    f_out.save(mmapable_sections = options.mmapable_sections)
 
-def main():
+def get_object_cache_key(process, options):
+  """
+  Compute key of the object file in object cache. Key covers everything that
+  affects the content of the object file - preprocessed source, which
+  includes names of all source files, defines, options of the resulting
+  binary, and version of the assembler.
+
+  :param ducky.asm.AssemblerProcess process: process with preprocessed source.
+  :rtype: str
+  """
+
+  import ducky
+
+  h = hashlib.sha1()
+
+  h.update(str2bytes(ducky.__version__))
+  h.update(str2bytes(process.preprocessed))
+  h.update(str2bytes(' '.join(sorted(options.defines))))
+  h.update(str2bytes(str((options.mmapable_sections, options.writable_sections))))
+
+  return h.hexdigest()
+
+def assemble_file(logger, file_in, file_out, options, preprocessor_cache = None):
+  """
+  Translate one input file into an object file.
+
+  :returns: ``True`` when the file was translated successfully, ``False``
+    otherwise.
+  """
+
+  logger.debug('assemble_file: file_in=%s, file_out=%s', file_in, file_out)
+
+  if options.blob is True and options.preprocess is not True:
+    save_object_file(logger, encode_blob(logger, file_in, options), file_out, options)
+    return True
+
+  process = get_assembler_process(logger, None, file_in, options, preprocessor_cache = preprocessor_cache)
+
+  try:
+    process.preprocess()
+
+    if options.preprocess is True:
+      with open(file_out, 'w') as f_out:
+        f_out.write(process.preprocessed)
+
+      return True
+
+    cache_path = None
+
+    if options.cache_dir is not None:
+      cache_path = os.path.join(options.cache_dir, get_object_cache_key(process, options) + '.o')
+
+      if os.path.exists(cache_path):
+        logger.debug('assemble_file: using cached object %s', cache_path)
+
+        if os.path.exists(file_out) and not options.force:
+          logger.error('Output file %s already exists, use -f to force overwrite', file_out)
+          return False
+
+        shutil.copyfile(cache_path, file_out)
+        return True
+
+    process.translate()
+
+  except AssemblerError as e:
+    e.log(logger.error)
+    return False
+
+  save_object_file(logger, process.sections_pass3, file_out, options)
+
+  if cache_path is not None:
+    # Another process may be storing the same object, therefore write a private
+    # copy, and then atomically rename it
+    tmp_path = '%s.%i' % (cache_path, os.getpid())
+
+    shutil.copyfile(file_out, tmp_path)
+    os.rename(tmp_path, cache_path)
+
+  return True
+
+_WORKER_OPTIONS = None
+_WORKER_PREPROCESSOR_CACHE = None
+
+def _init_worker(options):
+  global _WORKER_OPTIONS, _WORKER_PREPROCESSOR_CACHE
+
+  from ..asm.parser import get_parser
+  from ..asm.preprocessor import SourceCache
+
+  _WORKER_OPTIONS = options
+  _WORKER_PREPROCESSOR_CACHE = SourceCache()
+
+  # Build parser tables now, once for all files this worker will translate
+  get_parser()
+
+def _assemble_file_worker(files):
+  try:
+    return assemble_file(get_logger(), files[0], files[1], _WORKER_OPTIONS, preprocessor_cache = _WORKER_PREPROCESSOR_CACHE)
+
+  except SystemExit:
+    return False
+
+def assemble_files(logger, files, options):
+  """
+  Translate input files into object files. When ``options.jobs`` is greater
+  than one, files are translated in parallel, by a pool of worker processes.
+
+  :param list files: list of ``(input file, output file)`` pairs.
+  :returns: ``True`` when all files were translated successfully.
+  """
+
+  if options.cache_dir is not None and not os.path.exists(options.cache_dir):
+    os.makedirs(options.cache_dir)
+
+  if options.jobs > 1 and len(files) > 1:
+    import multiprocessing
+
+    pool = multiprocessing.Pool(min(options.jobs, len(files)), initializer = _init_worker, initargs = (options,))
+
+    try:
+      return all(pool.map(_assemble_file_worker, files))
+
+    finally:
+      pool.close()
+      pool.join()
+
+  from ..asm.preprocessor import SourceCache
+
+  # Included files are often shared by all input files, read and parse them just once
+  preprocessor_cache = SourceCache()
+
+  results = [assemble_file(logger, file_in, file_out, options, preprocessor_cache = preprocessor_cache) for file_in, file_out in files]
+
+  return all(results)
+
+def create_option_parser():
   import optparse
-  from . import add_common_options, parse_options
+  from . import add_common_options
 
   parser = optparse.OptionParser()
   add_common_options(parser)
@@ -229,7 +367,10 @@ def main():
   group.add_option('-E', dest = 'preprocess', action = 'store_true', default = False, help = 'Preprocess only')
   group.add_option('-D', dest = 'defines', action = 'append', default = [], help = 'Define variable', metavar = 'VAR')
   group.add_option('-I', dest = 'includes', action = 'append', default = [], help = 'Add directory to list of include dirs', metavar = 'DIR')
+  group.add_option('--cpp', dest = 'cpp', action = 'store_true', default = False, help = 'Use external C preprocessor instead of the built-in one')
   group.add_option('--verify-disassemble', dest = 'verify_disassemble', action = 'store_true', default = False, help = 'Verify that disassebler instructions match input text')
+  group.add_option('-j', '--jobs', dest = 'jobs', action = 'store', type = 'int', default = 1, help = 'Translate up to N input files in parallel', metavar = 'N')
+  group.add_option('--cache-dir', dest = 'cache_dir', action = 'store', default = None, help = 'Store object files in DIR, and reuse them when their sources did not change', metavar = 'DIR')
 
   group = optparse.OptionGroup(parser, 'Binary options')
   parser.add_option_group(group)
@@ -238,6 +379,13 @@ def main():
   group.add_option('-m', '--mmapable-sections', dest = 'mmapable_sections', action = 'store_true', default = False, help = 'Create mmap\'able sections')
   group.add_option('-w', '--writable-sections', dest = 'writable_sections', action = 'store_true', default = False, help = '.text and other read-only sections will be marked as writable too')
 
+  return parser
+
+def main():
+  from . import parse_options
+
+  parser = create_option_parser()
+
   options, logger = parse_options(parser)
 
   if not options.file_in:
@@ -248,37 +396,7 @@ def main():
     logger.error('If specified, number of output files must be equal to number of input files')
     sys.exit(1)
 
-  for file_in in options.file_in:
-    with open(file_in, 'r') as f_in:
-      buffer = f_in.read()
+  files_out = options.file_out or [os.path.splitext(file_in)[0] + '.o' for file_in in options.file_in]
 
-    if options.file_out:
-      file_out = options.file_out.pop(0)
-
-    else:
-      file_out = os.path.splitext(file_in)[0] + '.o'
-
-    if options.preprocess is True:
-      process = get_assembler_process(logger, buffer, file_in, options)
-      process.preprocess()
-
-      with open(file_out, 'w') as f_out:
-        f_out.write(process.preprocessed)
-
-    else:
-      if options.blob is True:
-        sections = encode_blob(logger, file_in, options)
-
-      else:
-        process = get_assembler_process(logger, buffer, file_in, options)
-
-        try:
-          process.translate()
-
-        except AssemblerError as e:
-          e.log(logger.error)
-          sys.exit(1)
-
-        sections = process.sections_pass3
-
-      save_object_file(logger, sections, file_out, options)
+  if not assemble_files(logger, list(zip(options.file_in, files_out)), options):
+    sys.exit(1)
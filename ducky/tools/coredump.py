@@ -2,21 +2,23 @@ import sys
 import optparse
 import string
 
-from six import print_, iteritems
+from six import print_
 from functools import partial
 
-from ..snapshot import CoreDumpFile
+from ..snapshot import CoreDumpFile, flatten_snapshot
 from ..mm import PAGE_SIZE, UINT32_FMT, PAGE_MASK, u32_t, u16_t, u8_t, UINT8_FMT, UINT16_FMT
-from ..mm.binary import File, SectionTypes
+from ..mm.binary import File
 from ..cpu import CoreFlags
 from ..cpu.registers import Registers
-from ..util import str2int, align
+from ..util import str2int, align, SymbolTable
 from ..log import get_logger
 
 def show_header(logger, state):
+  parent = getattr(state, 'parent', None)
   state = state.get_child('machine')
 
   logger.info('=== Coredump header ===')
+  logger.info('  Parent:         %s', parent if parent is not None else '<none>')
   logger.info('  # of CPUs:      %i', state.nr_cpus)
   logger.info('  # of CPU cores: %i', state.nr_cores)
   logger.info('')
@@ -92,17 +94,8 @@ def show_pages(logger, state, empty_pages = False):
     logger.info('')
 
 def __load_forth_symbols(logger):
-  symbols = {}
-
   with File.open(logger, 'forth/ducky-forth', 'r') as f:
-    for section in f.sections:
-      if section.header.type != SectionTypes.SYMBOLS:
-        continue
-
-      for index, entry in enumerate(section.payload):
-        symbols[entry.address] = f.string_table.get_string(entry.name)
-
-  return symbols
+    return SymbolTable(f)
 
 def __read(state, cnt, address):
   pid = (address & PAGE_MASK) >> 8
@@ -139,7 +132,10 @@ def __show_forth_word(state, symbols, base_address, ending_addresses):
 
   while True:
     code_token = __read_u32(code_address).value
-    token_name = symbols.get(code_token, '<unknown>')
+    token_name, offset = symbols[code_token]
+
+    if token_name is None or offset != 0:
+      token_name = '<unknown>'
 
     I('  %s  %s - %s', UINT32_FMT(code_address), UINT32_FMT(code_token), token_name)
 
@@ -158,7 +154,7 @@ def show_forth_word(logger, state, base_address):
 
   symbols = __load_forth_symbols(logger)
 
-  __show_forth_word(state, symbols, base_address, [[k for k, v in iteritems(symbols) if v == 'EXIT'][0]])
+  __show_forth_word(state, symbols, base_address, [symbols.get_symbol('EXIT').address])
 
 def show_forth_dict(logger, state, last):
   I = get_logger().info
@@ -170,7 +166,7 @@ def show_forth_dict(logger, state, last):
   symbols = __load_forth_symbols(logger)
 
   base_address = __read_u32(last).value
-  ending_addresses = [[k for k, v in iteritems(symbols) if v == 'EXIT'][0]]
+  ending_addresses = [symbols.get_symbol('EXIT').address]
 
   while base_address != 0x00000000:
     I('')
@@ -225,6 +221,9 @@ def main():
 
   parser.add_option('-Q',         dest = 'queries',  default = [],    action = 'append',     help = 'Query snapshot')
 
+  parser.add_option('--flatten',     dest = 'flatten',     default = None, action = 'store', help = 'Merge incremental snapshot with its parents, and save the result into a file')
+  parser.add_option('--compression', dest = 'compression', default = None, action = 'store', help = 'Compression of the flattened snapshot')
+
   options, logger = parse_options(parser)
 
   if not options.file_in:
@@ -236,6 +235,12 @@ def main():
 
   logger.info('Input file: %s', options.file_in)
 
+  if options.flatten:
+    flatten_snapshot(logger, options.file_in).save(options.flatten, compression = options.compression)
+
+    logger.info('Flattened snapshot saved as %s', options.flatten)
+    return
+
   with CoreDumpFile.open(logger, options.file_in, 'r') as f_in:
     state = f_in.load()
 
@@ -1,11 +1,13 @@
 import ast
 import collections
+import hashlib
+import io
+import json
 import logging
 import os
 import re
 import sys
 import tarfile
-import tempfile
 
 from six import iteritems, integer_types
 from functools import partial
@@ -17,6 +19,142 @@ from ..asm import align_to_next_page
 from ..errors import Error, UnalignedJumpTargetError, EncodingLargeValueError, UnknownSymbolError, PatchTooLargeError, BadLinkerScriptError, IncompatibleSectionFlagsError, UnknownDestinationSectionError, LinkerError
 from ..log import get_logger
 
+#: Name of archive member with symbol index.
+ARCHIVE_INDEX = '__.SYMDEF'
+
+#: Version of archive's symbol index.
+ARCHIVE_INDEX_VERSION = 1
+
+#: Version of link map, created by incremental linking.
+LINK_MAP_VERSION = 2
+
+#: Symbols linker tries to find in archives even when no object file
+#: references them.
+DEFAULT_UNDEFINED_SYMBOLS = ['_start']
+
+def get_defined_symbols(f_in, globals_only = False):
+  """
+  Return names of symbols defined by an object file.
+
+  :param ducky.mm.binary.File f_in: object file.
+  :param bool globals_only: if set, only globally visible symbols are returned.
+  :rtype: ``set`` of ``str``
+  """
+
+  symbols = set()
+
+  for section in f_in.sections:
+    if section.header.type != SectionTypes.SYMBOLS:
+      continue
+
+    for symbol in section.payload:
+      if globals_only and symbol.flags.globally_visible == 0:
+        continue
+
+      symbols.add(f_in.string_table.get_string(symbol.name))
+
+  return symbols
+
+def get_undefined_symbols(f_in):
+  """
+  Return names of symbols referenced by relocations of an object file but
+  not defined by the same file.
+
+  :param ducky.mm.binary.File f_in: object file.
+  :rtype: ``set`` of ``str``
+  """
+
+  symbols = set()
+
+  for section in f_in.sections:
+    if section.header.type != SectionTypes.RELOC:
+      continue
+
+    for reloc_entry in section.payload:
+      symbols.add(f_in.string_table.get_string(reloc_entry.name))
+
+  return symbols - get_defined_symbols(f_in)
+
+class Archive(object):
+  """
+  Archive of object files, created by :py:func:`archive_files`. Members are
+  read directly from the archive, without extracting them. When the archive
+  has a symbol index, only members defining requested symbols are loaded.
+
+  :param logger: logger to use.
+  :param str path: path to the archive.
+  """
+
+  def __init__(self, logger, path):
+    self.DEBUG = logger.debug
+
+    self._logger = logger
+    self.path = path
+
+    self._tarfile = tarfile.open(path, 'r:gz')
+
+    self.member_names = [member.name for member in self._tarfile.getmembers() if member.name != ARCHIVE_INDEX]
+    self.members = {}
+
+    if ARCHIVE_INDEX in self._tarfile.getnames():
+      index = json.loads(self._tarfile.extractfile(ARCHIVE_INDEX).read().decode('utf-8'))
+
+      if index['version'] != ARCHIVE_INDEX_VERSION:
+        raise LinkerError('%s: unsupported version of symbol index: %s' % (path, index['version']))
+
+      self.index = index['symbols']
+
+    else:
+      self.index = None
+
+  def close(self):
+    for f_in in self.members.values():
+      f_in.close()
+
+    self._tarfile.close()
+
+  def load_member(self, name):
+    """
+    Load archive member.
+
+    :param str name: name of the member.
+    :rtype: ducky.mm.binary.File
+    """
+
+    self.DEBUG('%s: load member %s', self.path, name)
+
+    f_in = File.open_buffer(self._logger, '%s(%s)' % (self.path, name), self._tarfile.extractfile(name).read())
+    self.members[name] = f_in
+
+    return f_in
+
+  def pull(self, symbols):
+    """
+    Load members defining any of given symbols, and not loaded yet. When the
+    archive has no symbol index, all members are loaded.
+
+    :param symbols: names of requested symbols.
+    :returns: newly loaded members.
+    :rtype: ``list`` of :py:class:`ducky.mm.binary.File`
+    """
+
+    if self.index is None:
+      names = self.member_names
+
+    else:
+      names = set([self.index[symbol] for symbol in symbols if symbol in self.index])
+
+    return [self.load_member(name) for name in self.member_names if name in names and name not in self.members]
+
+  def loaded_members(self):
+    """
+    Return loaded members, in the order they are stored in the archive.
+
+    :rtype: ``list`` of :py:class:`ducky.mm.binary.File`
+    """
+
+    return [self.members[name] for name in self.member_names if name in self.members]
+
 class LinkerScript(object):
   def __init__(self, filepath = None):
     self._filepath = filepath
@@ -73,6 +211,13 @@ class LinkerScript(object):
   def where_to_base(self, section):
     return self._dst_section_start.get(section)
 
+  def digest(self):
+    if self._filepath is None:
+      return None
+
+    with open(self._filepath, 'rb') as f:
+      return hashlib.sha1(f.read()).hexdigest()
+
 class LinkerInfo(object):
   def __init__(self, linker_script):
     super(LinkerInfo, self).__init__()
@@ -81,9 +226,400 @@ class LinkerInfo(object):
     self.relocations = collections.defaultdict(list)
     self.symbols = collections.defaultdict(list)
     self.section_bases = collections.defaultdict(dict)
+    self.symbol_ranges = {}
 
     self.linker_script = linker_script
 
+def file_digest(f_in):
+  """
+  Compute hash of file content.
+
+  :param ducky.util.BinaryFile f_in: opened file.
+  :rtype: str
+  """
+
+  f_in.seek(0)
+
+  return hashlib.sha1(f_in.read()).hexdigest()
+
+def get_symbol_addresses(f_in):
+  """
+  Return addresses of all symbols defined by a binary.
+
+  :param ducky.mm.binary.File f_in: binary.
+  :returns: mapping between symbol names and sets of their addresses.
+  :rtype: ``dict``
+  """
+
+  addresses = collections.defaultdict(set)
+
+  for section in f_in.sections:
+    if section.header.type != SectionTypes.SYMBOLS:
+      continue
+
+    for symbol in section.payload:
+      addresses[f_in.string_table.get_string(symbol.name)].add(symbol.address)
+
+  return addresses
+
+#: Input of a link, as recorded in link map - hash of its content, placement
+#: of its sections (``{src section: (dst section, offset, size)}``), range
+#: of its symbols in output's symbol table, and its relocation sites
+#: (``{symbol: [(reloc section index, entry index), ...]}``).
+LinkMapInput = collections.namedtuple('LinkMapInput', ['digest', 'sections', 'symbols', 'relocations'])
+
+def get_relocation_sites(f_in):
+  """
+  Find relocation sites of an object file.
+
+  :param ducky.mm.binary.File f_in: object file.
+  :returns: mapping between symbol names and lists of ``(reloc section
+    index, entry index)`` pairs of relocations referring to them.
+  :rtype: ``dict``
+  """
+
+  sites = collections.defaultdict(list)
+
+  for section in f_in.sections:
+    if section.header.type != SectionTypes.RELOC:
+      continue
+
+    for i, reloc_entry in enumerate(section.payload):
+      sites[f_in.string_table.get_string(reloc_entry.name)].append((section.header.index, i))
+
+  return dict(sites)
+
+class LinkMap(object):
+  """
+  Layout of a linked binary - what inputs were linked, where their sections
+  were placed, where their symbols are, and which symbols their relocations
+  refer to. Map is stored next to the binary, and it allows incremental
+  relinking: when inputs change but their sections still fit into the same
+  space, unchanged inputs are neither merged nor resolved again, only the
+  content and symbols of changed inputs are replaced, and only relocations
+  affected by the change are applied again.
+
+  :param str file_out: path to the binary.
+  """
+
+  def __init__(self, file_out):
+    self.file_out = file_out
+    self.path = file_out + '.map'
+
+    self.script = None
+    self.mmapable_sections = False
+    self.output = None
+
+    self.inputs = collections.OrderedDict()
+    self.bases = {}
+
+    self.binary = None
+    self.symbols = {}
+
+  def save(self):
+    with open(self.file_out, 'rb') as f:
+      self.output = hashlib.sha1(f.read()).hexdigest()
+
+    data = {
+      'version': LINK_MAP_VERSION,
+      'script': self.script,
+      'mmapable_sections': self.mmapable_sections,
+      'output': self.output,
+      'inputs': [{'name': name, 'digest': entry.digest, 'sections': entry.sections, 'symbols': entry.symbols, 'relocations': entry.relocations} for name, entry in iteritems(self.inputs)],
+      'bases': self.bases
+    }
+
+    with open(self.path, 'w') as f:
+      json.dump(data, f, indent = 2, sort_keys = True)
+
+  @staticmethod
+  def load(file_out):
+    """
+    Load link map of a binary, together with the binary itself.
+
+    :param str file_out: path to the binary.
+    :returns: link map, or ``None`` if there is no usable map.
+    :rtype: LinkMap
+    """
+
+    D = get_logger().debug
+
+    link_map = LinkMap(file_out)
+
+    if not os.path.exists(link_map.path) or not os.path.exists(file_out):
+      D('No link map for %s', file_out)
+      return None
+
+    with open(link_map.path, 'r') as f:
+      data = json.load(f)
+
+    if data['version'] != LINK_MAP_VERSION:
+      D('Unsupported link map version %s', data['version'])
+      return None
+
+    link_map.script = data['script']
+    link_map.mmapable_sections = data['mmapable_sections']
+    link_map.output = data['output']
+    link_map.bases = data['bases']
+
+    for entry in data['inputs']:
+      sections = dict([(name, tuple(contribution)) for name, contribution in iteritems(entry['sections'])])
+      relocations = dict([(name, [tuple(site) for site in sites]) for name, sites in iteritems(entry['relocations'])])
+
+      link_map.inputs[entry['name']] = LinkMapInput(entry['digest'], sections, tuple(entry['symbols']), relocations)
+
+    # Binary is kept in memory, its file is going to be overwritten
+    with open(file_out, 'rb') as f:
+      content = f.read()
+
+    if hashlib.sha1(content).hexdigest() != link_map.output:
+      D('Binary %s changed since it was linked', file_out)
+      return None
+
+    link_map.binary = File.open_buffer(get_logger(), file_out, content)
+    link_map.symbols = get_symbol_addresses(link_map.binary)
+
+    return link_map
+
+  @staticmethod
+  def create(info, f_out, fs_in, digests, mmapable_sections = False, previous = None, changed = None):
+    """
+    Create link map of a binary. Hash of binary's content is computed when
+    the map is saved.
+
+    :param LinkerInfo info: linker info, describing layout of the binary.
+    :param ducky.mm.binary.File f_out: saved binary.
+    :param list fs_in: linked object files.
+    :param list digests: hashes of linked object files.
+    :param LinkMap previous: if set, binary was linked incrementally, using
+      this map, and relocation sites of inputs that did not change are
+      taken from it.
+    :param set changed: object files changed since the previous link.
+    """
+
+    link_map = LinkMap(f_out.name)
+
+    link_map.script = info.linker_script.digest()
+    link_map.mmapable_sections = mmapable_sections
+
+    for f_in, digest in zip(fs_in, digests):
+      sections = {}
+
+      for index, offset in iteritems(info.section_offsets[f_in]):
+        section = f_in.get_section_by_index(index)
+
+        sections[section.name] = (info.linker_script.where_to_merge(section.name), offset, section.header.data_size)
+
+      if previous is not None and f_in not in changed:
+        relocations = previous.inputs[f_in.name].relocations
+
+      else:
+        relocations = get_relocation_sites(f_in)
+
+      link_map.inputs[f_in.name] = LinkMapInput(digest, sections, info.symbol_ranges.get(f_in, (0, 0)), relocations)
+
+    for section in f_out.sections:
+      if section.header.type == SectionTypes.PROGBITS:
+        link_map.bases[section.name] = section.header.base
+
+    return link_map
+
+  def get_changed_inputs(self, info, fs_in, digests, mmapable_sections = False):
+    """
+    Find inputs that changed since the last link.
+
+    :returns: changed object files, or ``None`` when inputs cannot be linked
+      incrementally.
+    :rtype: ``set`` of :py:class:`ducky.mm.binary.File`
+    """
+
+    D = get_logger().debug
+
+    if self.script != info.linker_script.digest() or self.mmapable_sections != mmapable_sections:
+      D('Linker options changed')
+      return None
+
+    if list(self.inputs.keys()) != [f_in.name for f_in in fs_in]:
+      D('Set of inputs changed')
+      return None
+
+    changed = set()
+
+    for f_in, digest in zip(fs_in, digests):
+      entry = self.inputs[f_in.name]
+
+      if digest == entry.digest:
+        continue
+
+      D('Input %s changed', f_in.name)
+
+      sections = dict([(section.name, section) for section in f_in.sections if section.header.type == SectionTypes.PROGBITS])
+
+      if sorted(sections.keys()) != sorted(entry.sections.keys()):
+        D('  its set of sections changed')
+        return None
+
+      for name, section in iteritems(sections):
+        if section.header.data_size > entry.sections[name][2]:
+          D('  section %s does not fit', name)
+          return None
+
+      changed.add(f_in)
+
+    return changed
+
+  def pad_sections(self, f_in):
+    """
+    Pad sections of an object file to the size they had in the last link.
+    """
+
+    for section in f_in.sections:
+      if section.header.type != SectionTypes.PROGBITS:
+        continue
+
+      padding = self.inputs[f_in.name].sections[section.name][2] - section.header.data_size
+
+      if padding == 0:
+        continue
+
+      section.header.data_size += padding
+
+      if section.header.flags.bss != 1:
+        section.payload += bytearray(padding)
+
+  def copy_sections(self, f_out):
+    """
+    Create sections of a new binary, with the same layout and content as
+    sections of the binary from the last link.
+    """
+
+    for section in self.binary.sections:
+      if section.header.type != SectionTypes.PROGBITS:
+        continue
+
+      dst_section = f_out.create_section(name = section.name)
+      dst_header = dst_section.header
+
+      dst_header.type      = section.header.type
+      dst_header.name      = f_out.string_table.put_string(section.name)
+      dst_header.flags     = section.header.flags
+      dst_header.base      = section.header.base
+      dst_header.data_size = section.header.data_size
+      dst_header.file_size = section.header.data_size
+      dst_section.payload  = section.payload[:]
+
+  def copy_symbols(self, f_out, f_in):
+    """
+    Copy symbols of an object file from symbol table of the binary from the
+    last link.
+
+    :returns: list of ``(name, symbol)`` pairs.
+    """
+
+    string_table = self.binary.string_table
+    start, end = self.inputs[f_in.name].symbols
+
+    symbols = []
+
+    for symbol in self.binary.get_section_by_type(SectionTypes.SYMBOLS).payload[start:end]:
+      symbol_name = string_table.get_string(symbol.name)
+
+      dst_symbol = SymbolEntry()
+      dst_symbol.flags = symbol.flags
+      dst_symbol.name = f_out.string_table.put_string(symbol_name)
+      dst_symbol.address = symbol.address
+      dst_symbol.size = symbol.size
+      dst_symbol.section = symbol.section
+      dst_symbol.type = symbol.type
+      dst_symbol.filename = f_out.string_table.put_string(string_table.get_string(symbol.filename))
+      dst_symbol.lineno = symbol.lineno
+
+      symbols.append((symbol_name, dst_symbol))
+
+    return symbols
+
+  def relink(self, info, f_out, fs_in, changed):
+    """
+    Link binary incrementally. Layout of the binary does not change, content
+    and symbols of unchanged inputs are copied from the binary from the last
+    link, only changed inputs are placed and resolved, and only relocations
+    of changed inputs, and relocations referring to symbols whose address
+    changed, are applied.
+
+    :param set changed: object files changed since the last link, their
+      sections must be already padded by :py:meth:`LinkMap.pad_sections`.
+    """
+
+    D = get_logger().debug
+
+    self.copy_sections(f_out)
+
+    for f_in in fs_in:
+      contributions = self.inputs[f_in.name].sections
+
+      for section in f_in.sections:
+        if section.header.type != SectionTypes.PROGBITS:
+          continue
+
+        dst_name, offset, size = contributions[section.name]
+        info.section_offsets[f_in][section.header.index] = offset
+
+        if f_in not in changed or section.header.flags.bss == 1:
+          continue
+
+        D('Replace content of %s:%s in %s', f_in.name, section.name, dst_name)
+
+        f_out.get_section_by_name(dst_name).payload[offset:offset + size] = section.payload
+
+    symbols = []
+    symbol_map = defaultdict(list)
+
+    for f_in in fs_in:
+      if f_in in changed:
+        file_symbols = resolve_file_symbols(info, f_out, f_in, [section for section in f_in.sections if section.header.type == SectionTypes.SYMBOLS])
+
+      else:
+        file_symbols = self.copy_symbols(f_out, f_in)
+
+      info.symbol_ranges[f_in] = (len(symbols), len(symbols) + len(file_symbols))
+
+      for symbol_name, dst_symbol in file_symbols:
+        symbols.append(dst_symbol)
+        symbol_map[symbol_name].append((dst_symbol, f_in))
+
+    create_symbol_table(f_out, symbols)
+    info.symbols = symbol_map
+
+    addresses = collections.defaultdict(set)
+
+    for symbol_name, family in iteritems(symbol_map):
+      addresses[symbol_name] = set([dst_symbol.address for dst_symbol, _ in family])
+
+    # Symbols that appeared or disappeared count as changed as well - relocations referring to a removed symbol must fail
+    changed_symbols = set(addresses.keys()) ^ set(self.symbols.keys())
+    changed_symbols |= set([name for name, symbol_addresses in iteritems(addresses) if self.symbols.get(name) != symbol_addresses])
+
+    D('Symbols with changed addresses: %s', ', '.join(sorted(changed_symbols)))
+
+    section_symbols = get_section_symbols(f_out)
+
+    for f_in in fs_in:
+      if f_in in changed:
+        for section in f_in.sections:
+          if section.header.type != SectionTypes.RELOC:
+            continue
+
+          for reloc_entry in section.payload:
+            patch_relocation(info, f_out, f_in, reloc_entry, section_symbols)
+
+        continue
+
+      sites = self.inputs[f_in.name].relocations
+
+      for symbol_name in changed_symbols:
+        for section_index, entry_index in sites.get(symbol_name, []):
+          patch_relocation(info, f_out, f_in, f_in.get_section_by_index(section_index).payload[entry_index], section_symbols)
+
 def merge_object_into(info, f_dst, f_src):
   D = get_logger().debug
 
@@ -262,59 +798,85 @@ def fix_section_bases(info, f_out):
 
   dump_sections()
 
-def resolve_symbols(info, f_out, f_ins):
+def resolve_file_symbols(info, f_out, f_in, symbol_sections):
+  """
+  Compute new addresses of symbols defined by an object file.
+
+  :param list symbol_sections: symbol sections of ``f_in``.
+  :returns: list of ``(name, symbol)`` pairs.
+  """
+
   D = get_logger().debug
 
-  D('Resolve symbols - compute their new addresses')
+  D('Processing file %s', f_in.name)
 
   symbols = []
-  symbol_map = []
-
-  symbol_map = defaultdict(list)
 
-  for f_in, symbol_sections in iteritems(info.symbols):
-    D('Processing file %s', f_in.name)
+  for section in symbol_sections:
+    D('Symbol section: %s', section.header)
 
-    for section in symbol_sections:
-      D('Symbol section: %s', section.header)
+    for symbol in section.payload:
+      symbol_name = f_in.string_table.get_string(symbol.name)
+      symbol._filename = f_in.string_table.get_string(symbol.filename)
 
-      for symbol in section.payload:
-        symbol_name = f_in.string_table.get_string(symbol.name)
-        symbol._filename = f_in.string_table.get_string(symbol.filename)
+      D('Symbol: %s', symbol_name)
 
-        D('Symbol: %s', symbol_name)
+      src_symbol_section = f_in.get_section_by_index(symbol.section)
+      D('  src section: %s', src_symbol_section.header)
+      D('  src section name: %s', src_symbol_section.name)
 
-        src_symbol_section = f_in.get_section_by_index(symbol.section)
-        D('  src section: %s', src_symbol_section.header)
-        D('  src section name: %s', src_symbol_section.name)
+      dst_symbol_section = f_out.get_section_by_name(info.linker_script.where_to_merge(src_symbol_section.name))
+      D('  dst section: %s', dst_symbol_section.header)
+      D('  dst section name: %s', dst_symbol_section.name)
 
-        dst_symbol_section = f_out.get_section_by_name(info.linker_script.where_to_merge(src_symbol_section.name))
-        D('  dst section: %s', dst_symbol_section.header)
-        D('  dst section name: %s', dst_symbol_section.name)
+      D('src base: %s, dst base: %s, symbol addr: %s, section dst offset: %s', UINT32_FMT(src_symbol_section.header.base), UINT32_FMT(dst_symbol_section.header.base), UINT32_FMT(symbol.address), UINT32_FMT(info.section_offsets[f_in][src_symbol_section.header.index]))
+      new_addr = symbol.address - src_symbol_section.header.base + info.section_offsets[f_in][src_symbol_section.header.index] + dst_symbol_section.header.base
 
-        D('src base: %s, dst base: %s, symbol addr: %s, section dst offset: %s', UINT32_FMT(src_symbol_section.header.base), UINT32_FMT(dst_symbol_section.header.base), UINT32_FMT(symbol.address), UINT32_FMT(info.section_offsets[f_in][src_symbol_section.header.index]))
-        new_addr = symbol.address - src_symbol_section.header.base + info.section_offsets[f_in][src_symbol_section.header.index] + dst_symbol_section.header.base
+      dst_symbol = SymbolEntry()
+      dst_symbol.flags = symbol.flags
+      dst_symbol.name = f_out.string_table.put_string(symbol_name)
+      dst_symbol.address = new_addr
+      dst_symbol.size = symbol.size
+      dst_symbol.section = dst_symbol_section.header.index
+      dst_symbol.type = symbol.type
+      dst_symbol.filename = f_out.string_table.put_string(symbol._filename)
+      dst_symbol.lineno = symbol.lineno
 
-        dst_symbol = SymbolEntry()
-        dst_symbol.flags = symbol.flags
-        dst_symbol.name = f_out.string_table.put_string(symbol_name)
-        dst_symbol.address = new_addr
-        dst_symbol.size = symbol.size
-        dst_symbol.section = dst_symbol_section.header.index
-        dst_symbol.type = symbol.type
-        dst_symbol.filename = f_out.string_table.put_string(symbol._filename)
-        dst_symbol.lineno = symbol.lineno
+      symbols.append((symbol_name, dst_symbol))
 
-        symbols.append(dst_symbol)
-        symbol_map[symbol_name].append((dst_symbol, f_in))
+      D('New symbol: %s', dst_symbol)
 
-        D('New symbol: %s', dst_symbol)
+  return symbols
 
+def create_symbol_table(f_out, symbols):
   symtab = f_out.create_section(name = '.symtab')
   symtab.header.name = f_out.string_table.put_string('.symtab')
   symtab.header.type = SectionTypes.SYMBOLS
   symtab.payload = symbols
 
+def resolve_symbols(info, f_out, f_ins):
+  D = get_logger().debug
+
+  D('Resolve symbols - compute their new addresses')
+
+  symbols = []
+  symbol_map = defaultdict(list)
+
+  # Walk files in the order they were linked, to keep symbol table stable
+  for f_in in f_ins:
+    if f_in not in info.symbols:
+      continue
+
+    file_symbols = resolve_file_symbols(info, f_out, f_in, info.symbols[f_in])
+
+    info.symbol_ranges[f_in] = (len(symbols), len(symbols) + len(file_symbols))
+
+    for symbol_name, dst_symbol in file_symbols:
+      symbols.append(dst_symbol)
+      symbol_map[symbol_name].append((dst_symbol, f_in))
+
+  create_symbol_table(f_out, symbols)
+
   info.symbols = symbol_map
 
 
@@ -424,13 +986,15 @@ class RelocationPatcher(object):
     content[content_index + 2] = (value >> 16) & 0xFF
     content[content_index + 3] = (value >> 24) & 0xFF
 
-def resolve_relocations(info, f_out, f_ins):
-  logger, D = get_logger(), get_logger().debug
+def get_section_symbols(f_out):
+  """
+  Create symbols for all sections of a binary, named after sections, pointing
+  to their bases.
 
-  D('')
-  D('----- * ----- * ----- * ----- * -----')
-  D('Resolve relocations')
-  D('----- * ----- * ----- * ----- * -----')
+  :rtype: ``dict``
+  """
+
+  D = get_logger().debug
 
   section_symbols = {}
 
@@ -444,72 +1008,111 @@ def resolve_relocations(info, f_out, f_ins):
 
     section_symbols[section.name] = se
 
-  for f_in, reloc_sections in iteritems(info.relocations):
-    D('Processing file %s', f_in.name)
+  return section_symbols
 
-    for section in reloc_sections:
-      for reloc_entry in section.payload:
-        D('-----*-----*-----')
-        D('  %s', reloc_entry)
+def patch_relocation(info, f_out, f_in, reloc_entry, section_symbols):
+  """
+  Patch merged section with final address of a symbol referenced by a
+  relocation.
+
+  :param ducky.mm.binary.File f_in: object file the relocation belongs to.
+  :param ducky.mm.binary.RelocEntry reloc_entry: relocation.
+  :param dict section_symbols: symbols of sections, see
+    :py:func:`get_section_symbols`.
+  """
+
+  logger, D = get_logger(), get_logger().debug
+
+  D('-----*-----*-----')
+  D('  %s', reloc_entry)
 
-        symbol_name = f_in.string_table.get_string(reloc_entry.name)
+  symbol_name = f_in.string_table.get_string(reloc_entry.name)
 
-        # Get all involved sections
-        src_section = f_in.get_section_by_index(reloc_entry.patch_section)
-        dst_section_name = info.linker_script.where_to_merge(src_section.name)
-        dst_section = f_out.get_section_by_name(dst_section_name)
+  # Get all involved sections
+  src_section = f_in.get_section_by_index(reloc_entry.patch_section)
+  dst_section_name = info.linker_script.where_to_merge(src_section.name)
+  dst_section = f_out.get_section_by_name(dst_section_name)
 
-        D('  src section: %s', src_section.name)
-        D('  src header: %s', src_section.header)
-        D('  dst section: %s', dst_section.name)
-        D('  dst header: %s', dst_section.header)
-        D('  symbol: %s', symbol_name)
-        D('  file: %s', f_in.name)
+  D('  src section: %s', src_section.name)
+  D('  src header: %s', src_section.header)
+  D('  dst section: %s', dst_section.name)
+  D('  dst header: %s', dst_section.header)
+  D('  symbol: %s', symbol_name)
+  D('  file: %s', f_in.name)
 
-        # Find referenced symbol
-        if symbol_name in info.symbols:
-          symbol_family = info.symbols[symbol_name]
+  # Find referenced symbol
+  if symbol_name in info.symbols:
+    symbol_family = info.symbols[symbol_name]
 
-          if len(symbol_family) > 1:
-            D('  multiple candidates:')
-            for se, f_src in symbol_family:
-              D('    %s from file %s', se, f_src.name)
+    if len(symbol_family) > 1:
+      D('  multiple candidates:')
+      for se, f_src in symbol_family:
+        D('    %s from file %s', se, f_src.name)
 
-            for se, f_src in symbol_family:
-              if f_in.name == f_src.name:
-                D('  found file match in %s from %s', se, f_in.name)
-                break
+      for se, f_src in symbol_family:
+        if f_in.name == f_src.name:
+          D('  found file match in %s from %s', se, f_in.name)
+          break
 
-            else:
-              logger.warn('Symbol with name "%s" has multiple candidates but no definitve match', symbol_name)
-              logger.warn('  file: %s', f_in.name)
+      else:
+        logger.warn('Symbol with name "%s" has multiple candidates but no definitve match', symbol_name)
+        logger.warn('  file: %s', f_in.name)
+
+        for se, f_src in symbol_family:
+          logger.warn('  %s from file %s', se, f_src.name)
+
+        return
+
+    else:
+      se, f_src = symbol_family[0]
+
+    if f_src != f_in and se.flags.globally_visible == 0:
+      raise UnknownSymbolError('Symbol "%s" is not globally visible' % symbol_name)
+
+  else:
+    if symbol_name not in section_symbols:
+      raise UnknownSymbolError('No such symbol "%s", referenced from %s' % (symbol_name, f_in.name))
 
-              for se, f_src in symbol_family:
-                logger.warn('  %s from file %s', se, f_src.name)
+    se = section_symbols[symbol_name]
 
-              continue
+  RelocationPatcher(reloc_entry, se, symbol_name, dst_section, original_section = src_section, section_offset = info.section_offsets[f_in][src_section.header.index]).patch()
 
-          else:
-            se, f_src = symbol_family[0]
+def resolve_relocations(info, f_out, f_ins):
+  """
+  Patch merged sections with final addresses of referenced symbols.
+  """
+
+  D = get_logger().debug
 
-          if f_src != f_in and se.flags.globally_visible == 0:
-            raise UnknownSymbolError('Symbol "%s" is not globally visible' % symbol_name)
+  D('')
+  D('----- * ----- * ----- * ----- * -----')
+  D('Resolve relocations')
+  D('----- * ----- * ----- * ----- * -----')
 
-        else:
-          if symbol_name not in section_symbols:
-            raise UnknownSymbolError('No such symbol "%s", referenced from %s' % (symbol_name, f_in.name))
+  section_symbols = get_section_symbols(f_out)
 
-          se = section_symbols[symbol_name]
+  for f_in, reloc_sections in iteritems(info.relocations):
+    D('Processing file %s', f_in.name)
 
-        RelocationPatcher(reloc_entry, se, symbol_name, dst_section, original_section = src_section, section_offset = info.section_offsets[f_in][src_section.header.index]).patch()
+    for section in reloc_sections:
+      for reloc_entry in section.payload:
+        patch_relocation(info, f_out, f_in, reloc_entry, section_symbols)
 
-def link_files(info, files_in, file_out):
+def link_files(info, files_in, file_out, mmapable_sections = False, undefined_symbols = None, incremental = False):
   D = get_logger().debug
 
-  fs_in = []
+  undefined_symbols = DEFAULT_UNDEFINED_SYMBOLS if undefined_symbols is None else undefined_symbols
+
+  inputs = []
+  archives = []
 
-  cleanup_dirs = []
-  opened_files = []
+  defined = set()
+  undefined = set(undefined_symbols)
+
+  def __add_object(f_in):
+    defined.update(get_defined_symbols(f_in, globals_only = True))
+    undefined.update(get_undefined_symbols(f_in))
+    undefined.difference_update(defined)
 
   def __gather_input_files():
     D('----- * ----- * ----- * ----- * -----')
@@ -520,51 +1123,82 @@ def link_files(info, files_in, file_out):
       D('Input file: %s', file_in)
 
       if file_in.endswith('.tgz'):
-        D('  archive, unpack and add its content')
-
-        with tarfile.open(file_in, 'r:gz') as f_in:
-          tmpdir = tempfile.mkdtemp()
-          cleanup_dirs.append(tmpdir)
+        D('  archive, its members are added when needed')
 
-          for member in f_in.getmembers():
-            f_in.extract(member, path = tmpdir)
-
-            D('  %s added', os.path.join(tmpdir, member.name))
-            fs_in.append(os.path.join(tmpdir, member.name))
+        archive = Archive(get_logger(), file_in)
+        archives.append(archive)
+        inputs.append(archive)
 
       else:
         D('  %s added', file_in)
-        fs_in.append(file_in)
+
+        f_in = File.open(get_logger(), file_in, 'r')
+        inputs.append(f_in)
+
+        __add_object(f_in)
+
+    # Pull archive members until no archive defines any of undefined symbols
+    while True:
+      pulled = False
+
+      for archive in archives:
+        for f_in in archive.pull(undefined):
+          D('  %s added', f_in.name)
+
+          __add_object(f_in)
+          pulled = True
+
+      if not pulled:
+        break
 
     D('')
 
   try:
     __gather_input_files()
 
-    with File.open(get_logger(), file_out, 'w') as f_out:
-      for file_in in fs_in:
-        f_in = File.open(get_logger(), file_in, 'r')
-        opened_files.append(f_in)
+    fs_in = []
 
-        merge_object_into(info, f_out, f_in)
+    for f_in in inputs:
+      fs_in += f_in.loaded_members() if isinstance(f_in, Archive) else [f_in]
 
-      fix_section_bases(info, f_out)
-      resolve_symbols(info, f_out, fs_in)
-      resolve_relocations(info, f_out, fs_in)
+    digests, link_map, changed = None, None, None
 
-      f_out.save()
+    if incremental is True:
+      digests = [file_digest(f_in) for f_in in fs_in]
+      link_map = LinkMap.load(file_out)
 
-  except KeyError as e:
-    import shutil
+      if link_map is not None:
+        changed = link_map.get_changed_inputs(info, fs_in, digests, mmapable_sections = mmapable_sections)
 
-    for d in cleanup_dirs:
-      shutil.rmtree(d)
+      if changed is not None:
+        D('Incremental link, changed inputs: %s', ', '.join([f_in.name for f_in in changed]))
 
-    raise e
+        for f_in in changed:
+          link_map.pad_sections(f_in)
+
+    with File.open(get_logger(), file_out, 'w') as f_out:
+      if changed is None:
+        for f_in in fs_in:
+          merge_object_into(info, f_out, f_in)
+
+        fix_section_bases(info, f_out)
+        resolve_symbols(info, f_out, fs_in)
+        resolve_relocations(info, f_out, fs_in)
+
+      else:
+        link_map.relink(info, f_out, fs_in, changed)
+
+      f_out.save(mmapable_sections = mmapable_sections)
+
+      if incremental is True:
+        link_map = LinkMap.create(info, f_out, fs_in, digests, mmapable_sections = mmapable_sections, previous = link_map if changed is not None else None, changed = changed)
+
+    if incremental is True:
+      link_map.save()
 
   finally:
-    for f in opened_files:
-      f.close()
+    for f_in in inputs:
+      f_in.close()
 
 def archive_files(logger, files_in, file_out):
   D = logger.debug
@@ -576,9 +1210,30 @@ def archive_files(logger, files_in, file_out):
     os.unlink(file_out)
 
   with tarfile.open(file_out, 'w:gz') as f_out:
-    for f_in in files_in:
-      D('  Adding %s', f_out)
-      f_out.add(f_in, recursive = False)
+    members = [f_out.gettarinfo(f_in) for f_in in files_in]
+
+    D('Creating symbol index')
+
+    index = {}
+
+    for f_in, member in zip(files_in, members):
+      with File.open(logger, f_in, 'r') as f:
+        for symbol in sorted(get_defined_symbols(f, globals_only = True)):
+          index.setdefault(symbol, member.name)
+
+    buff = json.dumps({'version': ARCHIVE_INDEX_VERSION, 'symbols': index}, sort_keys = True).encode('utf-8')
+
+    index_member = tarfile.TarInfo(ARCHIVE_INDEX)
+    index_member.size = len(buff)
+    index_member.mtime = min([member.mtime for member in members]) if members else 0
+
+    f_out.addfile(index_member, io.BytesIO(buff))
+
+    for f_in, member in zip(files_in, members):
+      D('  Adding %s', f_in)
+
+      with open(f_in, 'rb') as f:
+        f_out.addfile(member, f)
 
 def main():
   import optparse
@@ -597,6 +1252,9 @@ def main():
   parser.add_option_group(group)
   group.add_option('--script',       dest = 'script',       action = 'store',      default = None,  help = 'Linker script')
   group.add_option('--archive',      dest = 'archive',      action = 'store_true', default = False, help = 'Instead of linking, create an archive containing all input files')
+  group.add_option('-m', '--mmapable-sections', dest = 'mmapable_sections', action = 'store_true', default = False, help = 'Create mmap\'able sections')
+  group.add_option('--incremental',  dest = 'incremental',  action = 'store_true', default = False, help = 'Link incrementally, using link map stored next to the output file')
+  group.add_option('-u', '--undefined', dest = 'undefined', action = 'append', default = [], help = 'Link archive member defining this symbol even when it is not referenced')
 
   options, logger = parse_options(parser)
 
@@ -636,7 +1294,7 @@ def main():
       script = LinkerScript(options.script)
       info = LinkerInfo(script)
 
-      link_files(info, options.file_in, options.file_out)
+      link_files(info, options.file_in, options.file_out, mmapable_sections = options.mmapable_sections, undefined_symbols = DEFAULT_UNDEFINED_SYMBOLS + options.undefined, incremental = options.incremental)
 
     except LinkerError as e:
       __cleanup(e)
@@ -2,16 +2,11 @@ import sys
 import optparse
 import tabulate
 
-from six import itervalues, iteritems
-from collections import defaultdict
-
 from . import add_common_options, parse_options
-from ..cpu.instructions import DuckyInstructionSet, get_instruction_set, EncodingContext
-from ..mm import UINT16_FMT, SIZE_FMT, UINT32_FMT, UINT8_FMT, WORD_SIZE
+from ..mm import UINT16_FMT, SIZE_FMT, UINT32_FMT, UINT8_FMT
 from ..mm.binary import File, SectionTypes, SECTION_TYPES, SYMBOL_DATA_TYPES, SymbolDataTypes, RelocFlags, SymbolFlags, SectionFlags
 from ..log import get_logger
-
-from ..cpu.coprocessor.math_copro import MathCoprocessorInstructionSet  # noqa
+from ..asm.disassembler import disassemble_section, DEFAULT_CHUNK_SIZE
 
 def show_file_header(f):
   f_header = f.header
@@ -57,54 +52,12 @@ def show_sections(options, f):
 
   I('')
 
-def show_disassemble(f):
+def show_disassemble(options, f):
   logger, I = get_logger(), get_logger().info
 
   I('=== Disassemble ==')
   I('')
 
-  instruction_set = DuckyInstructionSet
-
-  symbols = defaultdict(list)
-
-  for section in f.sections:
-    if section.header.type != SectionTypes.SYMBOLS:
-      continue
-
-    for entry in section.payload:
-      symbol_section = f.get_section_by_index(entry.section)
-
-      if symbol_section.header.type != SectionTypes.PROGBITS:
-        continue
-
-      if symbol_section.header.flags.executable != 1:
-        continue
-
-      symbols[symbol_section.name].append((entry.address, f.string_table.get_string(entry.name)))
-
-  for symbols_list in itervalues(symbols):
-    symbols_list.sort(key = lambda x: x[0])
-
-  symbols_maps = {}
-  for section_name, symbols_list in iteritems(symbols):
-    symbol_map = symbols_maps[section_name] = {}
-
-    symbol_count = len(symbols_list)
-
-    for i in range(0, symbol_count):
-      symbol_addr, symbol_name = symbols_list[i]
-
-      if i == symbol_count - 1:
-        limit_addr = symbol_addr + f.get_section_by_name(section_name).header.data_size
-
-      else:
-        limit_addr, _ = symbols_list[i + 1]
-
-      for addr in range(symbol_addr, limit_addr, 4):
-        symbol_map[addr] = symbol_name
-
-  ctx = EncodingContext(logger)
-
   for section in f.sections:
     if section.header.type != SectionTypes.PROGBITS:
       continue
@@ -113,30 +66,17 @@ def show_disassemble(f):
       continue
 
     I('  Section %s', section.name)
+    I('')
 
-    table = [
-      ['', '', '', '']
-    ]
-
-    symbols_map = symbols_maps[section.name]
-    csp = section.header.base
-
-    payload = section.payload
-    for i in range(0, len(payload), WORD_SIZE):
-      raw_inst = payload[i] | (payload[i + 1] << 8) | (payload[i + 2] << 16) | (payload[i + 3] << 24)
-
-      symbol_name = symbols_map[csp]
-
-      inst, desc, opcode = ctx.decode(instruction_set, raw_inst)
-
-      table.append([UINT32_FMT(csp), UINT32_FMT(raw_inst), instruction_set.disassemble_instruction(get_logger(), raw_inst), symbol_name])
+    for chunk in disassemble_section(logger, f, section, chunk_size = options.chunk_size, jobs = options.jobs):
+      for inst in chunk:
+        annotation = inst.symbol or ''
 
-      if opcode == DuckyInstructionSet.opcodes.SIS:
-        instruction_set = get_instruction_set(inst.immediate)
+        if inst.relocations:
+          annotation += ' -> %s' % ', '.join(inst.relocations)
 
-      csp += 4
+        I('  %s  %s  %-32s  %s', UINT32_FMT(inst.address), UINT32_FMT(inst.raw), inst.disassembly, annotation)
 
-    get_logger().table(table)
     I('')
 
 def show_reloc(f):
@@ -277,6 +217,11 @@ def main():
   parser.add_option_group(group)
   group.add_option('--full-strings', dest = 'full_strings', default = False, action = 'store_true')
 
+  group = optparse.OptionGroup(parser, 'Disassemble options')
+  parser.add_option_group(group)
+  group.add_option('--chunk-size', dest = 'chunk_size', default = DEFAULT_CHUNK_SIZE, action = 'store', type = 'int', help = 'Disassemble N instructions at once', metavar = 'N')
+  group.add_option('-j', '--jobs', dest = 'jobs', default = 1, action = 'store', type = 'int', help = 'Disassemble chunks by N worker processes', metavar = 'N')
+
   options, logger = parse_options(parser)
 
   if not options.file_in:
@@ -305,4 +250,4 @@ def main():
         show_reloc(f_in)
 
       if options.disassemble:
-        show_disassemble(f_in)
+        show_disassemble(options, f_in)
@@ -8,26 +8,164 @@ import collections
 import optparse
 import sys
 
-from six import itervalues
+from six import iteritems, itervalues
+
+def is_binary_profile(path):
+  from ..profiler import PROFILE_MAGIC, read_profile_header
+
+  header = read_profile_header(path)
+
+  return header is not None and header.magic == PROFILE_MAGIC
 
 def read_profiling_data(logger, files_in):
-  from ..profiler import ProfileRecord
+  from ..profiler import ProfileRecord, read_profile
 
   data = collections.defaultdict(ProfileRecord)
 
   for path in files_in:
     logger.info('Reading profile data from %s', path)
 
-    with open(path, 'rb') as f_in:
-      file_data = pickle.load(f_in)
+    if is_binary_profile(path):
+      merged = 0
+
+      for entry in read_profile(path):
+        record = data[entry.ip]
+        record.ip = entry.ip
+        record.instruction_set_id = entry.instruction_set_id
+        record.count += entry.count
+
+        merged += 1
+
+    else:
+      logger.debug('%s is not a binary profile, trying pickle', path)
+
+      with open(path, 'rb') as f_in:
+        file_data = pickle.load(f_in)
+
+      for record in itervalues(file_data):
+        data[record.ip].merge(record)
+
+      merged = len(file_data)
+
+    logger.debug('%d records merged', merged)
+
+  return data
+
+def is_callgraph_profile(path):
+  from ..profiler import CALLGRAPH_MAGIC, read_profile_header
+
+  header = read_profile_header(path)
 
-    for record in itervalues(file_data):
-      data[record.ip].merge(record)
+  return header is not None and header.magic == CALLGRAPH_MAGIC
 
-    logger.debug('%d records merged', len(file_data))
+def read_callgraph_data(logger, files_in):
+  """
+  Read and merge call graph profiles.
+
+  :param list files_in: paths of profile files.
+  :returns: mapping between call paths - tuples of routine addresses,
+    starting with the root of call graph - and numbers of instructions
+    executed by the last routine of each path.
+  """
+
+  from ..profiler import CALLGRAPH_NO_PARENT, read_callgraph
+
+  data = collections.defaultdict(int)
+
+  for path in files_in:
+    logger.info('Reading call graph data from %s', path)
+
+    paths = []
+
+    for entry in read_callgraph(path):
+      call_path = (entry.ip,) if entry.parent == CALLGRAPH_NO_PARENT else paths[entry.parent] + (entry.ip,)
+
+      paths.append(call_path)
+      data[call_path] += entry.count
+
+    logger.debug('%d records merged', len(paths))
 
   return data
 
+def print_callgraph(logger, data, symbol_table, collapsed = None):
+  """
+  Print routines with their inclusive and exclusive instruction counts, and
+  table of caller/callee pairs. Recursive calls are counted just once for
+  each call path.
+
+  :param dict data: call graph, as returned by :py:func:`read_callgraph_data`.
+  :param ducky.util.SymbolTable symbol_table: symbols of profiled binary.
+  :param string collapsed: if set, call paths are written into this file,
+    in "collapsed stacks" format accepted by flame graph tools.
+  """
+
+  from ..mm import UINT32_FMT
+
+  names = {}
+
+  def __name(ip):
+    if ip not in names:
+      symbol, offset = symbol_table[ip]
+
+      if symbol is None:
+        names[ip] = UINT32_FMT(ip)
+
+      elif offset == 0:
+        names[ip] = symbol
+
+      else:
+        names[ip] = '%s+%s' % (symbol, UINT32_FMT(offset))
+
+    return names[ip]
+
+  inclusive = collections.defaultdict(int)
+  exclusive = collections.defaultdict(int)
+  calls = collections.defaultdict(int)
+  stacks = collections.defaultdict(int)
+
+  for call_path, count in iteritems(data):
+    if count == 0:
+      continue
+
+    call_path = [__name(ip) for ip in call_path]
+
+    stacks[';'.join(call_path)] += count
+    exclusive[call_path[-1]] += count
+
+    for name in set(call_path):
+      inclusive[name] += count
+
+    for pair in set(zip(call_path, call_path[1:])):
+      calls[pair] += count
+
+  all_hits = sum(itervalues(exclusive))
+
+  table = [
+    ['Routine', 'Inclusive', 'Exclusive', 'Percentage']
+  ]
+
+  for name in sorted(inclusive.keys(), key = lambda x: inclusive[x], reverse = True):
+    table.append([name, inclusive[name], exclusive[name], '%.02f' % (float(inclusive[name]) / float(all_hits) * 100.0)])
+
+  logger.table(table)
+  logger.info('')
+
+  table = [
+    ['Caller', 'Callee', 'Instructions', 'Percentage']
+  ]
+
+  for (caller, callee) in sorted(calls.keys(), key = lambda x: calls[x], reverse = True):
+    table.append([caller, callee, calls[(caller, callee)], '%.02f' % (float(calls[(caller, callee)]) / float(inclusive[caller]) * 100.0)])
+
+  logger.table(table)
+
+  if collapsed is not None:
+    with open(collapsed, 'w') as f:
+      for stack in sorted(stacks.keys()):
+        f.write('%s %d\n' % (stack, stacks[stack]))
+
+    logger.info('Collapsed stacks saved into %s', collapsed)
+
 def main():
   from . import add_common_options, parse_options
 
@@ -36,6 +174,7 @@ def main():
 
   parser.add_option('-i', dest = 'files_in', action = 'append', default = [], help = 'Input file')
   parser.add_option('-b', dest = 'binary', action = 'store', default = None, help = 'Profiled binary')
+  parser.add_option('--collapsed', dest = 'collapsed', action = 'store', default = None, metavar = 'FILE', help = 'Save call paths into FILE, in collapsed stacks format')
 
   options, logger = parse_options(parser)
 
@@ -47,22 +186,24 @@ def main():
     parser.print_help()
     sys.exit(1)
 
-  merged_data = read_profiling_data(logger, options.files_in)
-
   from ..mm.binary import File
   from ..util import SymbolTable
 
   binary = File.open(logger, options.binary, 'r')
-  binary.load()
-  binary.load_symbols()
 
   symbol_table = SymbolTable(binary)
 
+  if is_callgraph_profile(options.files_in[0]):
+    print_callgraph(logger, read_callgraph_data(logger, options.files_in), symbol_table, collapsed = options.collapsed)
+    return
+
+  merged_data = read_profiling_data(logger, options.files_in)
+
   all_hits = sum([record.count for record in itervalues(merged_data)])
 
   def print_points():
     from ..mm import UINT32_FMT
-    from ..cpu.instructions import DuckyInstructionSet
+    from ..cpu.instructions import get_instruction_set
 
     table = [
       ['Address', 'Symbol', 'Offset', 'Hits', 'Percentage', 'Inst']
@@ -83,10 +224,13 @@ def main():
         symbol_name = symbol
 
         symbol = symbol_table.get_symbol(symbol)
-        header, content = binary.get_section(symbol.section)
+        section = binary.get_section_by_index(symbol.section)
+
+        payload = section.payload
+        i = symbol.address + offset - section.header.base
+        raw_inst = payload[i] | (payload[i + 1] << 8) | (payload[i + 2] << 16) | (payload[i + 3] << 24)
 
-        inst_encoding, inst_cls, inst_opcode = DuckyInstructionSet.decode_instruction(logger, content[(symbol.address + offset - header.base) / 4].value)
-        inst_disassembly = DuckyInstructionSet.disassemble_instruction(logger, inst_encoding)
+        inst_disassembly = get_instruction_set(record.instruction_set_id).disassemble_instruction(logger, raw_inst)
 
       table.append([UINT32_FMT(binary_ip), symbol_name, UINT32_FMT(offset), record.count, '%.02f' % (float(record.count) / float(all_hits) * 100.0), inst_disassembly])
 
@@ -6,6 +6,7 @@ if not hasattr(urllib, 'parse'):
 
 from .. import patch  # noqa
 from ..machine import Machine
+from ..snapshot import flatten_snapshot
 from ..util import str2int, UINT32_FMT
 from ..streams import OutputStream, InputStream
 from ..interfaces import IReactorTask
@@ -16,6 +17,7 @@ import optparse
 import os
 import signal
 import sys
+import tempfile
 import threading
 
 from autobahn.twisted.websocket import WebSocketServerProtocol, WebSocketServerFactory
@@ -170,6 +172,69 @@ def print_machine_stats(logger, M):
     logger.info('Executed instructions: %i %f (%.4f/sec)', inst_executed, runtime, float(inst_executed) / runtime)
   logger.info('')
 
+def fork_workers(logger, M, count, run):
+  """
+  Clone booted machine into ``count`` child processes, and let each of them
+  run on its own. Output of children is collected, and printed once all of
+  them exit.
+
+  :param logging.Logger logger: ``Logger`` instance to use for logging.
+  :param ducky.machine.Machine M: booted machine.
+  :param int count: number of clones.
+  :param callable run: called in each child to run the machine, returns exit
+    code of the child.
+  :rtype: int
+  :returns: ``1`` if any of children failed, ``0`` otherwise.
+  """
+
+  outputs = []
+
+  for _ in range(0, count):
+    output = tempfile.TemporaryFile()
+
+    if M.fork() == 0:
+      exit_code = 1
+
+      try:
+        os.dup2(output.fileno(), sys.stdout.fileno())
+        os.dup2(output.fileno(), sys.stderr.fileno())
+
+        exit_code = run()
+
+      finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        os._exit(exit_code)
+
+    outputs.append(output)
+
+  exit_codes = M.wait_children()
+
+  table = [
+    ['Worker', 'PID', 'Exit code']
+  ]
+
+  stdout = sys.stdout.buffer if hasattr(sys.stdout, 'buffer') else sys.stdout
+
+  for i, ((pid, exit_code), output) in enumerate(zip(exit_codes, outputs)):
+    table.append([str(i), str(pid), str(exit_code)])
+
+    logger.info('')
+    logger.info('Output of worker #%i (PID %i):', i, pid)
+    sys.stdout.flush()
+
+    output.seek(0)
+    stdout.write(output.read())
+    stdout.flush()
+    output.close()
+
+  logger.info('')
+  logger.table(table)
+  logger.info('')
+
+  return 1 if any(exit_code != 0 for _, exit_code in exit_codes) else 0
+
 class DuckyProtocol(WebSocketServerProtocol):
   """
   Protocol handling communication between VM and remote terminal emulator.
@@ -376,12 +441,16 @@ def main():
   parser.add_option_group(opt_group)
   opt_group.add_option('--machine-config',  dest = 'machine_config',  action = 'store',      default = None,  help = 'Path to machine configuration file')
   opt_group.add_option('--machine-profile', dest = 'machine_profile', action = 'store_true', default = False, help = 'Enable profiling of running binaries')
+  opt_group.add_option('--machine-profile-frequency', dest = 'machine_profile_frequency', action = 'store', default = None, type = 'int', metavar = 'N', help = 'Sample running binaries every N instructions on average')
+  opt_group.add_option('--machine-profile-callgraph', dest = 'machine_profile_callgraph', action = 'store_true', default = False, help = 'Profile call graph of running binaries instead of sampling')
   opt_group.add_option('--set-option',      dest = 'set_options',     action = 'append',     default = [],    metavar = 'SECTION:OPTION=VALUE', help = 'Set option')
   opt_group.add_option('--add-option',      dest = 'add_options',     action = 'append',     default = [],    metavar = 'SECTION:OPTION=VALUE')
   opt_group.add_option('--enable-device',   dest = 'enable_devices',  action = 'append',     default = [],    metavar = 'DEVICE', help = 'Enable device')
   opt_group.add_option('--disable-device',  dest = 'disable_devices', action = 'append',     default = [],    metavar = 'DEVICE', help = 'Disable device')
   opt_group.add_option('--poke',            dest = 'poke',            action = 'append',     default = [],    metavar = 'ADDRESS:VALUE:<124>', help = 'Modify content of memory before running binaries')
   opt_group.add_option('--jit',             dest = 'jit',             action = 'store_true', default = False, help = 'Optimize instructions')
+  opt_group.add_option('--restore',         dest = 'restore',         action = 'store',      default = None,  metavar = 'SNAPSHOT', help = 'Restore machine from a snapshot, and continue its execution')
+  opt_group.add_option('--fork-workers',    dest = 'fork_workers',    action = 'store',      default = 0,     type = 'int', metavar = 'N', help = 'Clone booted machine into N worker processes, and run them in parallel')
 
   # Network options
   opt_group = optparse.OptionGroup(parser, 'Network options')
@@ -403,7 +472,7 @@ def main():
     parser.print_help()
     sys.exit(1)
 
-  if options.profile and options.profile_dir is None:
+  if (options.profile or options.machine_profile) and options.profile_dir is None:
     parser.print_help()
     sys.exit(1)
 
@@ -418,6 +487,9 @@ def main():
   if options.profile:
     STORE.enable_machine()
 
+  if options.machine_profile:
+    STORE.enable_cpu(frequency = options.machine_profile_frequency, callgraph = options.machine_profile_callgraph)
+
   main_thread_profiler = STORE.get_machine_profiler()
   main_thread_profiler.enable()
 
@@ -452,7 +524,7 @@ def main():
 
       elif sig == signal.SIGSEGV:
         M.tenh('VM snapshot requested')
-        M.reactor.add_call(M.snapshot('ducky-snapshot-user.bin'))
+        M.reactor.add_call(M.checkpoint, 'ducky-snapshot-user.bin')
 
     signal.signal(signal.SIGINT,  signal_handler)
     signal.signal(signal.SIGUSR1, signal_handler)
@@ -461,6 +533,11 @@ def main():
 
     M.boot()
 
+    if options.restore is not None:
+      logger.info('Restoring machine from %s', options.restore)
+
+      M.load_state(flatten_snapshot(logger, options.restore).get_child('machine'))
+
     for poke in options.poke:
       address, value, length = poke.split(':')
 
@@ -469,24 +546,33 @@ def main():
 
       M.poke(str2int(address), str2int(value), str2int(length))
 
-    try:
-      M.run()
-
-    except:
-      logger.exception('Unhandled exception')
-
+    def run_machine():
       try:
-        M.halt()
+        M.run()
 
       except:
-        logger.exception('Exception raised when handling an exception')
+        logger.exception('Unhandled exception')
+
+        try:
+          M.halt()
+
+        except:
+          logger.exception('Exception raised when handling an exception')
+
+      print_machine_stats(logger, M)
+      return 1 if M.exit_code != 0 else 0
 
-    print_machine_stats(logger, M)
-    exit_code = 1 if M.exit_code != 0 else 0
+    if options.fork_workers > 0:
+      exit_code = fork_workers(logger, M, options.fork_workers, run_machine)
+
+      M.halt()
+
+    else:
+      exit_code = run_machine()
 
   main_thread_profiler.disable()
 
-  if options.profile:
+  if options.profile or options.machine_profile:
     logger.info('Saving profiling data into %s' % options.profile_dir)
     STORE.save(logger, options.profile_dir)
 
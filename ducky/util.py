@@ -1,5 +1,7 @@
+import bisect
 import collections
 import functools
+import io
 import string
 
 from six import iteritems, integer_types, PY2
@@ -114,6 +116,23 @@ class BinaryFile(object):
 
     return klass(logger, stream)
 
+  @staticmethod
+  def do_open_buffer(logger, name, buff, klass = None):
+    """
+    Open file whose content is already in memory, e.g. a member of an archive.
+
+    :param str name: name of the file.
+    :param bytes buff: content of the file.
+    """
+
+    stream = io.BytesIO(buff)
+    stream.name = name
+    stream.mode = 'rb'
+
+    klass = klass or BinaryFile
+
+    return klass(logger, stream)
+
   @staticmethod
   def open(*args, **kwargs):
     return BinaryFile.do_open(*args, **kwargs)
@@ -180,6 +199,43 @@ class BinaryFile(object):
 
     self.write(st)
 
+  def read_array(self, st_class, count):
+    """
+    Read a continuous array of structures from current position in file,
+    using just a single read.
+
+    :param class st_class: ``ctype``-based structure.
+    :param int count: number of structures.
+    :returns: instances of ``st_class``, sharing one buffer.
+    :rtype: ``list``
+    """
+
+    pos = self.tell()
+
+    array = (st_class * count)()
+    self.readinto(array)
+
+    self.DEBUG('read_array: %s: %s x %s bytes', pos, count, sizeof(st_class))
+
+    return list(array)
+
+  def write_array(self, entries):
+    """
+    Write list of structures of the same class into file at the current
+    position, using just a single write.
+
+    :param list entries: ``ctype``-based structures.
+    """
+
+    if not entries:
+      return
+
+    st_class = type(entries[0])
+
+    self.DEBUG('write_array: %s: %s x %s bytes', self.tell(), len(entries), sizeof(st_class))
+
+    self.write((st_class * len(entries))(*entries))
+
 class StringTable(object):
   """
   Simple string table, used by many classes operating with files (core, binaries, ...).
@@ -264,29 +320,114 @@ class StringTable(object):
     return self._offset_to_string[offset]
 
 class SymbolTable(dict):
-  def __init__(self, binary):
+  """
+  Symbols of a binary file, indexed by their names and by their addresses.
+
+  Table is built when created - symbols are sorted by their addresses, and
+  each address lookup is then a binary search. When a symbol has its size
+  set, addresses past its end are not considered to be part of it.
+
+  :param ducky.mm.binary.File binary: file to read symbols from.
+  :param callable section_filter: if set, only symbols whose section passes
+    the filter - ``section_filter(section)`` returns ``True`` - are
+    included. Useful for object files, where all sections start at the same
+    address.
+  """
+
+  def __init__(self, binary, section_filter = None):
+    super(SymbolTable, self).__init__()
+
+    from .mm.binary import SectionTypes
+
     self.binary = binary
 
+    symbols = []
+
+    for section in binary.sections:
+      if section.header.type != SectionTypes.SYMBOLS:
+        continue
+
+      for entry in section.payload:
+        if section_filter is not None and section_filter(binary.get_section_by_index(entry.section)) is not True:
+          continue
+
+        name = binary.string_table.get_string(entry.name)
+
+        dict.__setitem__(self, name, entry)
+        symbols.append((entry.address, name, entry))
+
+    symbols.sort(key = lambda x: (x[0], x[1]))
+
+    self._addresses = [address for address, _, _ in symbols]
+    self._symbols = [(name, entry) for _, name, entry in symbols]
+
   def __getitem__(self, address):
-    last_symbol = None
-    last_symbol_offset = 0xFFFE
+    """
+    Find symbol covering an address.
+
+    :param u32_t address: address to look up.
+    :returns: ``(name, offset)`` pair, ``offset`` being the distance between
+      ``address`` and the beginning of the symbol, or ``(None, 0)`` when
+      there is no such symbol.
+    """
+
+    i = bisect.bisect_right(self._addresses, address)
 
-    for symbol_name, symbol in iteritems(self.binary.symbols):
-      if symbol.address > address:
+    if i == 0:
+      return (None, 0)
+
+    name, entry = self._symbols[i - 1]
+    offset = address - entry.address
+
+    if entry.size != 0 and offset >= entry.size:
+      return (None, 0)
+
+    return (name, offset)
+
+  def walk(self, start, end, step = 4):
+    """
+    Find symbols covering consecutive addresses. Result is the same as if each
+    address was looked up, but the sorted list of symbols is searched just
+    once, and then followed as addresses grow.
+
+    :param u32_t start: first address.
+    :param u32_t end: end of the range, not included.
+    :param int step: distance between addresses.
+    :returns: iterator of ``(name, offset)`` pairs, one for each address.
+    """
+
+    addresses, symbols = self._addresses, self._symbols
+    count = len(addresses)
+
+    i = bisect.bisect_right(addresses, start)
+
+    for address in range(start, end, step):
+      while i < count and addresses[i] <= address:
+        i += 1
+
+      if i == 0:
+        yield (None, 0)
         continue
 
-      if symbol.address == address:
-        return (symbol_name, 0)
+      name, entry = symbols[i - 1]
+      offset = address - entry.address
 
-      offset = abs(address - symbol.address)
-      if offset < last_symbol_offset:
-        last_symbol = symbol_name
-        last_symbol_offset = offset
+      if entry.size != 0 and offset >= entry.size:
+        yield (None, 0)
 
-    return (last_symbol, last_symbol_offset)
+      else:
+        yield (name, offset)
 
   def get_symbol(self, name):
-    return self.binary.symbols[name]
+    """
+    Get symbol by its name.
+
+    :param str name: name of symbol.
+    :rtype: ducky.mm.binary.SymbolEntry
+    :raises KeyError: when there is no such symbol.
+    """
+
+    return dict.__getitem__(self, name)
 
 
 class Flags(object):
@@ -2,6 +2,8 @@
 #include <arch/tty.h>
 
 static char *tty_mmio_address = (char *)(CONFIG_TTY_MMIO_BASE + TTY_MMIO_DATA);
+static u32_t *tty_mmio_buffer_address = (u32_t *)(CONFIG_TTY_MMIO_BASE + TTY_MMIO_BUFFER_ADDRESS);
+static u32_t *tty_mmio_buffer_length = (u32_t *)(CONFIG_TTY_MMIO_BASE + TTY_MMIO_BUFFER_LENGTH);
 
 
 //-----------------------------------------------------------------------------
@@ -15,8 +17,8 @@ void putc(char c)
 
 void puts(char *s, u32_t len)
 {
-  while(len--)
-    *tty_mmio_address = *s++;
+  *tty_mmio_buffer_address = (u32_t)s;
+  *tty_mmio_buffer_length = len;
 }
 
 void putcs(char *s)
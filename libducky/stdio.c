@@ -11,6 +11,8 @@
 //-----------------------------------------------------------------------------
 
 static volatile u8_t *tty_mmio_address = (u8_t *)(TTY_MMIO_ADDRESS + TTY_MMIO_DATA);
+static volatile u32_t *tty_mmio_buffer_address = (u32_t *)(TTY_MMIO_ADDRESS + TTY_MMIO_BUFFER_ADDRESS);
+static volatile u32_t *tty_mmio_buffer_length = (u32_t *)(TTY_MMIO_ADDRESS + TTY_MMIO_BUFFER_LENGTH);
 
 
 /*
@@ -31,8 +33,6 @@ void putc(int c)
  */
 void puts(const char *s)
 {
-  char c;
-
-  while ((c = *s++) != '\0')
-    *tty_mmio_address = c;
+  *tty_mmio_buffer_address = (u32_t)s;
+  *tty_mmio_buffer_length = strlen(s);
 }
@@ -118,7 +118,7 @@ def assert_raises(callable, exc_class, message = ''):
   else:
     assert False, message
 
-def assert_registers(state, **regs):
+def assert_registers(core, **regs):
   for reg in ducky.cpu.registers.REGISTER_NAMES:
     if reg in ('flags', 'ip', 'cnt'):
       continue
@@ -126,12 +126,12 @@ def assert_registers(state, **regs):
     val = regs.get(reg, 0)
 
     reg_index = ducky.cpu.registers.REGISTER_NAMES.index(reg)
-    reg_value = state.registers[reg_index]
+    reg_value = core.registers[reg_index]
 
     assert reg_value == val, F('Register {reg} expected to have value {expected} ({expected:L}), {actual} ({actual:L}) found instead', reg = reg, expected = val, actual = reg_value)
 
-def assert_flags(state, **flags):
-  core_flags = ducky.cpu.CoreFlags.from_int(state.flags)
+def assert_flags(core, **flags):
+  core_flags = core.flags
 
   flag_labels = {
     'privileged': 'privileged',
@@ -149,29 +149,19 @@ def assert_flags(state, **flags):
 
     assert expected == actual, F('Flag {flag} expected to be {expected}, {actual} found instead', flag = core_flag, expected = expected, actual = actual)
 
-def assert_mm(state, cells):
+def assert_mm(memory, cells):
   for addr, expected_value in cells:
-    addr = addr
-    expected_value = expected_value
     page_index = ducky.mm.addr_to_page(addr)
     page_offset = ducky.mm.addr_to_offset(addr)
 
-    for page in state.get_page_states():
-      if page.index != page_index:
-        continue
+    assert page_index in memory.pages, 'Page {} (address {}) not found in memory'.format(page_index, ducky.mm.ADDR_FMT(addr))
 
-      real_value = page.content[page_offset] | (page.content[page_offset + 1] << 8) | (page.content[page_offset + 2] << 16) | (page.content[page_offset + 3] << 24)
-      assert real_value == expected_value, 'Value at {} (page {}, offset {}) should be {}, {} found instead'.format(ducky.mm.ADDR_FMT(addr), page_index, ducky.mm.UINT8_FMT(page_offset), ducky.mm.UINT32_FMT(expected_value), ducky.mm.UINT32_FMT(real_value))
-      break
-
-    else:
-      assert False, 'Page {} (address {}) not found in memory'.format(page_index, ducky.mm.ADDR_FMT(addr))
-
-def assert_mm_pages(state, *pages):
-  pg_indices = [pg.index for pg in state.get_page_states()]
+    real_value = memory.read_u32(addr)
+    assert real_value == expected_value, 'Value at {} (page {}, offset {}) should be {}, {} found instead'.format(ducky.mm.ADDR_FMT(addr), page_index, ducky.mm.UINT8_FMT(page_offset), ducky.mm.UINT32_FMT(expected_value), ducky.mm.UINT32_FMT(real_value))
 
+def assert_mm_pages(memory, *pages):
   for pg_id in pages:
-    assert pg_id in pg_indices, 'Page {} not found in VM state'.format(pg_id)
+    assert pg_id in memory.pages, 'Page {} not found in memory'.format(pg_id)
 
 def assert_file_content(filename, cells):
   with open(filename, 'rb') as f:
@@ -184,10 +174,12 @@ def common_asserts(M, S, mm_asserts = None, file_asserts = None, **kwargs):
   mm_asserts = mm_asserts or {}
   file_asserts = file_asserts or []
 
-  assert_registers(S.get_child('machine').get_child('cpu0').get_child('core0'), **kwargs)
-  assert_flags(S.get_child('machine').get_child('cpu0').get_child('core0'), **kwargs)
+  core = M.cpus[0].cores[0]
+
+  assert_registers(core, **kwargs)
+  assert_flags(core, **kwargs)
 
-  assert_mm(S.get_child('machine').get_child('memory'), mm_asserts)
+  assert_mm(M.memory, mm_asserts)
 
   for filename, cells in file_asserts:
     assert_file_content(filename, cells)
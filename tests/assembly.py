@@ -1,9 +1,15 @@
+import os
 import string
+import tempfile
+
+from six import iteritems
 
 from ducky.asm import AssemblerProcess
 from ducky.asm.lexer import reserved_map
+from ducky.asm.preprocessor import Preprocessor
+from ducky.errors import PreprocessorError
 
-from . import LOGGER
+from . import tmp_dir, LOGGER
 
 from hypothesis import given, assume
 from hypothesis.strategies import integers, text
@@ -116,3 +122,78 @@ def test_short_id(name):
 #
 # def test_short_var():
 #  translate_buffer('  .set %foo, 1\n  .short %foo  ; foo ')
+
+def preprocess_buffer(code, headers = None, defines = None):
+  directory = tempfile.mkdtemp(dir = tmp_dir())
+
+  for name, content in iteritems(headers or {}):
+    with open(os.path.join(directory, name), 'w') as f:
+      f.write(content)
+
+  filepath = os.path.join(directory, 'test.s')
+
+  with open(filepath, 'w') as f:
+    f.write(code)
+
+  return filepath, Preprocessor(includes = [directory], defines = defines, logger = LOGGER).preprocess(filepath)
+
+def test_preprocess():
+  filepath, preprocessed = preprocess_buffer('''#include "defs.h"
+/* two
+   lines */
+#ifdef FOO
+  li r0, FOO
+#else
+  li r0, 0
+#endif
+#if BAR(2) == 4 && !defined(BAZ)
+  li r1, CAT(0x, 10)
+#endif
+  .ascii STR(a   "b")
+  li r2, \\
+    CAT(1, 2)
+''', headers = {'defs.h': '#define BAR(x) ((x) * 2) // comment\n#define CAT(a, b) a ## b\n#define STR(s) #s\n'}, defines = ['FOO=0x79'])
+
+  header = os.path.join(os.path.dirname(filepath), 'defs.h')
+
+  assert preprocessed == '\n'.join([
+    '# 1 "%s"' % filepath,
+    '# 1 "%s"' % header,
+    '', '', '',
+    '# 2 "%s"' % filepath,
+    ' ', '', '',
+    '  li r0, 0x79',
+    '', '', '', '',
+    '  li r1, 0x10',
+    '',
+    '  .ascii "a \\"b\\""',
+    '  li r2,     12',
+    '',
+    ''
+  ])
+
+  process = AssemblerProcess(filepath, logger = LOGGER)
+  process.preprocessed = preprocessed
+  process.parse()
+
+  assert [(node.location.filename, node.location.lineno) for node in process.ast_root.children] == [(filepath, 5), (filepath, 10), (filepath, 12), (filepath, 13)]
+
+def test_preprocess_nested_macros():
+  _, preprocessed = preprocess_buffer('''#define F(x) G(x)
+#define G(x) x + H
+#define H F
+  F(1)(2)
+''')
+
+  assert preprocessed.split('\n')[4] == '  1 + F(2)'
+
+def test_preprocess_error():
+  try:
+    preprocess_buffer('#if 1\n# error "Bad config"\n#endif\n')
+
+  except PreprocessorError as e:
+    assert e.location.lineno == 2
+    assert e.info == '#error "Bad config"'
+
+  else:
+    assert False, 'PreprocessorError not raised'
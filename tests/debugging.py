@@ -0,0 +1,135 @@
+from ducky.cpu.registers import Registers
+from ducky.debugging import BreakPoint, MemoryWatchPoint, TraceAction, compile_condition
+from ducky.errors import InvalidResourceError
+
+from . import common_run_machine, mock
+
+def common_case():
+  M = common_run_machine(post_boot = [lambda _M: False])
+
+  core = M.cpus[0].cores[0]
+  core.init_debug_set()
+
+  return M, core
+
+def test_breakpoint():
+  M, core = common_case()
+
+  point = BreakPoint(core.debug, 0x1000)
+  action = mock.MagicMock()
+  point.actions.append(action)
+
+  core.debug.add_point(point, 'pre-step')
+
+  core.registers[Registers.IP] = 0x0FFC
+  assert core.debug.pre_step() is False
+  assert action.act.call_count == 0
+
+  core.registers[Registers.IP] = 0x1000
+  assert core.debug.pre_step() is True
+  assert action.act.call_count == 1
+
+  core.debug.post_step()
+  core.debug.remove_point(point)
+
+  assert core.debug.pre_step() is False
+  assert action.act.call_count == 1
+
+def test_memory_watchpoint():
+  M, core = common_case()
+
+  M.memory.write_u32(0x1000, 0xDEADBEEF)
+  M.memory.write_u32(0x2000, 0x12345678)
+
+  point = MemoryWatchPoint(core.debug, 0x1000, True)
+  action = mock.MagicMock()
+  point.actions.append(action)
+
+  core.debug.add_point(point, 'pre-memory')
+
+  assert core.debug.watched_pages == set([0x10])
+
+  with mock.patch.object(core.debug, 'pre_memory', wraps = core.debug.pre_memory) as pre_memory:
+    assert core.MEM_IN32(0x2000) == 0x12345678
+    assert pre_memory.call_count == 0
+
+    assert core.MEM_IN32(0x1000) == 0xDEADBEEF
+    assert pre_memory.call_count == 1
+    assert action.act.call_count == 1
+
+  core.debug.remove_point(point)
+
+  assert core.debug.watched_pages == set()
+  assert core.MEM_IN32 == core.mmu._nopt_read_u32
+
+def test_condition():
+  M, core = common_case()
+
+  M.memory.write_u32(0x1000, 0xDEADBEEF)
+
+  condition = compile_condition('r1 == 0x10 and mem32(r2) == 0xDEADBEEF and not zero')
+
+  core.registers[Registers.R01] = 0x10
+  core.registers[Registers.R02] = 0x1000
+  core.arith_zero = False
+
+  assert condition(core)
+
+  core.arith_zero = True
+
+  assert not condition(core)
+
+  for expression in ('__import__("os")', 'r1.real', 'foo == 1', '"foo"'):
+    try:
+      compile_condition(expression)
+
+    except InvalidResourceError:
+      pass
+
+    else:
+      assert False, 'Condition accepted: %s' % expression
+
+def test_conditional_breakpoint():
+  M, core = common_case()
+
+  point = BreakPoint(core.debug, 0x1000, condition = 'r0 > 2')
+  action = mock.MagicMock()
+  point.actions.append(action)
+
+  core.debug.add_point(point, 'pre-step')
+
+  core.registers[Registers.IP] = 0x1000
+
+  for i in range(0, 5):
+    core.registers[Registers.R00] = i
+    core.debug.pre_step()
+    core.debug.post_step()
+
+  assert action.act.call_count == 2
+
+def test_tracepoint():
+  M, core = common_case()
+
+  M.memory.write_u32(0x1000, 0xDEADBEEF)
+
+  point = BreakPoint(core.debug, 0x2000)
+  action = TraceAction(core.LOGGER, registers = ['r0'], addresses = [0x1000], size = 2)
+  point.actions.append(action)
+
+  core.debug.add_point(point, 'pre-step')
+
+  core.registers[Registers.IP] = 0x2000
+
+  for i in range(0, 3):
+    core.registers[Registers.R00] = i
+    core.registers[Registers.CNT] = i + 10
+    core.debug.pre_step()
+    core.debug.post_step()
+
+  assert action.count == 3
+  assert action.get_records() == [[0x2000, 11, 1, 0xDEADBEEF], [0x2000, 12, 2, 0xDEADBEEF]]
+  assert core.debug.get_trace_actions() == [action]
+
+  action.clear()
+
+  assert action.get_records() == []
@@ -10,7 +10,7 @@ from ducky.util import UINT8_FMT
 
 from .. import get_tempfile, common_run_machine, mock, LOGGER
 from hypothesis import given
-from hypothesis.strategies import integers
+from hypothesis.strategies import integers, binary
 
 def common_case(**kwargs):
   machine_config = ducky.config.MachineConfig()
@@ -68,3 +68,122 @@ def test_read_unknown_port(port):
   else:
     assert v == 0x00
     backend._mmio_page.WARN.assert_called_with('%s.read_u8: attempt to read raw offset: offset=%s', backend._mmio_page.__class__.__name__, UINT8_FMT(port))
+
+def common_ring_case(size, address = 0x1000):
+  frontend, backend = common_case()
+  M = frontend.machine
+
+  M.trigger_irq = mock.MagicMock()
+  backend.boot()
+
+  backend._mmio_page.write_u32(ducky.devices.keyboard.KeyboardPorts.RING_ADDRESS, address)
+  backend._mmio_page.write_u32(ducky.devices.keyboard.KeyboardPorts.RING_SIZE, size)
+
+  return frontend, backend
+
+def read_ring(M, address, size):
+  producer = M.memory.read_u32(address)
+  consumer = M.memory.read_u32(address + 4)
+
+  data = bytearray([M.memory.read_u8(address + 8 + (i & (size - 1))) for i in range(consumer, producer)])
+
+  M.memory.write_u32(address + 4, producer)
+
+  return data
+
+@given(data = binary(min_size = 1, max_size = 64))
+def test_ring(data):
+  LOGGER.debug('----- ----- ----- ----- ----- ----- -----')
+  LOGGER.debug('TEST: data=%r', data)
+
+  frontend, backend = common_ring_case(16)
+  M = frontend.machine
+
+  backend._comm_queue.write_in(bytearray(data))
+  backend.input_available()
+
+  M.trigger_irq.assert_called_once_with(backend)
+
+  received = bytearray()
+
+  while len(received) < len(data):
+    received += read_ring(M, 0x1000, 16)
+
+    assert backend._mmio_page.read_u8(ducky.devices.keyboard.KeyboardPorts.DATA) == 0xFF
+
+  assert received == bytearray(data)
+  assert M.trigger_irq.call_count == 1
+
+def test_ring_irq_on_empty_only():
+  frontend, backend = common_ring_case(16)
+  M = frontend.machine
+
+  backend._comm_queue.write_in(bytearray(b'foo'))
+  backend.input_available()
+
+  backend._comm_queue.write_in(bytearray(b'bar'))
+  backend.input_available()
+
+  assert M.trigger_irq.call_count == 1
+  assert read_ring(M, 0x1000, 16) == bytearray(b'foobar')
+
+  backend._comm_queue.write_in(bytearray(b'baz'))
+  backend.input_available()
+
+  assert M.trigger_irq.call_count == 2
+  assert read_ring(M, 0x1000, 16) == bytearray(b'baz')
+
+def test_ring_halt():
+  frontend, backend = common_ring_case(16)
+  M = frontend.machine
+
+  M.halt = mock.MagicMock()
+
+  backend._comm_queue.write_in(bytearray(b'foo'))
+  backend._comm_queue.write_in(ducky.devices.keyboard.ControlMessages.HALT)
+  backend.input_available()
+
+  backend._mmio_page.read_u8(ducky.devices.keyboard.KeyboardPorts.DATA)
+  M.halt.assert_not_called()
+
+  assert read_ring(M, 0x1000, 16) == bytearray(b'foo')
+
+  backend._mmio_page.read_u8(ducky.devices.keyboard.KeyboardPorts.DATA)
+  M.halt.assert_called_once_with()
+
+def test_ring_invalid_size():
+  frontend, backend = common_case()
+  backend.boot()
+
+  backend._mmio_page.write_u32(ducky.devices.keyboard.KeyboardPorts.RING_SIZE, 15)
+
+  assert backend.ring_size == 0
+
+def test_ring_corrupted():
+  frontend, backend = common_ring_case(16)
+  M = frontend.machine
+
+  M.WARN = mock.MagicMock()
+
+  # consumer ahead of producer - ring claims to hold more than its size
+  M.memory.write_u32(0x1004, 0x20)
+
+  backend._comm_queue.write_in(bytearray(b'foo'))
+  backend.input_available()
+
+  M.trigger_irq.assert_not_called()
+  M.WARN.assert_called_with('%s._refill_ring: corrupted ring: producer=%s, consumer=%s, size=%s', backend.__class__.__name__, 0, 0x20, 16)
+
+  assert M.memory.read_u32(0x1000) == 0
+  assert all(M.memory.read_u8(0x1008 + i) == 0 for i in range(16))
+
+  # once the ring is fixed, pending input is delivered
+  M.memory.write_u32(0x1004, 0)
+
+  backend._mmio_page.read_u8(ducky.devices.keyboard.KeyboardPorts.DATA)
+  assert read_ring(M, 0x1000, 16) == bytearray(b'foo')
+
+def test_ports_range():
+  ports = ducky.devices.keyboard.KeyboardPorts
+
+  assert ports.LAST == ports.RING_SIZE + 3
@@ -115,12 +115,12 @@ def test_frequency_change(freq):
   rtc = common_case()
   rtc.boot()
 
-  tick = float(1) / float(ducky.devices.rtc.DEFAULT_FREQ)
+  tick = 1000000000 // ducky.devices.rtc.DEFAULT_FREQ
   assert rtc.frequency == ducky.devices.rtc.DEFAULT_FREQ, 'Frequency mismatch: %s expected, %s found' % (freq, rtc.frequency)
   assert rtc.timer_task.tick == tick, 'Tick mismatch: %s expected, %s found' % (tick, rtc.timer_task.tick)
 
   rtc._mmio_page.write_u8(ducky.devices.rtc.RTCPorts.FREQUENCY, freq)
 
-  tick = float(1) / float(freq if freq else ducky.devices.rtc.DEFAULT_FREQ)
+  tick = 1000000000 // (freq if freq else ducky.devices.rtc.DEFAULT_FREQ)
   assert rtc.frequency == (freq if freq else ducky.devices.rtc.DEFAULT_FREQ), 'Frequency mismatch: %s expected, %s found' % (freq, rtc.frequency)
   assert rtc.timer_task.tick == tick, 'Tick mismatch: %s expected, %s found' % (tick, rtc.timer_task.tick)
@@ -0,0 +1,158 @@
+import ducky.config
+import ducky.devices.svga
+
+from .. import common_run_machine, get_tempfile, LOGGER, mock
+
+def common_case(boot_mode = 't, 80, 25, 2', **kwargs):
+  f = get_tempfile()
+  f.close()
+
+  machine_config = ducky.config.MachineConfig()
+  gpu_section = machine_config.add_device('gpu', 'ducky.devices.svga.SimpleVGA', **{'memory-address': 0xA000, 'boot-mode': boot_mode})
+  display_section = machine_config.add_device('display', 'ducky.devices.svga.Display', gpu = gpu_section, stream_out = f.name, **kwargs)
+
+  M = common_run_machine(machine_config = machine_config, post_setup = [lambda _M: False])
+
+  gpu = M.get_device_by_name(gpu_section, klass = 'gpu')
+  display = M.get_device_by_name(display_section, klass = 'display')
+
+  gpu.boot()
+  display.refresh_task.write = mock.MagicMock()
+
+  return M, gpu, display
+
+def test_sanity():
+  LOGGER.debug('----- ----- ----- ----- ----- ----- -----')
+  LOGGER.debug('TEST:')
+
+  common_case()
+
+def test_full_frame():
+  M, gpu, display = common_case()
+  task = display.refresh_task
+
+  M.memory.write_u8(0xA000, ord('A'))
+  M.memory.write_u8(0xA001, 0x8F)
+
+  task.on_tick(None)
+
+  assert task.write.call_count == 1
+
+  frame = bytes(task.write.call_args[0][0])
+  lines = frame.split(b'\n')
+
+  assert len(lines) == 25 + 3
+  assert lines[0] == b'-' * 80
+  assert lines[1].startswith(b'\033[5;97;40mA\033[0m')
+  assert lines[26] == b'-' * 80
+
+def test_damage_tracking():
+  M, gpu, display = common_case()
+  task = display.refresh_task
+
+  task.on_tick(None)
+  task.write.reset_mock()
+
+  task.on_tick(None)
+  task.write.assert_not_called()
+
+  M.memory.write_u8(0xA000 + 160 * 3 + 2, ord('B'))
+  M.memory.write_u8(0xA000 + 160 * 3 + 3, 0x0F)
+
+  task.on_tick(None)
+
+  assert task.write.call_count == 1
+
+  frame = bytes(task.write.call_args[0][0])
+
+  # move up to row #3, redraw it, and move back below the frame
+  assert frame.startswith(b'\033[23F')
+  assert frame.endswith(b'\n\033[22E')
+  assert frame.count(b'\n') == 1
+  assert b'\033[0;97;40mB\033[0m' in frame
+
+def test_mode_change_redraw():
+  M, gpu, display = common_case()
+  task = display.refresh_task
+
+  task.on_tick(None)
+  task.write.reset_mock()
+
+  gpu.set_mode(ducky.devices.svga.Mode('t', 80, 25, 1))
+  task.on_tick(None)
+
+  frame = bytes(task.write.call_args[0][0])
+
+  assert frame.startswith(b'\033[27F')
+  assert frame.count(b'\n') == 25 + 2
+
+def test_mode_compare():
+  mode = ducky.devices.svga.Mode('t', 80, 25, 2)
+
+  assert mode == ducky.devices.svga.Mode('t', 80, 25, 2)
+  assert not (mode != ducky.devices.svga.Mode('t', 80, 25, 2))
+  assert mode != ducky.devices.svga.Mode('t', 80, 25, 1)
+
+def test_graphic_ppm():
+  f = get_tempfile()
+  f.close()
+
+  M, gpu, display = common_case(boot_mode = 'g, 320, 200, 1', frames_out = f.name)
+  task = display.refresh_task
+
+  M.memory.write_u8(0xA000, 0x80)
+
+  task.on_tick(None)
+  task.on_tick(None)
+
+  # the last pixel of the second line
+  M.memory.write_u8(0xA000 + 40 + 39, 0x01)
+
+  task.on_tick(None)
+
+  display.frames_out.close()
+
+  with open(f.name, 'rb') as f_in:
+    data = f_in.read()
+
+  header = b'P6\n320 200\n255\n'
+  frame_size = len(header) + 320 * 200 * 3
+
+  assert len(data) == 2 * frame_size
+
+  first, second = data[0:frame_size], data[frame_size:]
+
+  assert first.startswith(header)
+  assert bytearray(first[len(header):len(header) + 6]) == bytearray([0xFF, 0xFF, 0xFF, 0x00, 0x00, 0x00])
+
+  offset = len(header) + (320 + 319) * 3
+  assert bytearray(second[offset - 3:offset + 3]) == bytearray([0x00, 0x00, 0x00, 0xFF, 0xFF, 0xFF])
+
+def test_graphic_y4m():
+  f = get_tempfile()
+  f.close()
+
+  M, gpu, display = common_case(boot_mode = 'g, 320, 200, 1', frames_out = f.name, frames_format = 'y4m')
+  task = display.refresh_task
+
+  task.on_tick(None)
+
+  M.memory.write_u8(0xA000, 0xFF)
+
+  task.on_tick(None)
+
+  display.frames_out.close()
+
+  with open(f.name, 'rb') as f_in:
+    data = f_in.read()
+
+  header = b'YUV4MPEG2 W320 H200 F5:1 Ip A1:1 C444\n'
+  frame_size = len(b'FRAME\n') + 320 * 200 * 3
+
+  assert data.startswith(header)
+  assert len(data) == len(header) + 2 * frame_size
+
+  second = data[len(header) + frame_size:]
+
+  assert second.startswith(b'FRAME\n')
+  assert bytearray(second[6:15]) == bytearray([0xFF] * 8 + [0x00])
@@ -0,0 +1,240 @@
+from six import iteritems
+
+import ducky.config
+import ducky.devices.timer
+import ducky.errors
+import ducky.machine
+
+from ducky.cpu.registers import Registers
+from ducky.devices.timer import TimerPorts, ComparatorPorts, TIMER_ENABLED, TIMER_PERIODIC, COMPARATOR_PORTS_SIZE
+from ducky.util import UINT8_FMT
+
+from .. import common_run_machine, LOGGER, mock
+
+from hypothesis import given
+from hypothesis.strategies import integers
+
+def common_case(**kwargs):
+  machine_config = ducky.config.MachineConfig()
+  section = machine_config.add_device('timer', 'ducky.devices.timer.Timer')
+
+  for name, value in iteritems(kwargs):
+    machine_config.set(section, name, value)
+
+  M = common_run_machine(machine_config = machine_config, post_setup = [lambda _M: False])
+
+  timer = M.get_device_by_name(section, klass = 'timer')
+
+  M.clock = mock.MagicMock()
+  M.clock.now.return_value = 0
+  M.trigger_irq = mock.MagicMock()
+
+  timer.boot()
+
+  return M, timer
+
+def comparator_port(index, port):
+  return TimerPorts.FIRST_COMPARATOR + index * COMPARATOR_PORTS_SIZE + port
+
+def arm(timer, index, interval, flags):
+  page = timer._mmio_page
+
+  page.write_u32(comparator_port(index, ComparatorPorts.INTERVAL_LO), interval & 0xFFFFFFFF)
+  page.write_u32(comparator_port(index, ComparatorPorts.INTERVAL_HI), interval >> 32)
+  page.write_u32(comparator_port(index, ComparatorPorts.CONTROL), flags)
+
+def test_sanity():
+  LOGGER.debug('----- ----- ----- ----- ----- ----- -----')
+  LOGGER.debug('TEST:')
+
+  common_case()
+
+@given(comparators = integers(min_value = 9))
+def test_too_many_comparators(comparators):
+  try:
+    common_case(comparators = comparators)
+
+  except ducky.errors.InvalidResourceError:
+    pass
+
+  else:
+    assert False, 'InvalidResourceError expected, none raised'
+
+@given(stamp = integers(min_value = 0, max_value = 0xFFFFFFFFFFFFFFFF))
+def test_counter(stamp):
+  LOGGER.debug('----- ----- ----- ----- ----- ----- -----')
+  LOGGER.debug('TEST: stamp=%s', stamp)
+
+  M, timer = common_case()
+
+  M.clock.now.return_value = stamp
+
+  lo = timer._mmio_page.read_u32(TimerPorts.COUNTER_LO)
+
+  M.clock.now.return_value = stamp + 0x100000000
+
+  hi = timer._mmio_page.read_u32(TimerPorts.COUNTER_HI)
+
+  assert (hi << 32) | lo == stamp
+
+def test_one_shot():
+  M, timer = common_case()
+  comparator = timer.comparators[1]
+
+  arm(timer, 1, 1000, TIMER_ENABLED)
+
+  assert timer.deadline == 1000
+  assert timer.timer_task in M.reactor.runnable_tasks
+
+  M.clock.now.return_value = 999
+  timer.timer_task.run()
+  M.trigger_irq.assert_not_called()
+
+  M.clock.now.return_value = 1500
+  timer.timer_task.run()
+  M.trigger_irq.assert_called_once_with(comparator)
+
+  assert comparator.irq == ducky.devices.timer.DEFAULT_IRQ + 1
+  assert timer._mmio_page.read_u32(comparator_port(1, ComparatorPorts.CONTROL)) == 0
+  assert timer.deadline is None
+  assert timer.timer_task not in M.reactor.runnable_tasks
+
+def test_periodic():
+  M, timer = common_case()
+  comparator = timer.comparators[0]
+
+  arm(timer, 0, 0x100000000, TIMER_ENABLED | TIMER_PERIODIC)
+
+  M.clock.now.return_value = 0x100000000
+  timer.timer_task.run()
+
+  assert M.trigger_irq.call_count == 1
+  assert comparator.deadline == 0x200000000
+
+  # missed periods are skipped
+  M.clock.now.return_value = 0x480000000
+  timer.timer_task.run()
+
+  assert M.trigger_irq.call_count == 2
+  assert comparator.deadline == 0x500000000
+
+  timer._mmio_page.write_u32(comparator_port(0, ComparatorPorts.CONTROL), 0)
+
+  assert timer.deadline is None
+
+def test_nearest_deadline():
+  M, timer = common_case()
+
+  arm(timer, 0, 3000, TIMER_ENABLED)
+  arm(timer, 2, 2000, TIMER_ENABLED)
+
+  assert timer.deadline == 2000
+
+  M.clock.now.return_value = 2000
+  timer.timer_task.run()
+
+  M.trigger_irq.assert_called_once_with(timer.comparators[2])
+  assert timer.deadline == 3000
+
+@given(port = integers(min_value = TimerPorts.FIRST_COMPARATOR + 4 * COMPARATOR_PORTS_SIZE, max_value = 0xFF))
+def test_read_unknown_port(port):
+  LOGGER.debug('----- ----- ----- ----- ----- ----- -----')
+  LOGGER.debug('TEST: port=%s', UINT8_FMT(port))
+
+  M, timer = common_case()
+
+  timer._mmio_page.WARN = mock.MagicMock()
+
+  assert timer._mmio_page.read_u32(port) == 0x00000000
+  timer._mmio_page.WARN.assert_called_with('%s.read_u32: attempt to read unhandled MMIO offset: offset=%s', timer._mmio_page.__class__.__name__, UINT8_FMT(port))
+
+def common_virtual_case():
+  machine_config = ducky.config.MachineConfig()
+  machine_config.add_section('machine')
+  machine_config.set('machine', 'clock', 'virtual')
+  machine_config.set('machine', 'instruction-time', 100)
+
+  section = machine_config.add_device('timer', 'ducky.devices.timer.Timer')
+
+  M = common_run_machine(machine_config = machine_config, post_setup = [lambda _M: False])
+
+  timer = M.get_device_by_name(section, klass = 'timer')
+
+  M.living_cores = M.cores
+  M.trigger_irq = mock.MagicMock()
+
+  M.clock.boot()
+  timer.boot()
+
+  return M, timer
+
+def test_virtual_clock():
+  M, timer = common_virtual_case()
+  core = M.cores[0]
+
+  assert isinstance(M.clock, ducky.machine.VirtualClock)
+  assert M.clock.now() == 0
+
+  core.registers[Registers.CNT] = 5
+  assert M.clock.now() == 500
+
+  M.clock.skip_to(200)
+  assert M.clock.now() == 500
+
+  M.clock.skip_to(1000)
+  assert M.clock.now() == 1000
+
+def test_fast_forward():
+  M, timer = common_virtual_case()
+  core = M.cores[0]
+  task = M.clock.fast_forward_task
+
+  arm(timer, 0, 50000, TIMER_ENABLED)
+
+  # running core - no skipping
+  core.idle = False
+  task.run()
+  assert M.clock.now() == 0
+
+  core.idle = True
+  task.run()
+  assert M.clock.now() == 50000
+
+  timer.timer_task.run()
+  M.trigger_irq.assert_called_once_with(timer.comparators[0])
+
+  # nothing to wait for
+  task.run()
+  assert M.clock.now() == 50000
+
+def test_fast_forward_suspend():
+  M, timer = common_virtual_case()
+  core = M.cores[0]
+  task = M.clock.fast_forward_task
+
+  assert task in M.reactor.runnable_tasks
+
+  # idle core, no deadline - task suspends itself
+  core.idle = True
+  task.run()
+  assert task not in M.reactor.runnable_tasks
+  assert M.clock.now() == 0
+
+  # armed deadline wakes the task up
+  arm(timer, 0, 50000, TIMER_ENABLED)
+  assert task in M.reactor.runnable_tasks
+
+  task.run()
+  assert M.clock.now() == 50000
+
+  timer.timer_task.run()
+
+  task.run()
+  assert task not in M.reactor.runnable_tasks
+
+  # core going idle wakes the task up
+  core.change_runnable_state(idle = False)
+  assert task not in M.reactor.runnable_tasks
+
+  core.change_runnable_state(idle = True)
+  assert task in M.reactor.runnable_tasks
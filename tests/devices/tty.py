@@ -0,0 +1,85 @@
+import ducky.config
+import ducky.devices.tty
+import ducky.streams
+
+from .. import common_run_machine, LOGGER, mock
+
+from hypothesis import given
+from hypothesis.strategies import binary
+
+def common_case():
+  machine_config = ducky.config.MachineConfig()
+  section_backend = machine_config.add_device('output', 'ducky.devices.tty.Backend')
+  section_frontend = machine_config.add_device('output', 'ducky.devices.tty.Frontend')
+
+  machine_config.set(section_backend, 'master', section_frontend)
+  machine_config.set(section_frontend, 'slave', section_backend)
+
+  M = common_run_machine(machine_config = machine_config, post_setup = [lambda _M: False])
+
+  return M.get_device_by_name(section_frontend, 'output'), M.get_device_by_name(section_backend, klass = 'output')
+
+def test_sanity():
+  LOGGER.debug('----- ----- ----- ----- ----- ----- -----')
+  LOGGER.debug('TEST:')
+
+  common_case()
+
+@given(data = binary(min_size = 1, max_size = 1024))
+def test_flush_batch(data):
+  LOGGER.debug('----- ----- ----- ----- ----- ----- -----')
+  LOGGER.debug('TEST: data=%r', data)
+
+  frontend, backend = common_case()
+
+  stream = mock.MagicMock()
+  frontend.set_output(stream)
+  frontend.boot()
+
+  try:
+    for b in bytearray(data):
+      backend._mmio_page.write_u8(ducky.devices.tty.TTYPorts.DATA, b)
+
+    frontend._flush_task.run()
+
+    assert stream.write.call_count == 1
+    assert bytearray(stream.write.call_args[0][0]) == bytearray(data)
+    assert backend.comm_queue.is_empty_out()
+
+  finally:
+    frontend.halt()
+
+@given(data = binary(min_size = 0, max_size = 1024))
+def test_write_buffer(data):
+  LOGGER.debug('----- ----- ----- ----- ----- ----- -----')
+  LOGGER.debug('TEST: data=%r', data)
+
+  frontend, backend = common_case()
+  M = frontend.machine
+
+  stream = mock.MagicMock()
+  frontend.set_output(stream)
+  frontend.boot()
+
+  address = 0x1F0
+
+  try:
+    for i, b in enumerate(bytearray(data)):
+      M.memory.write_u8(address + i, b)
+
+    backend._mmio_page.write_u32(ducky.devices.tty.TTYPorts.BUFFER_ADDRESS, address)
+    backend._mmio_page.write_u32(ducky.devices.tty.TTYPorts.BUFFER_LENGTH, len(data))
+
+    assert bytearray(backend.comm_queue.queue_out) == bytearray(data)
+
+    frontend.flush()
+
+    if data:
+      assert stream.write.call_count == 1
+      assert bytearray(stream.write.call_args[0][0]) == bytearray(data)
+
+    else:
+      assert stream.write.call_count == 0
+
+  finally:
+    frontend.halt()
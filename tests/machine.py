@@ -0,0 +1,207 @@
+import os
+
+import ducky.config
+
+from ducky.boot import DEFAULT_BOOTLOADER_ADDRESS, MMapMemoryPage, SharedMemoryPage
+from ducky.devices.storage import BLOCK_SIZE
+from ducky.mm import AnonymousMemoryPage, PAGE_SIZE, PAGE_SHIFT
+from ducky.mm.binary import File, SectionFlags, SectionTypes
+
+from . import common_run_machine, prepare_file, mock, get_tempfile, LOGGER
+
+def test_fork():
+  f_tmp = prepare_file(BLOCK_SIZE * 4)
+
+  M = common_run_machine(storages = [('ducky.devices.storage.FileBackedStorage', 1, f_tmp.name)], post_setup = [lambda _M: False])
+
+  storage = M.get_storage_by_id(1)
+  storage.boot()
+
+  M.memory.write_u32(0x1000, 0xDEADBEEF)
+
+  pid = M.fork()
+
+  if pid == 0:
+    exit_code = 1
+
+    try:
+      assert M.memory.read_u32(0x1000) == 0xDEADBEEF
+
+      M.memory.write_u32(0x1000, 0x12345678)
+      storage.write_blocks(1, 1, bytearray([0x79] * BLOCK_SIZE))
+
+      assert bytearray(storage.read_blocks(0, 2)) == bytearray([0xDE] * BLOCK_SIZE + [0x79] * BLOCK_SIZE)
+
+      exit_code = 0
+
+    finally:
+      os._exit(exit_code)
+
+  assert M.wait_children() == [(pid, 0)]
+  assert M.children == []
+
+  assert M.memory.read_u32(0x1000) == 0xDEADBEEF
+
+  with open(f_tmp.name, 'rb') as f:
+    assert bytearray(f.read()) == bytearray([0xDE] * BLOCK_SIZE * 4)
+
+  storage.halt()
+
+def test_fork_pending_checkpoint():
+  M = common_run_machine(post_boot = [lambda _M: False])
+
+  f_tmp = get_tempfile()
+  f_tmp.close()
+
+  checkpoint = M.checkpoint(f_tmp.name)
+
+  pid = M.fork()
+
+  if pid == 0:
+    exit_code = 1
+
+    try:
+      assert M.checkpoints == []
+
+      M.halt()
+
+      exit_code = 0
+
+    finally:
+      os._exit(exit_code)
+
+  assert M.wait_children() == [(pid, 0)]
+  assert M.wait_checkpoints() == [(checkpoint, 0)]
+
+  M.halt()
+
+def common_halt_case(policy = None):
+  machine_config = ducky.config.MachineConfig()
+
+  if policy is not None:
+    machine_config.add_section('machine')
+    machine_config.set('machine', 'capture-state-on-halt', policy)
+
+  M = common_run_machine(machine_config = machine_config, post_boot = [lambda _M: False])
+
+  M.memory.write_u32(0x1000, 0xDEADBEEF)
+
+  with mock.patch.object(M.cpus[0], 'save_state') as save_state:
+    M.halt()
+
+  M.memory.write_u32(0x1000, 0x12345678)
+
+  return M, save_state
+
+def test_lazy_last_state():
+  M, save_state = common_halt_case()
+
+  assert save_state.call_count == 0
+
+  with mock.patch.object(M.cpus[0], 'save_state') as save_state:
+    pages = dict([(pg.index, pg) for pg in M.last_state.get_child('machine').get_child('memory').get_page_states()])
+
+    assert save_state.call_count == 0
+
+  assert pages[0x10].content[0:4] == bytearray([0x78, 0x56, 0x34, 0x12])
+
+def test_capture_state_always():
+  M, save_state = common_halt_case(policy = 'always')
+
+  assert save_state.call_count == 1
+
+  pages = dict([(pg.index, pg) for pg in M.last_state.get_child('machine').get_child('memory').get_page_states()])
+
+  assert pages[0x10].content[0:4] == bytearray([0xEF, 0xBE, 0xAD, 0xDE])
+
+def create_bootloader(mmapable_sections = False):
+  f_tmp = get_tempfile()
+  f_tmp.close()
+
+  text = bytearray([i % 256 for i in range(0, PAGE_SIZE + 44)])
+  data = bytearray([0x79] * 16)
+
+  with File.open(LOGGER, f_tmp.name, 'w') as f_out:
+    def __section(name, base, payload, **flags):
+      section = f_out.create_section(name = name)
+      section.header.name = f_out.string_table.put_string(name)
+      section.header.type = SectionTypes.PROGBITS
+      section.header.flags = SectionFlags.create(readable = True, loadable = True, **flags).to_encoding()
+      section.header.base = base
+      section.header.data_size = len(payload)
+      section.payload = payload
+
+    __section('.text', 0x0000, text, executable = True)
+    __section('.data', 0x0200, data, writable = True)
+
+    f_out.save(mmapable_sections = mmapable_sections)
+
+  return f_tmp.name, text, data
+
+def test_bootloader_mmap():
+  filepath, text, data = create_bootloader(mmapable_sections = True)
+
+  M = common_run_machine(binary = filepath, post_boot = [lambda _M: False])
+
+  os.unlink(filepath)
+
+  text_page = DEFAULT_BOOTLOADER_ADDRESS >> PAGE_SHIFT
+
+  assert isinstance(M.memory.pages[text_page], MMapMemoryPage)
+  assert isinstance(M.memory.pages[text_page + 1], MMapMemoryPage)
+  assert isinstance(M.memory.pages[text_page + 2], AnonymousMemoryPage)
+
+  assert M.memory.read_bytes(DEFAULT_BOOTLOADER_ADDRESS, PAGE_SIZE * 2) == text + bytearray(PAGE_SIZE - 44)
+  assert M.memory.read_bytes(DEFAULT_BOOTLOADER_ADDRESS + 0x0200, 16) == data
+
+  M.halt()
+
+def test_bootloader_shared():
+  filepath, text, data = create_bootloader()
+
+  M1 = common_run_machine(binary = filepath, post_boot = [lambda _M: False])
+  M2 = common_run_machine(binary = filepath, post_boot = [lambda _M: False])
+
+  os.unlink(filepath)
+
+  text_page = DEFAULT_BOOTLOADER_ADDRESS >> PAGE_SHIFT
+
+  for i in (text_page, text_page + 1):
+    assert isinstance(M1.memory.pages[i], SharedMemoryPage)
+    assert M1.memory.pages[i].data is M2.memory.pages[i].data
+
+  assert not isinstance(M1.memory.pages[text_page + 2], SharedMemoryPage)
+  assert M1.memory.pages[text_page + 2].data is not M2.memory.pages[text_page + 2].data
+
+  assert M1.memory.read_bytes(DEFAULT_BOOTLOADER_ADDRESS, PAGE_SIZE * 2) == text + bytearray(PAGE_SIZE - 44)
+
+  M1.memory.write_u32(DEFAULT_BOOTLOADER_ADDRESS, 0xDEADBEEF)
+
+  assert M1.memory.pages[text_page].shared is False
+  assert M1.memory.read_u32(DEFAULT_BOOTLOADER_ADDRESS) == 0xDEADBEEF
+  assert M2.memory.pages[text_page].shared is True
+  assert M2.memory.read_bytes(DEFAULT_BOOTLOADER_ADDRESS, PAGE_SIZE * 2) == text + bytearray(PAGE_SIZE - 44)
+
+  M1.halt()
+  M2.halt()
+
+def test_lazy_last_state_mmap():
+  filepath, text, data = create_bootloader(mmapable_sections = True)
+
+  M = common_run_machine(binary = filepath, post_boot = [lambda _M: False])
+
+  os.unlink(filepath)
+
+  text_page = DEFAULT_BOOTLOADER_ADDRESS >> PAGE_SHIFT
+
+  assert isinstance(M.memory.pages[text_page], MMapMemoryPage)
+
+  M.halt()
+
+  assert all(core.exit_code == 0 for core in M.cores)
+  assert text_page not in M.memory.pages
+
+  pages = dict([(pg.index, pg) for pg in M.last_state.get_child('machine').get_child('memory').get_page_states()])
+
+  assert pages[text_page].content == text[0:PAGE_SIZE]
+  assert pages[text_page + 1].content == text[PAGE_SIZE:] + bytearray(PAGE_SIZE - 44)
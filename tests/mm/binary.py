@@ -1,7 +1,8 @@
 import os
 
 from ducky.mm import MalformedBinaryError
-from ducky.mm.binary import File, SectionFlags
+from ducky.mm.binary import File, SectionFlags, SectionTypes, SymbolEntry, RelocEntry
+from ducky.util import SymbolTable
 
 from .. import get_tempfile, LOGGER
 
@@ -44,3 +45,89 @@ def test_bad_section_type_save():
 
     finally:
       os.unlink(tmp.name)
+
+def test_symbol_table():
+  tmp = get_tempfile()
+  tmp.close()
+
+  with File.open(LOGGER, tmp.name, 'w') as f_out:
+    text = f_out.create_section(name = '.text')
+    text.header.type = SectionTypes.PROGBITS
+
+    data = f_out.create_section(name = '.data')
+    data.header.type = SectionTypes.PROGBITS
+
+    symtab = f_out.create_section(name = '.symtab')
+    symtab.header.type = SectionTypes.SYMBOLS
+
+    def __symbol(section, name, address, size = 0):
+      entry = SymbolEntry()
+      entry.section = section.index
+      entry.name = f_out.string_table.put_string(name)
+      entry.address = address
+      entry.size = size
+      symtab.payload.append(entry)
+
+    __symbol(text, 'foo', 0x1000)
+    __symbol(text, 'bar', 0x1010)
+    __symbol(data, 'baz', 0x2000, size = 4)
+
+    symbols = SymbolTable(f_out)
+
+    assert symbols[0x0FFC] == (None, 0)
+    assert symbols[0x1000] == ('foo', 0)
+    assert symbols[0x100C] == ('foo', 0x0C)
+    assert symbols[0x1010] == ('bar', 0)
+    assert symbols[0x1FFC] == ('bar', 0x0FEC)
+    assert symbols[0x2002] == ('baz', 2)
+    assert symbols[0x2004] == (None, 0)
+    assert symbols.get_symbol('baz').address == 0x2000
+
+    symbols = SymbolTable(f_out, section_filter = lambda section: section.index == data.index)
+
+    assert symbols[0x1000] == (None, 0)
+    assert symbols[0x2000] == ('baz', 0)
+
+  os.unlink(tmp.name)
+
+def test_tables():
+  tmp = get_tempfile()
+  tmp.close()
+
+  with File.open(LOGGER, tmp.name, 'w') as f_out:
+    symtab = f_out.create_section(name = '.symtab')
+    symtab.header.name = f_out.string_table.put_string('.symtab')
+    symtab.header.type = SectionTypes.SYMBOLS
+    symtab.header.flags = SectionFlags.create().to_encoding()
+
+    reloc = f_out.create_section(name = '.reloc')
+    reloc.header.name = f_out.string_table.put_string('.reloc')
+    reloc.header.type = SectionTypes.RELOC
+    reloc.header.flags = SectionFlags.create().to_encoding()
+
+    for i in range(0, 100):
+      entry = SymbolEntry()
+      entry.name = f_out.string_table.put_string('symbol_%i' % i)
+      entry.address = i * 4
+      entry.size = 4
+      symtab.payload.append(entry)
+
+      entry = RelocEntry()
+      entry.name = i
+      entry.patch_address = i * 8
+      entry.patch_size = 16
+      reloc.payload.append(entry)
+
+    f_out.save()
+
+  with File.open(LOGGER, tmp.name, 'r') as f_in:
+    symtab = f_in.get_section_by_name('.symtab')
+    reloc = f_in.get_section_by_name('.reloc')
+
+    assert len(symtab.payload) == 100
+    assert len(reloc.payload) == 100
+
+    assert [(f_in.string_table.get_string(entry.name), entry.address, entry.size) for entry in symtab.payload] == [('symbol_%i' % i, i * 4, 4) for i in range(0, 100)]
+    assert [(entry.name, entry.patch_address, entry.patch_size) for entry in reloc.payload] == [(i, i * 8, 16) for i in range(0, 100)]
+
+  os.unlink(tmp.name)
@@ -0,0 +1,136 @@
+import ducky.profiler
+
+from . import get_tempfile, mock
+
+def test_aggregation():
+  core = mock.MagicMock()
+  core.instruction_set.instruction_set_id = 0
+
+  profiler = ducky.profiler.RealCPUCoreProfiler(core, frequency = 4)
+  profiler.enable()
+
+  for i in range(0, 4000):
+    core.current_ip = 0x1000 + (i % 2) * 4
+    profiler.take_sample()
+
+  assert sorted(profiler.counts.keys()) == [(0, 0x1000), (0, 0x1004)]
+  assert 500 < sum(profiler.counts.values()) < 1500
+
+def test_dump():
+  core = mock.MagicMock()
+
+  profiler = ducky.profiler.RealCPUCoreProfiler(core)
+  profiler.counts[(0, 0x1000)] = 79
+  profiler.counts[(1, 0x2000)] = 0x100000000
+
+  f = get_tempfile()
+  f.close()
+
+  profiler.dump_stats(f.name)
+
+  entries = sorted([(entry.instruction_set_id, entry.ip, entry.count) for entry in ducky.profiler.read_profile(f.name, chunk_size = 1)])
+
+  assert entries == [(0, 0x1000, 79), (1, 0x2000, 0x100000000)]
+
+def test_callgraph():
+  from ducky.cpu import StackFrame
+  from ducky.cpu.registers import Registers
+
+  core = mock.MagicMock()
+  core.jit = False
+  core.frames = []
+  core.registers = [0x100] * len(Registers)
+  core.instruction_set.instruction_set_id = 0
+
+  def __frame(ip):
+    frame = StackFrame(0, 0)
+    frame.IP = ip
+    return frame
+
+  profiler = ducky.profiler.RealCPUCoreCallGraphProfiler(core)
+  profiler.enable()
+
+  # root executes 2 instructions, the second one is a call
+  profiler.take_sample()
+  core.frames.append(__frame(0x200))
+  profiler.take_sample()
+
+  # 0x200 executes 3 instructions, calls 0x300 which executes 2 instructions, including ret
+  profiler.take_sample()
+  profiler.take_sample()
+  core.frames.append(__frame(0x300))
+  profiler.take_sample()
+  profiler.take_sample()
+  core.frames.pop(-1)
+  profiler.take_sample()
+
+  # 0x200 returns
+  core.frames.pop(-1)
+  profiler.take_sample()
+
+  # root calls 0x300 directly
+  core.frames.append(__frame(0x300))
+  profiler.take_sample()
+  core.frames.pop(-1)
+  profiler.take_sample()
+
+  f = get_tempfile()
+  f.close()
+
+  profiler.dump_stats(f.name)
+
+  from ducky.tools.profile import is_callgraph_profile, read_callgraph_data
+
+  assert is_callgraph_profile(f.name) is True
+
+  data = read_callgraph_data(mock.MagicMock(), [f.name])
+
+  assert dict(data) == {
+    (0x100,): 3,
+    (0x100, 0x200): 4,
+    (0x100, 0x200, 0x300): 2,
+    (0x100, 0x300): 1
+  }
+
+def test_read_profiling_data():
+  import pickle
+
+  from ducky.tools.profile import read_profiling_data
+
+  core = mock.MagicMock()
+
+  profiler = ducky.profiler.RealCPUCoreProfiler(core)
+  profiler.counts[(0, 0x1000)] = 79
+
+  f = get_tempfile()
+  f.close()
+
+  profiler.dump_stats(f.name)
+
+  assert read_profiling_data(mock.MagicMock(), [f.name])[0x1000].count == 79
+
+  # truncated binary profile is reported, not passed to pickle
+  with open(f.name, 'rb') as f_in:
+    content = f_in.read()
+
+  with open(f.name, 'wb') as f_out:
+    f_out.write(content[:-4])
+
+  try:
+    read_profiling_data(mock.MagicMock(), [f.name])
+
+  except ValueError:
+    pass
+
+  else:
+    assert False, 'ValueError not raised'
+
+  # older, pickled profiles are still accepted
+  record = ducky.profiler.ProfileRecord()
+  record.ip = 0x2000
+  record.count = 13
+
+  with open(f.name, 'wb') as f_out:
+    pickle.dump({0x2000: record}, f_out)
+
+  assert read_profiling_data(mock.MagicMock(), [f.name])[0x2000].count == 13
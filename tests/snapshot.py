@@ -0,0 +1,269 @@
+import os
+
+import ducky.config
+import ducky.snapshot
+
+from ducky.cpu.registers import Registers
+from ducky.snapshot import CoreDumpFile, SnapshotHeader, CHUNK_PAGES
+
+from . import common_run_machine, get_tempfile, LOGGER
+
+def common_case(compression = None):
+  M = common_run_machine(post_setup = [lambda _M: False])
+
+  M.memory.write_u32(0x1000, 0xDEADBEEF)
+  M.memory.write_u8(0x20000 + 0xFF, 0x79)
+
+  M.cpus[0].cores[0].registers[Registers.R05] = 0x12345678
+
+  state = M.capture_state()
+
+  f = get_tempfile()
+  f.close()
+
+  state.save(f.name, compression = compression)
+
+  return M, state, f.name
+
+def check_state(M, state, filename):
+  with CoreDumpFile.open(LOGGER, filename, 'r') as f_in:
+    loaded = f_in.load()
+
+  machine_state = loaded.get_child('machine')
+  assert machine_state.nr_cpus == M.nr_cpus
+
+  core_state = machine_state.get_cpu_state_by_id(0).get_core_state_by_id(0)
+  assert core_state.registers[Registers.R05] == 0x12345678
+
+  pages = dict([(pg.index, pg) for pg in machine_state.get_child('memory').get_page_states()])
+
+  assert sorted(pages.keys()) == sorted([pg.index for pg in state.get_child('machine').get_child('memory').get_page_states()])
+  assert pages[0x10].content[0:4] == bytearray([0xEF, 0xBE, 0xAD, 0xDE])
+  assert pages[0x200].content[0xFF] == 0x79
+
+  return loaded
+
+def test_sanity():
+  LOGGER.debug('----- ----- ----- ----- ----- ----- -----')
+  LOGGER.debug('TEST:')
+
+  common_case()
+
+def test_header():
+  M, state, filename = common_case()
+
+  with open(filename, 'rb') as f_in:
+    header = SnapshotHeader.from_buffer_copy(f_in.read(12))
+
+  assert header.magic == CoreDumpFile.MAGIC
+  assert header.version == CoreDumpFile.VERSION
+
+def test_uncompressed():
+  M, state, filename = common_case()
+
+  check_state(M, state, filename)
+
+def test_zlib():
+  M, state, filename = common_case(compression = 'zlib')
+
+  check_state(M, state, filename)
+
+def test_lzma():
+  if ducky.snapshot.lzma is None:
+    return
+
+  M, state, filename = common_case(compression = 'lzma')
+
+  check_state(M, state, filename)
+
+def test_lazy_pages():
+  M, state, filename = common_case(compression = 'zlib')
+
+  with CoreDumpFile.open(LOGGER, filename, 'r') as f_in:
+    loaded = f_in.load()
+
+  pages = loaded.get_child('machine').get_child('memory').get_page_states()
+
+  assert all(pg._content is None for pg in pages)
+
+  pg = [pg for pg in pages if pg.index == 0x10][0]
+  assert pg.content[0] == 0xEF
+
+  assert pg._content is not None
+  assert len(pg._loader.chunks) == 1
+
+def test_chunks():
+  M, state, filename = common_case()
+
+  with CoreDumpFile.open(LOGGER, filename, 'r') as f_in:
+    loaded = f_in.load()
+
+  pages = loaded.get_child('machine').get_child('memory').get_page_states()
+  loader = pages[0]._loader
+
+  for entry in loader.entries:
+    assert 0 < entry.pages_cnt <= CHUNK_PAGES
+
+  assert sum(entry.pages_cnt for entry in loader.entries) == len(pages)
+
+def test_dirty_pages():
+  M = common_run_machine(post_setup = [lambda _M: False])
+
+  M.capture_state()
+  assert not M.memory.dirty_pages
+
+  M.memory.write_u8(0x1000, 0x79)
+  M.memory.write_u32(0x20010, 0xDEADBEEF)
+
+  assert sorted(M.memory.dirty_pages) == [0x10, 0x200]
+
+  state = M.capture_state(parent = 'full.snapshot')
+
+  assert state.parent == 'full.snapshot'
+  assert sorted([pg.index for pg in state.get_child('machine').get_child('memory').get_page_states()]) == [0x10, 0x200]
+  assert not M.memory.dirty_pages
+
+def test_flatten():
+  M = common_run_machine(post_setup = [lambda _M: False])
+
+  M.memory.write_u8(0x1000, 0x79)
+  M.memory.write_u8(0x2000, 0x80)
+
+  f_full = get_tempfile()
+  f_full.close()
+
+  M.capture_state().save(f_full.name)
+
+  M.memory.write_u8(0x1000, 0x81)
+
+  f_incremental = get_tempfile()
+  f_incremental.close()
+
+  M.capture_state(parent = os.path.basename(f_full.name)).save(f_incremental.name, compression = 'zlib')
+
+  with CoreDumpFile.open(LOGGER, f_incremental.name, 'r') as f_in:
+    assert len(f_in.load().get_child('machine').get_child('memory').get_page_states()) == 1
+
+  state = ducky.snapshot.flatten_snapshot(LOGGER, f_incremental.name)
+
+  assert state.parent is None
+
+  pages = dict([(pg.index, pg) for pg in state.get_child('machine').get_child('memory').get_page_states()])
+
+  assert sorted(pages.keys()) == sorted([pg.index for pg in M.capture_state().get_child('machine').get_child('memory').get_page_states()])
+  assert pages[0x10].content[0] == 0x81
+  assert pages[0x20].content[0] == 0x80
+
+def test_restore():
+  def create_machine():
+    machine_config = ducky.config.MachineConfig()
+    machine_config.add_device('rtc', 'ducky.devices.rtc.RTC', frequency = 20)
+    machine_config.add_device('timer', 'ducky.devices.timer.Timer')
+
+    M = common_run_machine(machine_config = machine_config, post_setup = [lambda _M: False])
+
+    for dev in list(M.devices['rtc'].values()) + list(M.devices['timer'].values()):
+      dev.boot()
+
+    return M
+
+  M = create_machine()
+  core = M.cpus[0].cores[0]
+  rtc = list(M.devices['rtc'].values())[0]
+  timer = list(M.devices['timer'].values())[0]
+
+  M.memory.write_u32(0x1000, 0xDEADBEEF)
+  core.registers[Registers.R05] = 0x12345678
+  core.registers[Registers.IP] = 0x1000
+  core.instruction_set_stack = [ducky.cpu.instructions.DuckyInstructionSet]
+
+  rtc.frequency = 50
+  timer.comparators[1].interval = 1000
+  timer.comparators[1].set_flags(ducky.devices.timer.TIMER_ENABLED)
+
+  M.trigger_irq(rtc)
+
+  f = get_tempfile()
+  f.close()
+
+  M.capture_state().save(f.name, compression = 'zlib')
+
+  M2 = create_machine()
+  core2 = M2.cpus[0].cores[0]
+  rtc2 = list(M2.devices['rtc'].values())[0]
+  timer2 = list(M2.devices['timer'].values())[0]
+
+  M2.load_state(ducky.snapshot.flatten_snapshot(LOGGER, f.name).get_child('machine'))
+
+  assert M2.memory.read_u32(0x1000) == 0xDEADBEEF
+  assert core2.registers[Registers.R05] == 0x12345678
+  assert core2.current_ip == 0x1000
+  assert core2.instruction_set_stack == [ducky.cpu.instructions.DuckyInstructionSet]
+
+  assert rtc2.frequency == 50
+  assert timer2.comparators[1].deadline == timer.comparators[1].deadline
+  assert timer2.deadline == timer.deadline
+
+  assert M2.irq_router_task.queue[rtc.irq] is True
+  assert M2.clock.now() >= M.last_state.get_child('machine').clock
+  assert not M2.memory.dirty_pages
+
+def test_checkpoint():
+  M = common_run_machine(post_setup = [lambda _M: False])
+
+  M.memory.write_u32(0x1000, 0xDEADBEEF)
+
+  f = get_tempfile()
+  f.close()
+
+  pid = M.checkpoint(f.name, compression = 'zlib')
+
+  assert M.checkpoints == [pid]
+  assert not M.memory.dirty_pages
+
+  # modifications made while the checkpoint is being saved must not leak into it
+  M.memory.write_u32(0x1000, 0x12345678)
+
+  assert M.wait_checkpoints() == [(pid, 0)]
+  assert M.checkpoints == []
+
+  with CoreDumpFile.open(LOGGER, f.name, 'r') as f_in:
+    pages = dict([(pg.index, pg) for pg in f_in.load().get_child('machine').get_child('memory').get_page_states()])
+
+  assert pages[0x10].content[0:4] == bytearray([0xEF, 0xBE, 0xAD, 0xDE])
+  assert M.memory.read_u32(0x1000) == 0x12345678
+
+def test_flatten_freed_page():
+  M = common_run_machine(post_setup = [lambda _M: False])
+
+  M.memory.write_u8(0x1000, 0x79)
+  M.memory.write_u8(0x2000, 0x80)
+
+  f_full = get_tempfile()
+  f_full.close()
+
+  M.capture_state().save(f_full.name)
+
+  M.memory.write_u8(0x1000, 0x81)
+
+  f_first = get_tempfile()
+  f_first.close()
+
+  M.capture_state(parent = os.path.basename(f_full.name)).save(f_first.name)
+
+  M.memory.free_page(M.memory.get_page(0x20))
+
+  f_second = get_tempfile()
+  f_second.close()
+
+  M.capture_state(parent = os.path.basename(f_first.name)).save(f_second.name)
+
+  state = ducky.snapshot.flatten_snapshot(LOGGER, f_second.name)
+  memory_state = state.get_child('machine').get_child('memory')
+
+  pages = dict([(pg.index, pg) for pg in memory_state.get_page_states()])
+
+  assert sorted(pages.keys()) == sorted([pg.index for pg in M.capture_state().get_child('machine').get_child('memory').get_page_states()])
+  assert 0x20 not in pages
+  assert pages[0x10].content[0] == 0x81
+  assert memory_state.live_pages is None
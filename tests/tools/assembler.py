@@ -0,0 +1,88 @@
+import importlib
+import logging
+import os
+import tempfile
+
+from ducky.asm import AssemblerProcess
+from ducky.log import create_logger
+
+from .. import tmp_dir, mock, LOGGER
+
+as_tool = importlib.import_module('ducky.tools.as')
+
+SOURCES = [
+  '  .text\nfoo:\n  li r0, 0x10\n  ret\n',
+  '  .text\nbar:\n  li r1, 0x20\n  ret\n',
+  '  .data\nbaz:\n  .word 0x79\n'
+]
+
+def create_sources(directory):
+  files = []
+
+  for i, source in enumerate(SOURCES):
+    file_in = os.path.join(directory, 'source-%i.s' % i)
+
+    with open(file_in, 'w') as f:
+      f.write(source)
+
+    files.append((file_in, os.path.join(directory, 'source-%i.o' % i)))
+
+  return files
+
+def read_objects(files):
+  objects = []
+
+  for _, file_out in files:
+    with open(file_out, 'rb') as f:
+      objects.append(f.read())
+
+  return objects
+
+def test_parallel():
+  create_logger(level = logging.DEBUG)
+
+  directory = tempfile.mkdtemp(dir = tmp_dir())
+  files = create_sources(directory)
+
+  options, _ = as_tool.create_option_parser().parse_args(['-f'])
+  assert as_tool.assemble_files(LOGGER, files, options) is True
+  serial = read_objects(files)
+
+  options, _ = as_tool.create_option_parser().parse_args(['-f', '-j', '2'])
+  assert as_tool.assemble_files(LOGGER, files, options) is True
+  assert read_objects(files) == serial
+
+def test_object_cache():
+  create_logger(level = logging.DEBUG)
+
+  directory = tempfile.mkdtemp(dir = tmp_dir())
+  files = create_sources(directory)
+  cache_dir = os.path.join(directory, 'cache')
+
+  options, _ = as_tool.create_option_parser().parse_args(['-f', '--cache-dir', cache_dir])
+
+  original_parse = AssemblerProcess.parse
+
+  def __assemble():
+    with mock.patch.object(AssemblerProcess, 'parse', autospec = True, side_effect = original_parse) as parse:
+      assert as_tool.assemble_files(LOGGER, files, options) is True
+
+    return parse.call_count, read_objects(files)
+
+  translated, objects = __assemble()
+  assert translated == len(SOURCES)
+  assert len(os.listdir(cache_dir)) == len(SOURCES)
+
+  assert __assemble() == (0, objects)
+
+  with open(files[1][0], 'w') as f:
+    f.write(SOURCES[1].replace('0x20', '0x21'))
+
+  translated, changed_objects = __assemble()
+  assert translated == 1
+  assert changed_objects[0] == objects[0] and changed_objects[1] != objects[1]
+  assert len(os.listdir(cache_dir)) == len(SOURCES) + 1
+
+  # Different defines lead to different objects
+  options.defines = ['FOO']
+  assert __assemble()[0] == len(SOURCES)
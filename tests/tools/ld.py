@@ -0,0 +1,228 @@
+import logging
+import os
+import tarfile
+
+from ducky.errors import UnknownSymbolError
+from ducky.log import create_logger
+from ducky.mm.binary import File, SectionFlags, SectionTypes, SymbolEntry, SymbolFlags, RelocEntry, RelocFlags
+from ducky.tools.ld import archive_files, link_files, merge_object_into, patch_relocation, resolve_file_symbols, Archive, LinkerInfo, LinkerScript, RelocationPatcher, ARCHIVE_INDEX
+from ducky.util import SymbolTable
+
+from .. import get_tempfile, mock, LOGGER
+
+def create_object(symbols, references = None, path = None):
+  if path is None:
+    tmp = get_tempfile()
+    tmp.close()
+
+    path = tmp.name
+
+  references = references or []
+
+  with File.open(LOGGER, path, 'w') as f_out:
+    def __section(name, typ, flags):
+      section = f_out.create_section(name = name)
+      section.header.name = f_out.string_table.put_string(name)
+      section.header.type = typ
+      section.header.flags = flags.to_encoding()
+      return section
+
+    text = __section('.text', SectionTypes.PROGBITS, SectionFlags.create(readable = True, executable = True, loadable = True))
+    text.payload = bytearray(4 * len(symbols))
+    text.header.data_size = len(text.payload)
+
+    symtab = __section('.symtab', SectionTypes.SYMBOLS, SectionFlags.create())
+
+    for i, name in enumerate(symbols):
+      entry = SymbolEntry()
+      entry.flags = SymbolFlags.create(globally_visible = True).to_encoding()
+      entry.name = f_out.string_table.put_string(name)
+      entry.filename = f_out.string_table.put_string(path)
+      entry.address = i * 4
+      entry.section = text.index
+      symtab.payload.append(entry)
+
+    if references:
+      reloc = __section('.reloc', SectionTypes.RELOC, SectionFlags.create())
+
+    for i, name in enumerate(references):
+      entry = RelocEntry()
+      entry.flags = RelocFlags.create().to_encoding()
+      entry.name = f_out.string_table.put_string(name)
+      entry.patch_section = text.index
+      entry.patch_address = i * 4
+      entry.patch_size = 16
+      reloc.payload.append(entry)
+
+    f_out.save()
+
+  return path
+
+def test_archive_index():
+  foo = create_object(['foo'])
+  bar = create_object(['bar', 'baz'])
+
+  archive = get_tempfile()
+  archive.close()
+
+  archive_files(LOGGER, [foo, bar], archive.name)
+
+  with tarfile.open(archive.name, 'r:gz') as f_in:
+    assert f_in.getnames()[0] == ARCHIVE_INDEX
+
+  archive = Archive(LOGGER, archive.name)
+
+  assert sorted(archive.index.keys()) == ['bar', 'baz', 'foo']
+  assert archive.pull(['bar', 'unknown']) == archive.loaded_members()
+  assert [f_in.name for f_in in archive.loaded_members()] == ['%s(%s)' % (archive.path, archive.index['baz'])]
+  assert archive.pull(['baz']) == []
+
+  archive.close()
+
+  for filename in (foo, bar, archive.path):
+    os.unlink(filename)
+
+def test_link_archive():
+  # linker expects logger with a table support, created by tools
+  create_logger(level = logging.DEBUG)
+
+  main = create_object(['main'], references = ['foo'])
+  foo = create_object(['foo'])
+  bar = create_object(['bar'])
+
+  archive = get_tempfile()
+  archive.close()
+  os.unlink(archive.name)
+
+  archive = archive.name + '.tgz'
+
+  archive_files(LOGGER, [bar, foo], archive)
+
+  script = get_tempfile()
+  script.write(b"[('.text', ['.text'])]")
+  script.close()
+
+  binary = get_tempfile()
+  binary.close()
+
+  link_files(LinkerInfo(LinkerScript(script.name)), [main, archive], binary.name)
+
+  with File.open(LOGGER, binary.name, 'r') as f_in:
+    symbols = SymbolTable(f_in)
+
+    assert symbols.get_symbol('main').address == 0x0000
+    assert symbols.get_symbol('foo').address == 0x0004
+    assert 'bar' not in symbols
+
+    assert f_in.get_section_by_name('.text').payload == bytearray([0x04, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+
+  for filename in (main, foo, bar, archive, script.name, binary.name):
+    os.unlink(filename)
+
+def test_incremental_link():
+  create_logger(level = logging.DEBUG)
+
+  main = create_object(['main'], references = ['foo'])
+  foo = create_object(['pad', 'foo'])
+  bar = create_object(['bar'])
+
+  script = get_tempfile()
+  script.write(b"[('.text', ['.text'])]")
+  script.close()
+
+  binary = get_tempfile()
+  binary.close()
+
+  full_binary = get_tempfile()
+  full_binary.close()
+
+  def __link(path, incremental = True):
+    with mock.patch('ducky.tools.ld.RelocationPatcher', side_effect = RelocationPatcher) as patcher:
+      link_files(LinkerInfo(LinkerScript(script.name)), [main, foo, bar], path, incremental = incremental)
+
+    with open(path, 'rb') as f:
+      return patcher.call_count, f.read()
+
+  def __relink():
+    patches, content = __link(binary.name)
+
+    assert content == __link(full_binary.name, incremental = False)[1]
+
+    return patches, content
+
+  patches, content = __relink()
+  assert patches == 1
+  assert os.path.exists(binary.name + '.map')
+
+  # Nothing changed
+  assert __relink() == (0, content)
+
+  # Unreferenced symbol changed
+  create_object(['baz'], path = bar)
+  assert __relink()[0] == 0
+
+  # Referenced symbol moved, reference from unchanged file must be patched
+  create_object(['foo', 'pad'], path = foo)
+  assert __relink()[0] == 1
+
+  with File.open(LOGGER, binary.name, 'r') as f_in:
+    assert SymbolTable(f_in).get_symbol('foo').address == 0x0004
+    assert f_in.get_section_by_name('.text').payload[0:4] == bytearray([0x04, 0x00, 0x00, 0x00])
+
+  # Section does not fit anymore, full link
+  create_object(['foo', 'pad', 'more'], path = foo)
+  assert __relink()[0] == 1
+
+  # Referenced symbol removed, incremental link must fail just like the full one
+  create_object(['pad', 'bar'], path = foo)
+
+  for incremental in (False, True):
+    try:
+      __link(binary.name if incremental else full_binary.name, incremental = incremental)
+
+    except UnknownSymbolError:
+      pass
+
+    else:
+      assert False, 'UnknownSymbolError not raised'
+
+  for filename in (main, foo, bar, script.name, binary.name, binary.name + '.map', full_binary.name):
+    os.unlink(filename)
+
+def test_incremental_link_unchanged_inputs():
+  create_logger(level = logging.DEBUG)
+
+  main = create_object(['main', 'main_end'], references = ['foo', 'bar'])
+  foo = create_object(['foo', 'pad'])
+  bar = create_object(['bar'], references = ['main'])
+
+  script = get_tempfile()
+  script.write(b"[('.text', ['.text'])]")
+  script.close()
+
+  binary = get_tempfile()
+  binary.close()
+
+  def __link():
+    with mock.patch('ducky.tools.ld.merge_object_into', side_effect = merge_object_into) as merge, \
+         mock.patch('ducky.tools.ld.resolve_file_symbols', side_effect = resolve_file_symbols) as resolve, \
+         mock.patch('ducky.tools.ld.patch_relocation', side_effect = patch_relocation) as patch:
+      link_files(LinkerInfo(LinkerScript(script.name)), [main, foo, bar], binary.name, incremental = True)
+
+    return merge.call_count, [args[0][2].name for args in resolve.call_args_list], patch.call_count
+
+  assert __link() == (3, [main, foo, bar], 3)
+
+  # Only symbols of the changed input are resolved, and only the relocation
+  # referring to its symbol is visited
+  create_object(['pad', 'foo'], path = foo)
+  assert __link() == (0, [foo], 1)
+
+  with File.open(LOGGER, binary.name, 'r') as f_in:
+    symbols = SymbolTable(f_in)
+
+    assert symbols.get_symbol('foo').address == 0x000C
+    assert f_in.get_section_by_name('.text').payload[0:8] == bytearray([0x0C, 0x00, 0x00, 0x00, 0x10, 0x00, 0x00, 0x00])
+
+  for filename in (main, foo, bar, script.name, binary.name, binary.name + '.map'):
+    os.unlink(filename)
@@ -0,0 +1,72 @@
+import importlib
+import logging
+import os
+import tempfile
+
+from ducky.asm.disassembler import disassemble_section, split_chunks
+from ducky.cpu.coprocessor.math_copro import MathCoprocessorInstructionSet
+from ducky.cpu.instructions import DuckyInstructionSet
+from ducky.log import create_logger
+from ducky.mm.binary import File
+
+from .. import tmp_dir, LOGGER
+
+as_tool = importlib.import_module('ducky.tools.as')
+
+SOURCE = '''  .text
+  .global main
+main:
+  li r0, 0x10
+  la r1, foo
+  nop
+  sis 1
+  pushl
+  sis 0
+loop:
+  inc r0
+  j loop
+'''
+
+def create_binary():
+  directory = tempfile.mkdtemp(dir = tmp_dir())
+
+  file_in, file_out = os.path.join(directory, 'test.s'), os.path.join(directory, 'test.o')
+
+  with open(file_in, 'w') as f:
+    f.write(SOURCE)
+
+  options, _ = as_tool.create_option_parser().parse_args([])
+  assert as_tool.assemble_file(LOGGER, file_in, file_out, options) is True
+
+  return file_out
+
+def test_split_chunks():
+  create_logger(level = logging.DEBUG)
+
+  with File.open(LOGGER, create_binary(), 'r') as f_in:
+    chunks = split_chunks(f_in.get_section_by_name('.text').payload, 2)
+
+  assert [instruction_set_id for _, _, instruction_set_id in chunks] == [
+    DuckyInstructionSet.instruction_set_id,
+    DuckyInstructionSet.instruction_set_id,
+    MathCoprocessorInstructionSet.instruction_set_id,
+    DuckyInstructionSet.instruction_set_id
+  ]
+
+def test_disassemble():
+  create_logger(level = logging.DEBUG)
+
+  with File.open(LOGGER, create_binary(), 'r') as f_in:
+    section = f_in.get_section_by_name('.text')
+
+    chunks = list(disassemble_section(LOGGER, f_in, section, chunk_size = 3))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 2]
+
+    instructions = sum(chunks, [])
+
+    assert [inst.address for inst in instructions] == list(range(section.header.base, section.header.base + 32, 4))
+    assert [inst.disassembly.split(' ')[0] for inst in instructions] == ['li', 'la', 'nop', 'sis', 'pushl', 'sis', 'inc', 'j']
+    assert [inst.symbol for inst in instructions] == ['main'] * 6 + ['loop'] * 2
+    assert [inst.relocations for inst in instructions] == [[], ['foo'], [], [], [], [], [], []]
+
+    assert list(disassemble_section(LOGGER, f_in, section, chunk_size = 1, jobs = 2)) == [[inst] for inst in instructions]